@@ -2,23 +2,180 @@
 
 import configparser
 import argparse
+import contextlib
+import io
 import logging
+import os
+import sys
+import threading
+from github.cache import RepositoryCache
+from github.cassette import RecordingTransport, ReplayTransport
 from github.client import GitHubClient
-from automerge.utilities import auto_merge
+from github.scheduler import RequestScheduler
+from github.tracing import Tracer
+from automerge.journal import RunJournal
+from automerge.manifest import load_manifest, run_manifest, print_manifest_report
+from automerge.plan import MergePlan
+from automerge.service import BranchIndex, MergeService
+from automerge.shards import ShardCoordinator, ShardedRun, wait_for_shards, work_shards
+from automerge.stats import MergeStatistics
+from automerge.utilities import auto_merge, plan_merge
+
+# `AutoMerge.py plan ...` writes the merge plan for review, `AutoMerge.py apply --plan FILE` runs it
+# and `AutoMerge.py serve` runs AutoMerge as a service taking webhooks and merge requests over HTTP.
+# `AutoMerge.py coordinate --coordinator FILE ...` scans and splits a run into shards that any number
+# of `AutoMerge.py work --coordinator FILE` processes merge. `AutoMerge.py merge ...`, or no command
+# at all, scans and merges in one go
+def connection_options(defaults: bool) -> argparse.ArgumentParser:
+    # the options every command takes, before or after its name; only the top-level parser fills in their
+    # defaults, so a command's parser doesn't overwrite what was given before the command
+    options = argparse.ArgumentParser(add_help=False, allow_abbrev=False, argument_default=None if defaults else argparse.SUPPRESS)
+    default = (lambda value: value) if defaults else (lambda value: argparse.SUPPRESS)
+    options.add_argument('--token', help="GitHub API access token to be used. Overrides the default specified by config")
+    options.add_argument('--org', help="GitHub organization to perform the auto merge against. Overrides the default specified by config")
+    options.add_argument('--api_url', help="GitHub API base URL. Overrides the default specified by config (https://api.github.com)")
+    options.add_argument('--config_path', help="Optionally tell the script where to find the config file. By default it searches in the base directory")
+    options.add_argument('--scan_batch_size', type=int, default=default(100),
+        help="Number of repositories whose branches are looked up by id in one request (at most 100). Defaults to 100")
+    options.add_argument('--scan_concurrency', type=int, default=default(1),
+        help="Number of those lookups to run in parallel. Above 1 the scan lists repository ids first and then looks up "
+             "their branches in parallel instead of paging through the organization. Defaults to 1")
+    options.add_argument('--cache_dir',
+        help="Directory for the local repository inventory cache, journals and merge statistics. Defaults to ~/.automerge")
+    options.add_argument('--cache_ttl', type=float, default=default(24),
+        help="Hours before the cached repository inventory is rebuilt from a full listing. Defaults to 24")
+    options.add_argument('--cache_evict_after', type=float, default=default(30),
+        help="Days an organization's cached repository inventory is kept after the last run that used it. Defaults to 30")
+    options.add_argument('--no_cache', action='store_true', default=default(False),
+        help="Ignore the local repository inventory cache that scans with --scan_concurrency above 1 list repository ids from")
+    options.add_argument('--metrics_out', metavar='PREFIX',
+        help="Write a JSON trace of the run to PREFIX.json and Prometheus metrics to PREFIX.prom")
+    options.add_argument('--record', metavar='CASSETTE',
+        help="Write every GitHub request and response of the run, with the token scrubbed, to CASSETTE for --replay")
+    options.add_argument('--replay', metavar='CASSETTE',
+        help="Answer GitHub requests from a CASSETTE written by --record instead of the network. Merge statistics are not recorded")
+    options.add_argument('--replay_speed', type=float,
+        help="Serve replayed responses at their recorded latency divided by this (1 for recorded speed). Defaults to as fast as possible")
+    return options
+
+def branch_options(required: bool) -> argparse.ArgumentParser:
+    options = argparse.ArgumentParser(add_help=False)
+    note = '' if required else '. Not used with --manifest'
+    options.add_argument('base_branch', nargs=None if required else '?', help="Base branch for the merge (i.e. master)" + note)
+    options.add_argument('head_branch', nargs=None if required else '?', help="Branch to be merged into the base (i.e. REL-2910)" + note)
+    options.add_argument('--current_rel_branch',
+        help="If specified, will attempt to merge the base branch into the current release branch. This can be useful for OCRs")
+    return options
+
+merge_options = argparse.ArgumentParser(add_help=False)
+merge_options.add_argument('--batch_size', type=int, default=1,
+    help="Number of merges to send to GitHub in a single request. Defaults to 1 (one request per repository)")
+merge_options.add_argument('--concurrency', type=int, default=1,
+    help="Number of merge requests to run in parallel. Defaults to 1 (sequential)")
+merge_options.add_argument('--no_stats', action='store_true',
+    help="Don't read or record the merge times and failures kept under --cache_dir to start slow and likely-to-fail merges first")
+
+fast_forward_options = argparse.ArgumentParser(add_help=False)
+fast_forward_options.add_argument('--fast_forward', action='store_true',
+    help="Move the base branch to the head commit instead of creating a merge commit when the base has no commits the head lacks")
+
+journal_options = argparse.ArgumentParser(add_help=False)
+journal_options.add_argument('--journal',
+    help="File recording the plan and each repository's outcome as the run progresses. Defaults to a file per org and branches under --cache_dir")
+journal_options.add_argument('--resume', action='store_true',
+    help="Continue the run recorded in the journal, skipping the scan and every repository it already merged")
 
 parser = argparse.ArgumentParser(
     prog="AutoMerge",
-    description="Script for auto-merging branches across repositories within an organization"
+    description="Script for auto-merging branches across repositories within an organization",
+    parents=[connection_options(True)]
 )
-parser.add_argument('base_branch', help="Base branch for the merge (i.e. master)")
-parser.add_argument('head_branch', help="Branch to be merged into the base (i.e. REL-2910)")
-parser.add_argument('--current_rel_branch',
-    help="If specified, will attempt to merge the base branch into the current release branch. This can be useful for OCRs")
-parser.add_argument('--token', help="GitHub API access token to be used. Overrides the default specified by config")
-parser.add_argument('--org', help="GitHub organization to perform the auto merge against. Overrides the default specified by config")
-parser.add_argument('--config_path', help="Optionally tell the script where to find the config file. By default it searches in the base directory")
+# what commands without an option leave it at
+parser.set_defaults(base_branch=None, head_branch=None, current_rel_branch=None, batch_size=1, concurrency=1, no_stats=False,
+    fast_forward=False, journal=None, resume=False, manifest=None, parallel_jobs=1, webhook_secret=None, api_token=None, shards=1)
+commands = parser.add_subparsers(dest='command', metavar='COMMAND',
+    help="merge (the default when no command is given), plan, apply, serve, coordinate or work")
+
+command_parser = commands.add_parser('merge', help="Scan the organization and merge",
+    parents=[connection_options(False), branch_options(False), merge_options, fast_forward_options, journal_options])
+command_parser.add_argument('--manifest',
+    help="JSON, YAML or INI file listing the org, base, head and optional current_release of each merge job to run in this process")
+command_parser.add_argument('--parallel_jobs', type=int, default=4,
+    help="Number of independent manifest jobs to run at once. Defaults to 4")
+
+command_parser = commands.add_parser('plan', help="Scan the organization and write the merges it would make to a plan for review",
+    parents=[connection_options(False), branch_options(True)])
+command_parser.add_argument('--plan', metavar='FILE', default='automerge-plan.json',
+    help="File to write the merge plan to. Defaults to automerge-plan.json")
+
+command_parser = commands.add_parser('apply', help="Run the merges of a reviewed plan",
+    parents=[connection_options(False), merge_options, fast_forward_options, journal_options])
+command_parser.add_argument('--plan', metavar='FILE', required=True, help="Merge plan written by the plan command")
 
-args = parser.parse_args()
+command_parser = commands.add_parser('serve', help="Keep a branch index current from webhooks and run the merges requested over HTTP",
+    parents=[connection_options(False), merge_options])
+command_parser.add_argument('--host', default='127.0.0.1', help="Address to listen on. Defaults to 127.0.0.1. Any other than a loopback address needs a webhook secret")
+command_parser.add_argument('--port', type=int, default=8080, help="Port to listen on. Defaults to 8080")
+command_parser.add_argument('--branches', nargs='+', default=[],
+    help="Branches to index from the start. Others are indexed the first time a merge asks for them")
+command_parser.add_argument('--index',
+    help="File to save the branch index to and start from. Defaults to a file per org under --cache_dir")
+command_parser.add_argument('--reconcile_interval', type=float, default=60,
+    help="Minutes between rescans of the indexed branches. Defaults to 60")
+command_parser.add_argument('--webhook_secret',
+    help="Secret GitHub signs webhook deliveries with. Overrides the default specified by config")
+command_parser.add_argument('--api_token',
+    help="Bearer token required to queue merges and reconciliations. Defaults to the webhook secret. "
+         "Overrides the default specified by config")
+
+command_parser = commands.add_parser('coordinate', help="Scan the organization and split the merges into shards for work commands",
+    parents=[connection_options(False), branch_options(True), fast_forward_options])
+command_parser.add_argument('--coordinator', metavar='FILE', required=True,
+    help="SQLite file to split the run into, which work commands take their shards from. Must be reachable by every worker")
+command_parser.add_argument('--shards', type=int, default=4,
+    help="Number of shards to split the repositories to merge into. Defaults to 4")
+command_parser.add_argument('--lease', type=float, default=300,
+    help="Seconds a worker's claim on a shard lasts without renewal before another worker may take the shard over. Defaults to 300")
+
+command_parser = commands.add_parser('work', help="Merge shards of a run split up by the coordinate command",
+    parents=[connection_options(False), merge_options])
+command_parser.add_argument('--coordinator', metavar='FILE', required=True, help="SQLite file the coordinate command split the run into")
+command_parser.add_argument('--lease', type=float, default=300,
+    help="Seconds a claim on a shard lasts without renewal before another worker may take the shard over. Defaults to 300")
+command_parser.add_argument('--worker_id', help="Name to lease shards under. Defaults to HOST:PID")
+
+def fits(arguments: [str]) -> bool:
+    # whether the arguments make a runnable command, found without printing a usage error or exiting
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            args = parser.parse_args(arguments)
+    except SystemExit:
+        return False
+    return args.command != 'merge' or bool(args.manifest or args.head_branch)
+
+# the command is the first argument besides the options every command takes; without one, the run is a merge.
+# A base branch named like a command (`AutoMerge.py plan REL-1`) is a merge too, unless the command fits the rest
+(_, arguments) = connection_options(True).parse_known_args(sys.argv[1:])
+if set(arguments[:1]) & {'-h', '--help'}:
+    implied = []
+elif arguments and arguments[0] in commands.choices:
+    implied = ['merge'] if not fits(sys.argv[1:]) and fits(['merge'] + sys.argv[1:]) else []
+else:
+    implied = ['merge']
+args = parser.parse_args(implied + sys.argv[1:])
+command = args.command
+command_parser = commands.choices[command]
+
+if args.manifest and (args.base_branch or args.head_branch or args.current_rel_branch or args.journal):
+    command_parser.error('base_branch, head_branch, --current_rel_branch and --journal cannot be combined with --manifest')
+if args.shards < 1:
+    command_parser.error('--shards must be at least 1')
+if args.record and args.replay:
+    command_parser.error('--record and --replay cannot be combined')
+if not 1 <= args.scan_batch_size <= 100:
+    command_parser.error('--scan_batch_size must be between 1 and 100')
+if command == 'merge' and not args.manifest and not (args.base_branch and args.head_branch):
+    command_parser.error('base_branch and head_branch are required unless --manifest is given')
 
 head_branch = args.head_branch
 base_branch = args.base_branch
@@ -31,8 +188,11 @@ if args.config_path:
 else:
     config.read('config.ini')
 
-access_token = config['DEFAULT']['access_token']
-organization = config['DEFAULT']['organization']
+access_token = config['DEFAULT'].get('access_token', '')
+organization = config['DEFAULT'].get('organization', '')
+api_url = config['DEFAULT'].get('api_url', GitHubClient.default_api_url)
+webhook_secret = config['DEFAULT'].get('webhook_secret', '')
+api_token = config['DEFAULT'].get('api_token', '')
 
 if args.token:
     access_token = args.token
@@ -40,6 +200,164 @@ if args.token:
 if args.org:
     organization = args.org
 
+if args.api_url:
+    api_url = args.api_url
+
+if args.webhook_secret:
+    webhook_secret = args.webhook_secret
+
+if args.api_token:
+    api_token = args.api_token
+
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 
-auto_merge(base_branch, head_branch, current_rel_branch, GitHubClient(access_token, organization))
+cache_dir = args.cache_dir or '~/.automerge'
+# a replay leaves the real runs' cache and journals alone, unless it is given a --cache_dir or --journal of its own
+replay_only = args.replay and not args.cache_dir
+
+# only a two-stage scan can use the cached ids; a single-pass scan would list the organization anyway
+cache = None if args.no_cache or replay_only or args.scan_concurrency <= 1 else RepositoryCache(RepositoryCache.default_path(cache_dir),
+    ttl=args.cache_ttl * 60 * 60, evict_after=args.cache_evict_after * 24 * 60 * 60)
+# replayed merge times say nothing about GitHub, so they aren't recorded
+stats = None if args.no_stats or args.replay else MergeStatistics(MergeStatistics.default_path(cache_dir))
+# every client shares one connection pool, one rate limit budget (they use the same token) and one trace
+# scans overlap merges, so there is room for both
+pool_size = max((args.concurrency + args.scan_concurrency) * (args.parallel_jobs if args.manifest else 1), 4)
+if args.replay:
+    pool = ReplayTransport(args.replay, args.replay_speed, pool_size)
+elif args.record:
+    pool = RecordingTransport(GitHubClient.create_pool(pool_size, api_url), args.record)
+else:
+    pool = GitHubClient.create_pool(pool_size, api_url)
+scheduler = RequestScheduler()
+tracer = Tracer()
+clients = {}
+
+def get_client(org: str) -> GitHubClient:
+    if org not in clients:
+        clients[org] = GitHubClient(access_token, org, pool, scheduler, cache, tracer,
+            nodeBatchSize=args.scan_batch_size, scanConcurrency=args.scan_concurrency)
+    return clients[org]
+
+def get_journal(org: str, base: str, head: str, curr_rel: str, path: str = None) -> RunJournal:
+    if replay_only and not path:
+        return None
+    return RunJournal(path or RunJournal.default_path(cache_dir, org, base, head, curr_rel), resume=args.resume)
+
+journals = []
+failed_jobs = 0
+try:
+    if args.manifest:
+        jobs = load_manifest(args.manifest, organization)
+        for job in jobs:
+            get_client(job.org)
+
+        def job_journal(job):
+            journal = get_journal(job.org, job.base, job.head, job.current_release)
+            journals.extend([journal] if journal else [])
+            return journal
+
+        results = run_manifest(jobs, clients, args.batch_size, args.concurrency, args.parallel_jobs, job_journal, args.fast_forward, stats)
+        print_manifest_report(results)
+        failed_jobs = len([result for result in results if result.error])
+    elif command == 'plan':
+        (_, repos_for_merge) = plan_merge(base_branch, head_branch, current_rel_branch, get_client(organization))
+        plan = MergePlan(organization, base_branch, head_branch, current_rel_branch, repos_for_merge)
+        plan.save(args.plan)
+
+        print('-' * 30)
+        print('PLAN')
+        print('-' * 30)
+        for repo in plan.repositories:
+            print('{}: {} ==>> {}{}'.format(repo.name, head_branch, base_branch, ' ==>> ' + current_rel_branch if current_rel_branch in repo.refs else ''))
+        print('-' * 30)
+        print('Wrote a plan to merge {} repositories to {}'.format(len(plan.repositories), args.plan))
+    elif command == 'apply':
+        plan = MergePlan.load(args.plan)
+        client = get_client(plan.org)
+        (repos_for_merge, moved) = plan.verify(client)
+
+        print('-' * 30)
+        print('OUT OF DATE')
+        print('-' * 30)
+        for (message, repo) in moved:
+            logging.error('{}: {}'.format(repo.name, message))
+            print('{}: {}'.format(repo.name, message))
+        print('-' * 30)
+
+        if not repos_for_merge:
+            raise Exception("Every repository in plan {} has moved since it was made".format(args.plan))
+
+        journal = get_journal(plan.org, plan.base, plan.head, plan.current_release, args.journal)
+        journals.extend([journal] if journal else [])
+        auto_merge(plan.base, plan.head, plan.current_release, client, args.batch_size, args.concurrency, journal, repos_for_merge,
+            fast_forward=args.fast_forward, stats=stats)
+    elif command == 'serve':
+        index_path = args.index or BranchIndex.default_path(cache_dir, organization)
+        index = BranchIndex.load(index_path, organization) if os.path.exists(index_path) else BranchIndex(organization, args.branches)
+        service = MergeService(get_client(organization), index, index_path, webhook_secret or None, args.reconcile_interval * 60,
+            batch_size=args.batch_size, concurrency=args.concurrency, stats=stats, api_token=api_token or None)
+        service.start(args.host, args.port)
+        try:
+            # a saved index only needs scanning for branches it didn't already cover
+            index.track(args.branches, get_client(organization))
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.stop()
+    elif command == 'coordinate':
+        coordinator = ShardCoordinator(args.coordinator, args.lease)
+        try:
+            run = coordinator.run()
+            if run is None:
+                (_, repos_for_merge) = plan_merge(base_branch, head_branch, current_rel_branch, get_client(organization))
+                run = ShardedRun(organization, base_branch, head_branch, current_rel_branch, args.shards, args.fast_forward)
+                coordinator.create(run, repos_for_merge)
+                logging.info('Split {} repositories into {} shards in {}'.format(len(repos_for_merge), run.shards, args.coordinator))
+            elif (run.org, run.base, run.head, run.current_release) != (organization, base_branch, head_branch, current_rel_branch):
+                raise Exception('Coordinator {} holds a different run: {}'.format(args.coordinator, run))
+            else:
+                # coordinating the same run again picks it back up, and gives its failed shards another try
+                logging.info('Resuming {} and retrying {} failed shards'.format(run, coordinator.retry_failed()))
+            wait_for_shards(coordinator)
+            coordinator.results()
+        finally:
+            coordinator.close()
+    elif command == 'work':
+        coordinator = ShardCoordinator(args.coordinator, args.lease)
+        try:
+            run = coordinator.wait_for_run()
+            finished = work_shards(coordinator, get_client(run.org), args.worker_id, args.batch_size, args.concurrency, stats)
+            logging.info('Merged shards {}'.format(', '.join(str(shard) for shard in finished) or 'none'))
+        finally:
+            coordinator.close()
+    else:
+        journal = get_journal(organization, base_branch, head_branch, current_rel_branch, args.journal)
+        journals.extend([journal] if journal else [])
+        auto_merge(base_branch, head_branch, current_rel_branch, get_client(organization), args.batch_size, args.concurrency, journal,
+            fast_forward=args.fast_forward, stats=stats)
+finally:
+    pool.close()
+    if cache:
+        cache.close()
+    if stats:
+        stats.close()
+    for journal in journals:
+        journal.close()
+    logging.info('Sent {} requests over {} connections'.format(pool.requests_sent, pool.connections_opened))
+    logging.info('Retried {} requests and spent {:.1f}s throttled (GraphQL cost {})'.format(
+        scheduler.retries, scheduler.throttled_seconds, scheduler.cost))
+
+    if args.metrics_out:
+        tracer.set_gauge('connections_opened', pool.connections_opened)
+        tracer.set_gauge('request_retries', scheduler.retries)
+        tracer.set_gauge('throttled_seconds', scheduler.throttled_seconds)
+        if scheduler.remaining is not None:
+            tracer.set_gauge('rate_limit_remaining', scheduler.remaining)
+        tracer.write(args.metrics_out)
+        logging.info('Wrote metrics to {0}.json and {0}.prom'.format(args.metrics_out))
+
+if failed_jobs:
+    logging.error('{} manifest jobs did not complete'.format(failed_jobs))
+    sys.exit(1)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from automerge.journal import RunJournal
+from automerge.utilities import MergeSelection, check_scan, collect_results, merge_message, prepare_merges
+from github.async_client import AsyncGitHubClient
+from github.types import GitHubError, Repository, RepositorySet
+
+async def auto_merge(base: str, head: str, curr_rel: str, client: AsyncGitHubClient, batch_size: int = 1, journal: RunJournal = None,
+        repositories: [Repository] = None, report: list = None):
+    """
+    asyncio version of automerge.utilities.auto_merge. Every merge of a phase is awaited at once, so
+    the number in flight is bounded only by the size of the client's connection pool.
+    """
+    auto_merge_results = []
+
+    plan = journal.plan(base, head, curr_rel) if journal else None
+    if plan:
+        (head_count, repos_for_merge) = (plan[0], RepositorySet(plan[1]))
+        logging.info('Resuming from journal {}'.format(journal.path))
+    else:
+        (head_count, repos_for_merge) = await plan_merge(base, head, curr_rel, client, repositories)
+        if journal:
+            journal.record_plan(base, head, curr_rel, head_count, repos_for_merge)
+
+    with client.tracer.span('merge_base', base=base, head=head, repositories=len(repos_for_merge)):
+        (succeeded, unprocessed, failed) = await merge_branches(base, head, list(repos_for_merge), client, batch_size, journal, report)
+    auto_merge_results.append((succeeded, unprocessed, failed))
+
+    logging.info('BASE MERGE COMPLETE')
+
+    for repo in succeeded:
+        repo.discard_comparisons(base)
+
+    eligible = RepositorySet(succeeded + unprocessed)
+
+    if not curr_rel or not eligible:
+        return auto_merge_results
+
+    logging.info('Beginning merge of base into current release branches...')
+
+    repos_for_merge = [repo for repo in repos_for_merge.intersection(eligible) if curr_rel in repo.refs]
+
+    if not repos_for_merge:
+        raise Exception("No eligible repositories matching the current release branch")
+
+    with client.tracer.span('merge_release', base=curr_rel, head=base, repositories=len(repos_for_merge)):
+        auto_merge_results.append(await merge_branches(curr_rel, base, repos_for_merge, client, batch_size, journal, report))
+
+    logging.info('CURRENT RELEASE MERGE COMPLETE')
+
+    for repo in auto_merge_results[-1][0]:
+        repo.discard_comparisons(curr_rel)
+
+    return auto_merge_results
+
+async def plan_merge(base: str, head: str, curr_rel: str, client: AsyncGitHubClient, repositories: [Repository] = None) -> tuple:
+    selection = MergeSelection(base, head, curr_rel)
+    with client.tracer.span('scan', branches=selection.branches) as span:
+        if repositories is None:
+            repositories = [repo async for repo in client.iter_repositories_for_branches(selection.branches, selection.comparisons)]
+        repos_for_merge = RepositorySet(selection.select(repositories))
+        span.update(head_matches=selection.head_count, base_matches=selection.matches)
+
+    check_scan(base, head, selection.head_count, repos_for_merge)
+    return (selection.head_count, repos_for_merge)
+
+async def merge_branches(base: str, head: str, repos: [Repository], client: AsyncGitHubClient, batch_size: int = 1, journal: RunJournal = None,
+        report: list = None):
+    (finished, up_to_date, pending) = prepare_merges(base, head, repos, journal)
+    results = await _merge_repositories(base, head, pending, client, merge_message(head), batch_size)
+    return collect_results(base, head, repos, client, finished, up_to_date, iter(results), journal, report)
+
+async def _merge_repositories(base: str, head: str, repos: [Repository], client: AsyncGitHubClient, message: str, batch_size: int) -> list:
+    # the MergeResponse or GitHubError for each repository, in repository order
+    batch_size = max(batch_size, 1)
+
+    async def merge_batch(batch: [Repository]) -> list:
+        with client.tracer.span('merge', base=base, head=head, repositories=[repo.name for repo in batch]):
+            if batch_size > 1:
+                return await client.merge_branches(batch, base, head, message, batch_size)
+
+            try:
+                return [await client.merge_branch(batch[0], base, head, message)]
+            except GitHubError as err:
+                return [err]
+
+    batches = await asyncio.gather(*[merge_batch(repos[i:i + batch_size]) for i in range(0, len(repos), batch_size)])
+    return [result for batch in batches for result in batch]
@@ -0,0 +1,156 @@
+import json
+import os
+import re
+from github.types import Comparison, GitHubError, MergeResponse, Ref, Repository, UpdateRefResponse
+
+class RunJournal:
+    """
+    Append-only record of an auto_merge run, one JSON object per line.
+
+    The plan comes first: a header naming the branches, then every repository that matched the
+    head and base branches (with the refs and comparisons the scan found) as the scan finds it,
+    then a marker once the scan is complete. Each repository's merge outcome is appended as soon
+    as it is known. The plan header, the marker and every outcome are flushed to disk with fsync, so a run that dies part way through
+    can be resumed from the journal without re-merging the repositories it already finished, and
+    without scanning the organization again if the scan had completed.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = os.path.expanduser(path)
+        self.__plan = None
+        self.__outcomes = {}
+        if resume and os.path.exists(self.path):
+            self.__load()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # a fresh run starts a new journal, a resumed run carries on appending to the old one
+        self.__file = open(self.path, 'a' if resume else 'w')
+        self.__sync()
+
+    @staticmethod
+    def default_path(directory: str, org: str, base: str, head: str, currentRelease: str = '') -> str:
+        name = '-'.join(part for part in (org, base, head, currentRelease) if part)
+        return os.path.join(os.path.expanduser(directory), 'journals', re.sub(r'[^\w.-]+', '_', name) + '.jsonl')
+
+    def plan(self, base: str, head: str, currentRelease: str = '') -> tuple:
+        """Returns (head match count, [Repository]) from the journal, or None if no complete plan was recorded."""
+        if self.__plan is None:
+            return None
+
+        branches = (self.__plan['base'], self.__plan['head'], self.__plan['current_release'])
+        if branches != (base, head, currentRelease):
+            raise Exception('Journal {} was recorded for {} ==>> {} (current release: {}), not {} ==>> {} (current release: {})'.format(
+                self.path, branches[1], branches[0], branches[2] or 'none', head, base, currentRelease or 'none'))
+
+        if self.__plan['head_count'] is None:
+            # the scan never finished, so the plan may be missing repositories
+            return None
+        return (self.__plan['head_count'], [decode_repository(repo) for repo in self.__plan['repositories']])
+
+    def record_plan(self, base: str, head: str, currentRelease: str, headCount: int, repositories: [Repository]):
+        self.start_plan(base, head, currentRelease)
+        for repository in repositories:
+            self.record_repository(repository)
+        self.finish_plan(headCount)
+
+    def start_plan(self, base: str, head: str, currentRelease: str):
+        # outcomes already journaled for these branches stay valid whether or not the scan is redone
+        outcomes = self.__outcomes if self.__plan and (self.__plan['base'], self.__plan['head'], self.__plan['current_release']) == (base, head, currentRelease) else {}
+        self.__plan = {'type': 'plan', 'base': base, 'head': head, 'current_release': currentRelease, 'head_count': None, 'repositories': []}
+        self.__outcomes = outcomes
+        self.__append({key: value for (key, value) in self.__plan.items() if key not in ('head_count', 'repositories')})
+
+    def record_repository(self, repository: Repository):
+        record = encode_repository(repository)
+        self.__plan['repositories'].append(record)
+        # not synced on its own: losing the tail of an unfinished plan only means scanning again on resume
+        self.__append(dict(record, type='repository'), sync=False)
+
+    def finish_plan(self, headCount: int):
+        self.__plan['head_count'] = headCount
+        self.__append({'type': 'scanned', 'head_count': headCount})
+
+    def result(self, base: str, head: str, repository: Repository):
+        """
+        The recorded MergeResponse, UpdateRefResponse (for a fast-forward) or GitHubError for merging
+        head into base, if the repository was finished.
+        """
+        record = self.__outcomes.get((base, head, repository.name))
+        return decode_result(record) if record else None
+
+    def record_result(self, base: str, head: str, repository: Repository, outcome: str, result):
+        record = dict(encode_result(result), type='outcome', base=base, head=head, repository=repository.name, outcome=outcome)
+        self.__keep(record)
+        self.__append(record)
+
+    def close(self):
+        self.__file.close()
+
+    def __keep(self, record: dict):
+        # failures are retried on resume; only merged and already merged repositories are finished
+        key = (record['base'], record['head'], record['repository'])
+        if record['outcome'] == 'failed':
+            self.__outcomes.pop(key, None)
+        else:
+            self.__outcomes[key] = record
+
+    def __load(self):
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line is cut short if the process died while writing it
+                    break
+                if record['type'] == 'plan':
+                    branches = (record['base'], record['head'], record['current_release'])
+                    if not self.__plan or branches != (self.__plan['base'], self.__plan['head'], self.__plan['current_release']):
+                        self.__outcomes = {}
+                    self.__plan = dict(record, head_count=None, repositories=[])
+                elif record['type'] == 'repository':
+                    self.__plan['repositories'].append(record)
+                elif record['type'] == 'scanned':
+                    self.__plan['head_count'] = record['head_count']
+                elif record['type'] == 'outcome':
+                    self.__keep(record)
+
+    def __append(self, record: dict, sync: bool = True):
+        self.__file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        if sync:
+            self.__sync()
+
+    def __sync(self):
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+def encode_repository(repo: Repository) -> dict:
+    return {
+        'id': repo.id,
+        'name': repo.name,
+        'permission': repo.permission,
+        'refs': {branch: {'id': ref.id, 'oid': ref.oid} for (branch, ref) in repo.refs.items()},
+        'comparisons': [{'base': base, 'head': head, 'ahead_by': cmp.ahead_by, 'behind_by': cmp.behind_by, 'status': cmp.status}
+            for ((base, head), cmp) in repo.comparisons.items()]
+    }
+
+def decode_repository(data: dict) -> Repository:
+    refs = {branch: Ref(ref['id'], branch, ref['oid'], None) for (branch, ref) in data['refs'].items()}
+    comparisons = {(cmp['base'], cmp['head']): Comparison(cmp['ahead_by'], cmp['behind_by'], cmp['status']) for cmp in data['comparisons']}
+    return Repository(data['id'], data['name'], data['permission'], None, refs, comparisons=comparisons)
+
+def encode_result(result) -> dict:
+    if isinstance(result, GitHubError):
+        return {'error_type': result.error_type, 'message': result.message}
+    if isinstance(result, UpdateRefResponse):
+        return {'commit_hash': result.commit_hash, 'commit_url': result.commit_url, 'fast_forward': True}
+    return {'commit_hash': result.commit_hash, 'commit_url': result.commit_url, 'commit_message': result.commit_message}
+
+def decode_result(data: dict):
+    """The MergeResponse, UpdateRefResponse or GitHubError encoded by encode_result."""
+    if 'error_type' in data:
+        return GitHubError(data['error_type'], data['message'])
+    if data.get('fast_forward'):
+        return UpdateRefResponse(data['commit_hash'], data['commit_url'])
+    return MergeResponse(data['commit_hash'], data['commit_url'], data['commit_message'])
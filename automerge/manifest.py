@@ -0,0 +1,165 @@
+import configparser
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from automerge.stats import MergeStatistics
+from automerge.utilities import MergeSelection, auto_merge, print_merge_results
+from github.client import GitHubClient
+from github.types import Repository
+
+class ManifestJob:
+
+    __slots__ = ('org', 'base', 'head', 'current_release')
+
+    def __init__(self, org: str, base: str, head: str, current_release: str = ''):
+        self.org = org
+        self.base = base
+        self.head = head
+        self.current_release = current_release or ''
+
+    @property
+    def branches(self) -> [str]:
+        return MergeSelection(self.base, self.head, self.current_release).branches
+
+    @property
+    def comparisons(self) -> [tuple]:
+        return MergeSelection(self.base, self.head, self.current_release).comparisons
+
+    def __str__(self) -> str:
+        name = '{}: {} ==>> {}'.format(self.org, self.head, self.base)
+        return name + ' ==>> {}'.format(self.current_release) if self.current_release else name
+
+class ManifestResult:
+
+    __slots__ = ('job', 'report', 'error')
+
+    def __init__(self, job: ManifestJob, report: list, error: Exception = None):
+        self.job = job
+        # one (base, head, succeeded, unprocessed, failed, up to date, finished) entry per merge phase
+        self.report = report
+        self.error = error
+
+def load_manifest(path: str, org: str = '') -> [ManifestJob]:
+    """
+    Reads merge jobs from a JSON, YAML or INI manifest. JSON and YAML manifests hold either a list of
+    jobs or an object with a `jobs` list and an optional default `org`. Each section of an INI manifest
+    is a job, with defaults taken from its [DEFAULT] section. Every job needs `base` and `head`, and
+    may set `org` (defaulting to `org`) and `current_release`.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.ini':
+        config = configparser.ConfigParser()
+        if not config.read(path):
+            raise Exception('Could not read manifest {}'.format(path))
+        entries = [dict(config[section]) for section in config.sections()]
+    else:
+        with open(path) as manifest:
+            if extension in ('.yaml', '.yml'):
+                try:
+                    import yaml
+                except ImportError:
+                    raise Exception('PyYAML is required to read YAML manifests (pip install pyyaml), or use a JSON or INI manifest')
+                data = yaml.safe_load(manifest)
+            else:
+                data = json.load(manifest)
+
+        if isinstance(data, dict):
+            org = data.get('org', org)
+            data = data.get('jobs')
+        if not isinstance(data, list):
+            raise Exception('Manifest {} does not contain a list of jobs'.format(path))
+        entries = data
+
+    jobs = []
+    for (i, entry) in enumerate(entries):
+        missing = [key for key in ('base', 'head') if not entry.get(key)]
+        if missing or not entry.get('org', org):
+            raise Exception('Manifest job {} is missing {}'.format(i + 1, ', '.join(missing or ['org'])))
+        jobs.append(ManifestJob(entry.get('org', org), entry['base'], entry['head'], entry.get('current_release', '')))
+
+    if not jobs:
+        raise Exception('Manifest {} contains no jobs'.format(path))
+    return jobs
+
+def run_manifest(jobs: [ManifestJob], clients: dict, batch_size: int = 1, concurrency: int = 1, parallel_jobs: int = 4, journals=None,
+        fast_forward: bool = False, stats: MergeStatistics = None) -> [ManifestResult]:
+    """
+    Runs every job, returning one ManifestResult per job in manifest order. `clients` maps each org
+    to its GitHubClient, `journals`, if given, returns the RunJournal for a job, and `fast_forward`
+    and `stats` are passed on to auto_merge.
+
+    Each org is scanned once for the branches of all its jobs. Jobs that share a branch in the same
+    org run one after another in manifest order, so each sees the merges of the jobs before it; all
+    other jobs run in parallel.
+    """
+    journals = {id(job): journals(job) for job in jobs} if journals else {}
+    chains = _chain_jobs(jobs)
+
+    # orgs whose every job resumes from a journaled plan do not need scanning at all
+    orgs = list(dict.fromkeys(job.org for job in jobs if not (journals.get(id(job)) and
+        journals[id(job)].plan(job.base, job.head, job.current_release))))
+    orgJobs = {org: [job for job in jobs if job.org == org] for org in orgs}
+
+    with ThreadPoolExecutor(max_workers=max(parallel_jobs, 1)) as executor:
+        scans = dict(zip(orgs, executor.map(lambda org: _scan_organization(clients[org], orgJobs[org]), orgs)))
+
+        def run_chain(chain: [ManifestJob]) -> [ManifestResult]:
+            # every chain works on its own copies, so parallel chains never share repository state
+            repositories = [_copy_repository(repo) for repo in scans[chain[0].org]] if chain[0].org in scans else None
+            results = []
+            for job in chain:
+                report = []
+                try:
+                    auto_merge(job.base, job.head, job.current_release, clients[job.org], batch_size, concurrency,
+                        journals.get(id(job)), repositories, report, fast_forward, stats)
+                    results.append(ManifestResult(job, report))
+                except Exception as err:
+                    logging.error('{}: {}'.format(job, err))
+                    results.append(ManifestResult(job, report, err))
+            return results
+
+        results = {id(result.job): result for chainResults in executor.map(run_chain, chains) for result in chainResults}
+
+    return [results[id(job)] for job in jobs]
+
+def print_manifest_report(results: [ManifestResult]):
+    for result in results:
+        print('=' * 30)
+        print(result.job)
+        print('=' * 30)
+        for (base, head, succeeded, unprocessed, failed, up_to_date, finished) in result.report:
+            print('{} ==>> {}'.format(head, base))
+            print_merge_results(succeeded, unprocessed, failed, up_to_date, finished)
+        if result.error:
+            print('ERROR: {}'.format(result.error))
+
+    print('=' * 30)
+    print('SUMMARY')
+    print('=' * 30)
+    for result in results:
+        counts = ', '.join('{} ==>> {}: {} succeeded, {} unprocessed, {} failed'.format(head, base, len(succeeded), len(unprocessed), len(failed))
+            for (base, head, succeeded, unprocessed, failed, _, _) in result.report)
+        print('{} [{}] {}'.format(result.job, 'ERROR' if result.error else 'OK', counts))
+    print('=' * 30)
+
+def _scan_organization(client: GitHubClient, jobs: [ManifestJob]) -> [Repository]:
+    # one scan fetches every branch and comparison any job in the org needs; repositories without
+    # any job's head branch can never be merged and are dropped straight away
+    branches = list(dict.fromkeys(branch for job in jobs for branch in job.branches))
+    comparisons = list(dict.fromkeys(pair for job in jobs for pair in job.comparisons))
+    heads = set(job.head for job in jobs)
+    with client.tracer.span('organization_scan', org=client.organization, branches=branches):
+        return [repo for repo in client.iter_repositories_for_branches(branches, comparisons) if heads.intersection(repo.refs)]
+
+def _chain_jobs(jobs: [ManifestJob]) -> [[ManifestJob]]:
+    chains = []
+    for job in jobs:
+        # a job joins (and links together) every chain it shares an org and branch with
+        linked = [chain for chain in chains if any(other.org == job.org and set(other.branches) & set(job.branches) for other in chain)]
+        chain = [other for other in jobs if any(other in linked_chain for linked_chain in linked)] + [job]
+        chains = [other for other in chains if other not in linked] + [chain]
+    return chains
+
+def _copy_repository(repo: Repository) -> Repository:
+    return Repository(repo.id, repo.name, repo.permission, repo.ref, dict(repo.refs), repo.updated_at, dict(repo.comparisons))
@@ -0,0 +1,63 @@
+import json
+import os
+from automerge.journal import encode_repository, decode_repository
+from github.client import GitHubClient
+from github.types import Repository
+
+class MergePlan:
+    """
+    The repositories an auto_merge run would merge, with the ref oids the scan saw. `AutoMerge.py plan`
+    writes one for review and `AutoMerge.py apply` runs it without scanning the organization again.
+    """
+
+    version = 1
+
+    __slots__ = ('org', 'base', 'head', 'current_release', 'repositories')
+
+    def __init__(self, org: str, base: str, head: str, current_release: str, repositories: [Repository]):
+        self.org = org
+        self.base = base
+        self.head = head
+        self.current_release = current_release or ''
+        self.repositories = list(repositories)
+
+    def save(self, path: str):
+        data = {
+            'version': self.version,
+            'org': self.org,
+            'base': self.base,
+            'head': self.head,
+            'current_release': self.current_release,
+            'repositories': [encode_repository(repo) for repo in self.repositories]
+        }
+        # written next to the target and renamed, so a reviewer never sees half a plan
+        with open(path + '.tmp', 'w') as plan:
+            json.dump(data, plan, indent=2)
+            plan.write('\n')
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def load(path: str) -> 'MergePlan':
+        with open(path) as plan:
+            data = json.load(plan)
+        if data.get('version') != MergePlan.version:
+            raise Exception('Plan {} has unsupported version {}'.format(path, data.get('version')))
+        return MergePlan(data['org'], data['base'], data['head'], data['current_release'],
+            [decode_repository(repo) for repo in data['repositories']])
+
+    def verify(self, client: GitHubClient) -> tuple:
+        """
+        Checks every planned ref against GitHub in batched node lookups. Returns the repositories whose
+        refs are all where the plan left them, and a (message, repository) pair for each of the rest.
+        """
+        oids = client.get_ref_oids([ref.id for repo in self.repositories for ref in repo.refs.values()])
+        current = []
+        moved = []
+        for repo in self.repositories:
+            changes = ['{} moved from {} to {}'.format(branch, ref.oid[:7], (oids.get(ref.id) or 'deleted')[:7])
+                for (branch, ref) in repo.refs.items() if oids.get(ref.id) != ref.oid]
+            if changes:
+                moved.append(('Plan is out of date: {}'.format(', '.join(changes)), repo))
+            else:
+                current.append(repo)
+        return (current, moved)
@@ -0,0 +1,478 @@
+import hashlib
+import hmac
+import collections
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from automerge.journal import encode_repository, decode_repository
+from automerge.manifest import ManifestJob
+from automerge.stats import MergeStatistics
+from automerge.utilities import auto_merge
+from github.client import GitHubClient
+from github.types import Ref, Repository
+
+class BranchIndex:
+    """
+    In-memory index of repository -> branch -> head commit for one organization, covering the
+    branches it tracks.
+
+    Webhook events keep the index current between reconciliations, which rescan the tracked branches
+    through a GitHubClient. A change a webhook makes while a reconciliation is running wins over what
+    the reconciliation's (older) scan saw. The index can be saved to and loaded from a JSON file so a
+    restarted service starts warm.
+    """
+
+    version = 1
+
+    def __init__(self, org: str, branches: [str] = ()):
+        self.org = org
+        self.branches = list(dict.fromkeys(branches))
+        self.reconciled_at = None
+        self.dirty = False
+        self.__repositories = {}
+        self.__lock = threading.Lock()
+        # (repository, branch or None) -> change number of the last webhook that touched it
+        self.__touched = {}
+        self.__changes = 0
+
+    @staticmethod
+    def default_path(directory: str, org: str) -> str:
+        return os.path.join(os.path.expanduser(directory), 'indexes', re.sub(r'[^\w.-]+', '_', org) + '.json')
+
+    def __len__(self) -> int:
+        return len(self.__repositories)
+
+    def repositories(self, branches: [str]) -> [Repository]:
+        """Copies of the indexed repositories with their refs for `branches`, ready to hand to auto_merge."""
+        with self.__lock:
+            return [Repository(repo.id, repo.name, repo.permission, None,
+                {branch: Ref(ref.id, ref.name, ref.oid, None) for (branch, ref) in repo.refs.items() if branch in branches})
+                for repo in self.__repositories.values()]
+
+    def get(self, name: str) -> Repository:
+        with self.__lock:
+            return self.__repositories.get(name)
+
+    def apply_event(self, event: str, payload: dict) -> bool:
+        """Applies a GitHub push, create, delete or repository webhook payload. Returns whether the index changed."""
+        repository = payload.get('repository') or {}
+        owner = ((payload.get('organization') or {}).get('login') or (repository.get('owner') or {}).get('login') or '')
+        if not repository.get('name') or owner.lower() != self.org.lower():
+            return False
+
+        with self.__lock:
+            self.__changes += 1
+            if event == 'push' and payload.get('ref', '').startswith('refs/heads/'):
+                branch = payload['ref'][len('refs/heads/'):]
+                return self.__set_ref(repository, branch, None if payload.get('deleted') else payload.get('after'), payload.get('deleted'))
+            if event in ('create', 'delete') and payload.get('ref_type') == 'branch':
+                # a create event carries no commit; the push that follows it does
+                return self.__set_ref(repository, payload['ref'], None, deleted=event == 'delete', created=event == 'create')
+            if event == 'repository':
+                return self.__apply_repository_event(payload.get('action'), repository, payload.get('changes') or {})
+        return False
+
+    def record_merge(self, name: str, branch: str, oid: str):
+        """Moves `branch` to the merge commit AutoMerge just made, ahead of the push webhook for it."""
+        with self.__lock:
+            repo = self.__repositories.get(name)
+            if repo and branch in repo.refs:
+                repo.refs[branch].oid = oid
+                self.dirty = True
+
+    def track(self, branches: [str], client: GitHubClient) -> bool:
+        """Starts tracking any of `branches` the index doesn't cover yet, scanning them once. Returns whether it scanned."""
+        with self.__lock:
+            new = [branch for branch in branches if branch not in self.branches]
+        if not new:
+            return False
+
+        logging.info('Indexing new branches: {}'.format(', '.join(new)))
+        self.reconcile(client, new)
+        return True
+
+    def reconcile(self, client: GitHubClient, branches: [str] = None):
+        """Rescans `branches` (every tracked branch by default) and corrects whatever webhooks missed."""
+        branches = list(branches) if branches is not None else list(self.branches)
+        if not branches:
+            return
+
+        with self.__lock:
+            start = self.__changes
+        scanned = client.get_repositories_for_branches(branches)
+
+        with self.__lock:
+            touched = lambda name, branch=None: self.__touched.get((name, branch), 0) > start
+            for repo in scanned:
+                if touched(repo.name):
+                    continue
+                indexed = self.__repositories.setdefault(repo.name, Repository(repo.id, repo.name, repo.permission, None))
+                (indexed.id, indexed.permission) = (repo.id, repo.permission)
+                for branch in branches:
+                    if touched(repo.name, branch):
+                        continue
+                    if branch in repo.refs:
+                        indexed.refs[branch] = repo.refs[branch]
+                    else:
+                        indexed.refs.pop(branch, None)
+
+            # a full scan lists every repository, so anything else was deleted, renamed or transferred
+            for name in [name for name in self.__repositories if name not in scanned and not touched(name)]:
+                del self.__repositories[name]
+
+            self.branches.extend(branch for branch in branches if branch not in self.branches)
+            self.__touched = {key: change for (key, change) in self.__touched.items() if change > start}
+            self.reconciled_at = time.time()
+            self.dirty = True
+
+        logging.info('Reconciled {} repositories for {}'.format(len(scanned), ', '.join(branches)))
+
+    def save(self, path: str):
+        with self.__lock:
+            data = {
+                'version': self.version,
+                'org': self.org,
+                'branches': self.branches,
+                'reconciled_at': self.reconciled_at,
+                'repositories': [encode_repository(repo) for repo in self.__repositories.values()]
+            }
+            self.dirty = False
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + '.tmp', 'w') as index:
+            json.dump(data, index, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def load(path: str, org: str) -> 'BranchIndex':
+        with open(path) as index:
+            data = json.load(index)
+        if data.get('version') != BranchIndex.version or data.get('org') != org:
+            raise Exception('Index {} is not a version {} index of {}'.format(path, BranchIndex.version, org))
+
+        index = BranchIndex(org, data['branches'])
+        index.reconciled_at = data['reconciled_at']
+        for repo in data['repositories']:
+            repo = decode_repository(repo)
+            index.__repositories[repo.name] = repo
+        return index
+
+    def __repository(self, data: dict) -> Repository:
+        # repositories first seen in a webhook get their permission at the next reconciliation
+        name = data['name']
+        if name not in self.__repositories:
+            self.__repositories[name] = Repository(data.get('node_id'), name, None, None)
+            self.__touch(name)
+        return self.__repositories[name]
+
+    def __set_ref(self, data: dict, branch: str, oid: str, deleted: bool = False, created: bool = False) -> bool:
+        if branch not in self.branches:
+            return False
+
+        repo = self.__repository(data)
+        if deleted:
+            repo.refs.pop(branch, None)
+        elif branch in repo.refs:
+            if created:
+                return False
+            repo.refs[branch].oid = oid
+        else:
+            repo.refs[branch] = Ref(None, branch, oid, None)
+        self.__touch(repo.name, branch)
+        return True
+
+    def __apply_repository_event(self, action: str, data: dict, changes: dict) -> bool:
+        name = data['name']
+        if action == 'created':
+            self.__repository(data)
+        elif action in ('deleted', 'transferred', 'archived'):
+            # none of these can be merged into by this organization any more
+            if self.__repositories.pop(name, None) is None:
+                return False
+            self.__touch(name)
+        elif action == 'renamed':
+            previous = ((changes.get('repository') or {}).get('name') or {}).get('from')
+            repo = self.__repositories.pop(previous, None)
+            if repo is None:
+                return False
+            repo.name = name
+            self.__repositories[name] = repo
+            self.__touch(previous)
+            self.__touch(name)
+        else:
+            return False
+        return True
+
+    def __touch(self, name: str, branch: str = None):
+        self.__touched[(name, branch)] = self.__changes
+        self.dirty = True
+
+class ServiceJob:
+
+    __slots__ = ('id', 'job', 'status', 'report', 'error', 'submitted_at', 'finished_at')
+
+    def __init__(self, id: str, job: ManifestJob):
+        self.id = id
+        self.job = job
+        self.status = 'queued'
+        # one (base, head, succeeded, unprocessed, failed, up to date, finished) entry per merge phase
+        self.report = []
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'base': self.job.base,
+            'head': self.job.head,
+            'current_release': self.job.current_release,
+            'status': self.status,
+            'error': str(self.error) if self.error else None,
+            'submitted_at': self.submitted_at,
+            'finished_at': self.finished_at,
+            'phases': [{
+                'base': base,
+                'head': head,
+                'succeeded': [{'repository': repo.name, 'commit_url': result.commit_url} for (result, repo) in succeeded],
+                'unprocessed': [{'repository': repo.name, 'message': message} for (message, repo) in unprocessed],
+                'failed': [{'repository': repo.name, 'message': message} for (message, repo) in failed],
+                'up_to_date': up_to_date,
+                'finished': finished
+            } for (base, head, succeeded, unprocessed, failed, up_to_date, finished) in self.report]
+        }
+
+class MergeService:
+    """
+    Long-running AutoMerge for one organization, serving a small HTTP/JSON API:
+
+        POST /webhook         GitHub push, create, delete and repository webhook deliveries
+        POST /merges          {"base", "head", "current_release"}: queues a merge, returns its job
+        GET  /merges[/ID]     every job, or one job with its results once it has run
+        GET  /index           the organization, tracked branches, repository count and last reconciliation
+        POST /reconcile       rescans the tracked branches now
+
+    Merges read their repositories and refs from the warm BranchIndex instead of scanning the
+    organization, and run one at a time in submission order. The index is reconciled with GitHub
+    every `reconcile_interval` seconds and, if `index_path` is given, saved there whenever it has
+    changed. Webhook deliveries must carry a valid X-Hub-Signature-256 when `webhook_secret` is set,
+    and POST /merges and /reconcile an `Authorization: Bearer` header with `api_token`, which
+    defaults to the webhook secret. Without a webhook secret the service only listens on a loopback
+    address. Only the last `max_finished_jobs` finished jobs are kept.
+    """
+
+    __events = ('push', 'create', 'delete', 'repository')
+
+    def __init__(self, client: GitHubClient, index: BranchIndex, index_path: str = None, webhook_secret: str = None,
+            reconcile_interval: float = 60 * 60, save_interval: float = 30, batch_size: int = 1, concurrency: int = 1, stats: MergeStatistics = None,
+            api_token: str = None, max_finished_jobs: int = 1000):
+        self.client = client
+        self.index = index
+        self.index_path = index_path
+        self.webhook_secret = webhook_secret
+        self.api_token = api_token or webhook_secret
+        self.reconcile_interval = reconcile_interval
+        self.save_interval = save_interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.stats = stats
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = {}
+        self.__finished = collections.deque()
+        self.__ids = itertools.count(1)
+        self.__queue = queue.Queue()
+        self.__stopping = threading.Event()
+        self.__reconcile_now = threading.Event()
+        self.__threads = []
+        self.httpd = None
+
+    @property
+    def url(self) -> str:
+        return 'http://{}:{}'.format(*self.httpd.server_address[:2])
+
+    def start(self, host: str = '127.0.0.1', port: int = 8080) -> 'MergeService':
+        if not self.webhook_secret and not _is_loopback(host):
+            # without a secret anyone who can reach the service could start merges and rewrite the index
+            raise ValueError('Serving on {} needs a webhook secret'.format(host))
+        self.httpd = ThreadingHTTPServer((host, port), self.__handler())
+        self.httpd.daemon_threads = True
+        self.__start_thread(self.httpd.serve_forever)
+        logging.info('Serving {} on {}'.format(self.index.org, self.url))
+
+        if self.index.reconciled_at is None:
+            # webhooks are already being taken, so nothing that happens during the first scan is lost
+            try:
+                self.index.reconcile(self.client)
+            except BaseException:
+                self.httpd.shutdown()
+                self.httpd.server_close()
+                raise
+        self.__start_thread(self.__run_jobs)
+        self.__start_thread(self.__maintain_index)
+        return self
+
+    def stop(self):
+        self.__stopping.set()
+        self.__reconcile_now.set()
+        self.__queue.put(None)
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for thread in self.__threads:
+            thread.join()
+        self.__save()
+
+    def __enter__(self):
+        return self.start(port=0)
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def submit(self, base: str, head: str, current_release: str = '') -> ServiceJob:
+        job = ServiceJob(str(next(self.__ids)), ManifestJob(self.index.org, base, head, current_release))
+        self.jobs[job.id] = job
+        self.__queue.put(job)
+        logging.info('Queued job {}: {}'.format(job.id, job.job))
+        return job
+
+    def authorized(self, authorization: str = None) -> bool:
+        """Whether an Authorization header may queue merges and reconciliations."""
+        if not self.api_token:
+            return True
+        return bool(authorization) and hmac.compare_digest(authorization.encode(), ('Bearer ' + self.api_token).encode())
+
+    def handle_webhook(self, event: str, body: bytes, signature: str = None) -> int:
+        """Returns the HTTP status for one webhook delivery."""
+        if self.webhook_secret:
+            expected = 'sha256=' + hmac.new(self.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+            if not signature or not hmac.compare_digest(signature, expected):
+                return 401
+        if event not in self.__events:
+            # ping and every other event are acknowledged and ignored
+            return 204
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400
+        if self.index.apply_event(event, payload):
+            self.client.tracer.increment('webhook_events_total', event=event)
+        return 204
+
+    def reconcile(self):
+        self.__reconcile_now.set()
+
+    def __run_jobs(self):
+        while True:
+            job = self.__queue.get()
+            if job is None:
+                return
+            job.status = 'running'
+            try:
+                with self.client.tracer.span('service_job', id=job.id, base=job.job.base, head=job.job.head):
+                    self.index.track(job.job.branches, self.client)
+                    auto_merge(job.job.base, job.job.head, job.job.current_release, self.client, self.batch_size, self.concurrency,
+                        repositories=self.index.repositories(job.job.branches), report=job.report, stats=self.stats)
+                for (base, _, succeeded, _, _, _, _) in job.report:
+                    for (result, repo) in succeeded:
+                        self.index.record_merge(repo.name, base, result.commit_hash)
+                job.status = 'succeeded'
+            except Exception as err:
+                logging.error('Job {} ({}) failed: {}'.format(job.id, job.job, err))
+                (job.status, job.error) = ('failed', err)
+            job.finished_at = time.time()
+            # queued and running jobs are always kept; finished ones only until enough newer ones finish
+            self.__finished.append(job.id)
+            while len(self.__finished) > self.max_finished_jobs:
+                self.jobs.pop(self.__finished.popleft(), None)
+
+    def __maintain_index(self):
+        next_reconcile = (self.index.reconciled_at or time.time()) + self.reconcile_interval
+        while not self.__stopping.is_set():
+            if self.__reconcile_now.is_set() or time.time() >= next_reconcile:
+                self.__reconcile_now.clear()
+                try:
+                    self.index.reconcile(self.client)
+                except Exception as err:
+                    # webhooks keep the index usable until the next attempt
+                    logging.error('Reconciliation failed: {}'.format(err))
+                next_reconcile = time.time() + self.reconcile_interval
+            self.__save()
+            self.__reconcile_now.wait(max(min(next_reconcile - time.time(), self.save_interval), 0))
+
+    def __start_thread(self, target):
+        self.__threads.append(threading.Thread(target=target, daemon=True))
+        self.__threads[-1].start()
+
+    def __save(self):
+        if self.index_path and self.index.dirty:
+            self.index.save(self.index_path)
+
+    def __handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if self.path == '/index':
+                    index = service.index
+                    return self.send_json(200, {'org': index.org, 'branches': index.branches, 'repositories': len(index),
+                        'reconciled_at': index.reconciled_at})
+                if self.path == '/merges':
+                    return self.send_json(200, [job.to_dict() for job in list(service.jobs.values())])
+                if self.path.startswith('/merges/'):
+                    job = service.jobs.get(self.path[len('/merges/'):])
+                    if job:
+                        return self.send_json(200, job.to_dict())
+                self.send_json(404, {'message': 'Not Found'})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path == '/webhook':
+                    status = service.handle_webhook(self.headers.get('X-GitHub-Event', ''), body, self.headers.get('X-Hub-Signature-256'))
+                    return self.send_json(status, None if status == 204 else {'message': 'Bad signature' if status == 401 else 'Bad payload'})
+                if self.path in ('/reconcile', '/merges') and not service.authorized(self.headers.get('Authorization')):
+                    return self.send_json(401, {'message': 'Bad credentials'})
+                if self.path == '/reconcile':
+                    service.reconcile()
+                    return self.send_json(202, {'message': 'Reconciliation started'})
+                if self.path == '/merges':
+                    try:
+                        request = json.loads(body)
+                        if not request.get('base') or not request.get('head'):
+                            raise ValueError('base and head are required')
+                    except (ValueError, AttributeError) as err:
+                        return self.send_json(400, {'message': str(err)})
+                    job = service.submit(request['base'], request['head'], request.get('current_release', ''))
+                    return self.send_json(202, job.to_dict())
+                self.send_json(404, {'message': 'Not Found'})
+
+            def send_json(self, status: int, payload):
+                body = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                if body:
+                    self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug('{}: {}'.format(self.address_string(), format % args))
+
+        return Handler
+
+def _is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
@@ -0,0 +1,324 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from automerge.journal import RunJournal, decode_repository, decode_result, encode_repository, encode_result
+from automerge.stats import MergeStatistics
+from automerge.utilities import auto_merge, print_merge_results
+from github.client import GitHubClient
+from github.types import Repository
+
+def shard_of(repository_id: str, shards: int) -> int:
+    """The shard a repository belongs to: the same on every host and every run, whatever the scan order."""
+    return int.from_bytes(hashlib.sha1(repository_id.encode()).digest()[:8], 'big') % shards
+
+def default_worker() -> str:
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+class ShardedRun:
+
+    __slots__ = ('org', 'base', 'head', 'current_release', 'shards', 'fast_forward')
+
+    def __init__(self, org: str, base: str, head: str, current_release: str, shards: int, fast_forward: bool = False):
+        self.org = org
+        self.base = base
+        self.head = head
+        self.current_release = current_release or ''
+        self.shards = shards
+        self.fast_forward = fast_forward
+
+    def __str__(self) -> str:
+        name = '{}: {} ==>> {}'.format(self.org, self.head, self.base)
+        return name + ' ==>> {}'.format(self.current_release) if self.current_release else name
+
+class ShardCoordinator:
+    """
+    SQLite file coordinating one auto_merge run split across worker processes, which may run on other
+    hosts if they can all reach the file.
+
+    The `coordinate` command scans the organization once and stores the repositories to merge, each
+    in the shard picked by `shard_of`. Workers lease one shard at a time and renew the lease while
+    they merge it. A shard whose lease runs out, because its worker died or lost the file, goes to
+    the next worker that asks, which carries on from the shard's journal (kept next to this file)
+    instead of merging it again. Each finished shard stores its results, and `results` combines
+    them into what auto_merge would have returned for the whole run.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300.0, clock=time.time):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        # transactions are explicit, and BEGIN IMMEDIATE makes other processes wait their turn for up to `timeout`
+        self.__db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.__db.executescript("""
+            CREATE TABLE IF NOT EXISTS run (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                org TEXT NOT NULL,
+                base TEXT NOT NULL,
+                head TEXT NOT NULL,
+                current_release TEXT NOT NULL,
+                shards INTEGER NOT NULL,
+                fast_forward INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS repositories (
+                position INTEGER PRIMARY KEY,
+                shard INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS shards (
+                shard INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                report TEXT,
+                error TEXT
+            );
+        """)
+
+    def journal_path(self, shard: int) -> str:
+        return '{}.shard-{}.jsonl'.format(os.path.splitext(self.path)[0], shard)
+
+    def run(self) -> ShardedRun:
+        """The run this file coordinates, or None until the `coordinate` command has stored its scan."""
+        with self.__lock:
+            row = self.__db.execute('SELECT org, base, head, current_release, shards, fast_forward FROM run').fetchone()
+        return ShardedRun(*row[:5], bool(row[5])) if row else None
+
+    def wait_for_run(self, poll: float = 5.0) -> ShardedRun:
+        run = self.run()
+        if run is None:
+            logging.info('Waiting for a run to be stored in {}'.format(self.path))
+        while run is None:
+            time.sleep(poll)
+            run = self.run()
+        return run
+
+    def create(self, run: ShardedRun, repositories: [Repository]):
+        """Stores the run and its scanned repositories, split into `run.shards` shards. Shards without any repositories start out done."""
+        if run.shards < 1:
+            raise ValueError('A run needs at least one shard')
+
+        rows = [(position, shard_of(repo.id, run.shards), repo.name, json.dumps(encode_repository(repo), separators=(',', ':')))
+            for (position, repo) in enumerate(repositories)]
+        used = set(shard for (_, shard, _, _) in rows)
+        with self.__lock, self.__transaction():
+            if self.__db.execute('SELECT 1 FROM run').fetchone():
+                raise Exception('Coordinator {} already holds a run'.format(self.path))
+            self.__db.execute('INSERT INTO run VALUES (1, ?, ?, ?, ?, ?, ?)',
+                (run.org, run.base, run.head, run.current_release, run.shards, int(run.fast_forward)))
+            self.__db.executemany('INSERT INTO repositories VALUES (?, ?, ?, ?)', rows)
+            self.__db.executemany("INSERT INTO shards (shard, status, report) VALUES (?, ?, ?)",
+                [(shard, 'pending', None) if shard in used else (shard, 'done', '[]') for shard in range(run.shards)])
+
+    def acquire(self, worker: str) -> tuple:
+        """
+        Leases the first shard that is waiting, or whose lease has run out, to `worker`. Returns the
+        shard number and its repositories, or None if every shard is done or leased.
+        """
+        now = self.__clock()
+        with self.__lock, self.__transaction():
+            row = self.__db.execute("""
+                SELECT shard FROM shards
+                WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+                ORDER BY attempts, shard LIMIT 1
+            """, (now,)).fetchone()
+            if row is None:
+                return None
+            shard = row[0]
+            self.__db.execute("UPDATE shards SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE shard = ?",
+                (worker, now + self.lease_seconds, shard))
+            repositories = [decode_repository(json.loads(data))
+                for (data,) in self.__db.execute('SELECT data FROM repositories WHERE shard = ? ORDER BY position', (shard,))]
+        return (shard, repositories)
+
+    def renew(self, shard: int, worker: str) -> bool:
+        """Extends `worker`'s lease on the shard. False if the lease has already gone to another worker."""
+        with self.__lock, self.__transaction():
+            return self.__db.execute("UPDATE shards SET lease_expires = ? WHERE shard = ? AND status = 'leased' AND worker = ?",
+                (self.__clock() + self.lease_seconds, shard, worker)).rowcount == 1
+
+    def complete(self, shard: int, worker: str, report: list, error: Exception = None) -> bool:
+        """
+        Stores the auto_merge `report` of a shard `worker` holds the lease on, and the error that
+        stopped it, if any. False if the lease has gone to another worker, whose results count instead.
+        """
+        phases = [{
+            'base': base,
+            'head': head,
+            'up_to_date': up_to_date,
+            'finished': finished,
+            'outcomes': [dict(encode_result(result), repository=repo.name, outcome='succeeded') for (result, repo) in succeeded] +
+                [{'repository': repo.name, 'outcome': 'unprocessed', 'message': message} for (message, repo) in unprocessed] +
+                [{'repository': repo.name, 'outcome': 'failed', 'message': message} for (message, repo) in failed]
+        } for (base, head, succeeded, unprocessed, failed, up_to_date, finished) in report]
+        with self.__lock, self.__transaction():
+            return self.__db.execute("""
+                UPDATE shards SET status = ?, lease_expires = NULL, report = ?, error = ?
+                WHERE shard = ? AND status = 'leased' AND worker = ?
+            """, ('failed' if error else 'done', json.dumps(phases, separators=(',', ':')), str(error) if error else None,
+                shard, worker)).rowcount == 1
+
+    def retry_failed(self) -> int:
+        """Puts every failed shard back in the queue, returning how many there were."""
+        with self.__lock, self.__transaction():
+            return self.__db.execute("UPDATE shards SET status = 'pending', worker = NULL, error = NULL WHERE status = 'failed'").rowcount
+
+    def progress(self) -> dict:
+        """Maps each shard status (pending, leased, done, failed) to its number of shards."""
+        with self.__lock:
+            return dict(self.__db.execute('SELECT status, COUNT(*) FROM shards GROUP BY status').fetchall())
+
+    def unfinished(self) -> int:
+        progress = self.progress()
+        return progress.get('pending', 0) + progress.get('leased', 0)
+
+    def results(self, report: list = None) -> list:
+        """
+        Combines the results of every shard into the (succeeded, unprocessed, failed) repositories of
+        each phase, like auto_merge returns, with repositories in scan order. `report` collects each
+        phase's results as auto_merge would instead of printing them. Raises if any shard failed,
+        after reporting what the other shards merged.
+        """
+        run = self.run()
+        with self.__lock:
+            repositories = {name: decode_repository(json.loads(data))
+                for (name, data) in self.__db.execute('SELECT name, data FROM repositories ORDER BY position')}
+            shards = self.__db.execute('SELECT shard, status, report, error FROM shards ORDER BY shard').fetchall()
+
+        phases = [(run.base, run.head), (run.current_release, run.base)] if run.current_release else [(run.base, run.head)]
+        outcomes = {phase: {} for phase in phases}
+        counts = {phase: [0, 0] for phase in phases}
+        for (_, _, data, _) in shards:
+            for phase in json.loads(data or '[]'):
+                key = (phase['base'], phase['head'])
+                counts[key][0] += phase['up_to_date']
+                counts[key][1] += phase['finished']
+                outcomes[key].update((outcome['repository'], outcome) for outcome in phase['outcomes'])
+
+        errors = ['shard {}: {}'.format(shard, error) for (shard, status, _, error) in shards if status == 'failed']
+        unfinished = [str(shard) for (shard, status, _, _) in shards if status in ('pending', 'leased')]
+        if unfinished:
+            errors.append('shards {} are not finished'.format(', '.join(unfinished)))
+
+        auto_merge_results = []
+        for (base, head) in phases:
+            recorded = outcomes[(base, head)]
+            if auto_merge_results and not recorded:
+                # shards carry on when none of their repositories reach the current release merge, but the run as a whole doesn't
+                if not errors and (auto_merge_results[0][0] or auto_merge_results[0][1]):
+                    raise Exception("No eligible repositories matching the current release branch")
+                break
+
+            phase = {'succeeded': [], 'unprocessed': [], 'failed': []}
+            for (name, repo) in repositories.items():
+                if name in recorded:
+                    outcome = recorded[name]
+                    result = decode_result(outcome) if outcome['outcome'] == 'succeeded' else outcome['message']
+                    phase[outcome['outcome']].append((result, repo))
+
+            if report is not None:
+                report.append((base, head, phase['succeeded'], phase['unprocessed'], phase['failed'], *counts[(base, head)]))
+            else:
+                print('{} ==>> {}'.format(head, base))
+                print_merge_results(phase['succeeded'], phase['unprocessed'], phase['failed'], *counts[(base, head)])
+            auto_merge_results.append(tuple([repo for (_, repo) in phase[outcome]] for outcome in ('succeeded', 'unprocessed', 'failed')))
+
+        if errors:
+            raise Exception('Sharded run {} did not complete: {}'.format(run, '; '.join(errors)))
+        return auto_merge_results
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+    @contextmanager
+    def __transaction(self):
+        self.__db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.__db.execute('ROLLBACK')
+            raise
+        self.__db.execute('COMMIT')
+
+def work_shards(coordinator: ShardCoordinator, client: GitHubClient, worker: str = None, batch_size: int = 1, concurrency: int = 1,
+        stats: MergeStatistics = None, poll: float = 5.0) -> [int]:
+    """
+    Leases shards from the coordinator and merges them with auto_merge until every shard is done,
+    returning the shards this worker finished. While other workers hold the only shards left, it
+    waits in case one of their leases runs out. `client` must be for the run's organization.
+    """
+    worker = worker or default_worker()
+    run = coordinator.wait_for_run(poll)
+    finished = []
+    while True:
+        lease = coordinator.acquire(worker)
+        if lease is None:
+            if not coordinator.unfinished():
+                return finished
+            time.sleep(min(poll, coordinator.lease_seconds))
+            continue
+
+        (shard, repositories) = lease
+        logging.info('{}: merging shard {} of {} ({} repositories)'.format(worker, shard, run.shards, len(repositories)))
+        (done, lost) = (threading.Event(), threading.Event())
+        heartbeat = threading.Thread(target=_renew_lease, args=(coordinator, shard, worker, done, lost), daemon=True)
+        heartbeat.start()
+        # the shard's journal lets whoever holds the shard next skip the repositories this worker finished
+        journal = RunJournal(coordinator.journal_path(shard), resume=True)
+        report = []
+        error = None
+        try:
+            # a shard none of whose merged repositories has the current release branch is done, not failed;
+            # the coordinator checks the run as a whole for that
+            auto_merge(run.base, run.head, run.current_release, client, batch_size, concurrency, journal, repositories, report,
+                run.fast_forward, stats, stop=lost, require_current_release=False)
+        except Exception as err:
+            error = err
+        finally:
+            done.set()
+            heartbeat.join()
+            journal.close()
+
+        if lost.is_set():
+            # whoever takes the shard over resumes from its journal
+            logging.warning('{}: lost the lease on shard {}, dropping it'.format(worker, shard))
+            continue
+        if error:
+            logging.error('{}: shard {}: {}'.format(worker, shard, error))
+        if coordinator.complete(shard, worker, report, error):
+            finished.append(shard)
+        else:
+            logging.warning('{}: lost the lease on shard {} to another worker'.format(worker, shard))
+
+def wait_for_shards(coordinator: ShardCoordinator, poll: float = 5.0):
+    """Blocks until no shard is waiting or leased, logging progress whenever it changes."""
+    last = None
+    while True:
+        progress = coordinator.progress()
+        if progress != last:
+            logging.info('Shards: {}'.format(', '.join('{} {}'.format(count, status) for (status, count) in sorted(progress.items()))))
+            last = progress
+        if not progress.get('pending') and not progress.get('leased'):
+            return
+        time.sleep(poll)
+
+def _renew_lease(coordinator: ShardCoordinator, shard: int, worker: str, done: threading.Event, lost: threading.Event):
+    while not done.wait(coordinator.lease_seconds / 3):
+        if not coordinator.renew(shard, worker):
+            # the merge loop stops sending batches for a shard another worker may already be merging
+            logging.warning('{}: could not renew the lease on shard {}'.format(worker, shard))
+            lost.set()
+            return
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import threading
+import time
+
+class MergeHistory:
+
+    __slots__ = ('seconds', 'failure_rate', 'samples')
+
+    def __init__(self, seconds: float, failure_rate: float, samples: int):
+        # moving averages over the repository's recent merges: request seconds, and 1 for each failure
+        self.seconds = seconds
+        self.failure_rate = failure_rate
+        self.samples = samples
+
+class MergeStatistics:
+    """
+    Local SQLite store of how long each repository's merges took and whether they failed.
+
+    Each finished merge request updates an exponential moving average (weighted by `smoothing`)
+    of the repository's merge seconds and failure rate. auto_merge reads the averages when a run
+    starts to predict each merge and schedule the slow and likely-to-fail ones first, then writes
+    the run's measurements back in one transaction.
+    """
+
+    failure_threshold = 0.5
+
+    def __init__(self, path: str, smoothing: float = 0.3, clock=time.time):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.smoothing = smoothing
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__pending = []
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript("""
+            CREATE TABLE IF NOT EXISTS merges (
+                org TEXT NOT NULL,
+                repository TEXT NOT NULL,
+                seconds REAL NOT NULL,
+                failure_rate REAL NOT NULL,
+                samples INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (org, repository)
+            );
+        """)
+
+    @staticmethod
+    def default_path(cacheDir: str) -> str:
+        return os.path.join(os.path.expanduser(cacheDir), 'merge_stats.sqlite3')
+
+    def history(self, org: str) -> dict:
+        """Maps each repository of the organization with recorded merges to its MergeHistory."""
+        with self.__lock:
+            rows = self.__db.execute('SELECT repository, seconds, failure_rate, samples FROM merges WHERE org = ?', (org,)).fetchall()
+
+        return {name: MergeHistory(seconds, failure_rate, samples) for (name, seconds, failure_rate, samples) in rows}
+
+    def record(self, org: str, repository: str, seconds: float, failed: bool):
+        """Queues one merge measurement; `flush` writes them."""
+        with self.__lock:
+            self.__pending.append((org, repository, seconds, 1.0 if failed else 0.0))
+
+    def flush(self):
+        with self.__lock:
+            (pending, self.__pending) = (self.__pending, [])
+            if not pending:
+                return
+            now = self.__clock()
+            with self.__db:
+                self.__db.executemany("""
+                    INSERT INTO merges VALUES (?, ?, ?, ?, 1, ?)
+                    ON CONFLICT (org, repository) DO UPDATE SET
+                        seconds = seconds + ? * (excluded.seconds - seconds),
+                        failure_rate = failure_rate + ? * (excluded.failure_rate - failure_rate),
+                        samples = samples + 1,
+                        updated_at = excluded.updated_at
+                """, [(org, repository, seconds, failed, now, self.smoothing, self.smoothing) for (org, repository, seconds, failed) in pending])
+
+    def close(self):
+        self.flush()
+        with self.__lock:
+            self.__db.close()
+
+class MergeForecast:
+    """
+    Predictions for one organization's merges, from the history in MergeStatistics. Repositories
+    without history are expected to take the organization's average.
+    """
+
+    def __init__(self, history: dict):
+        self.history = history
+        self.average = sum(entry.seconds for entry in history.values()) / len(history) if history else 0.0
+
+    def seconds(self, name: str) -> float:
+        entry = self.history.get(name)
+        return entry.seconds if entry else self.average
+
+    def likely_to_fail(self, name: str) -> bool:
+        entry = self.history.get(name)
+        return bool(entry) and entry.failure_rate >= MergeStatistics.failure_threshold
@@ -1,84 +1,448 @@
+import heapq
+import itertools
 import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from automerge.journal import RunJournal
+from automerge.stats import MergeForecast, MergeStatistics
 from github.client import GitHubClient
-from github.types import GitHubError, Repository
+from github.types import GitHubError, Repository, RepositorySet, UpdateRefResponse
 
-def auto_merge(base: str, head: str, curr_rel: str, client: GitHubClient):
-    auto_merge_results = []
+def auto_merge(base: str, head: str, curr_rel: str, client: GitHubClient, batch_size: int = 1, concurrency: int = 1, journal: RunJournal = None,
+        repositories: [Repository] = None, report: list = None, fast_forward: bool = False, stats: MergeStatistics = None,
+        stop: threading.Event = None, require_current_release: bool = True):
+    """
+    Merges head into base, then base into curr_rel (if given), across the organization. `repositories`
+    replaces the organization scan with repositories already scanned for these branches, and `report`
+    collects each phase's results instead of printing them. With `fast_forward`, a base the scan found
+    to be an ancestor of head is moved to head's commit instead of getting a merge commit.
 
-    # get repositories with the head branch (i.e. all repos with a 'REL-2910' branch)
-    head_repos = [repo for repo in client.get_repositories(head) if repo.ref]
+    The run is a pipeline: each repository is queued for merging as soon as the scan finds it with
+    both branches, up to `concurrency` merge requests run while later pages are still being fetched,
+    and each repository moves on to the current release merge as soon as its own base merge is done.
+    With `stats`, queued merges start likely failures first, then slowest first, going by earlier
+    runs, and the time each merge request took is recorded for the next run.
 
-    if not head_repos:
-        raise Exception("No repositories were found matching the head: {}".format(head))
+    Once `stop` is set, no further batches are sent and the run raises after the ones in flight finish.
+    Without `require_current_release`, a run none of whose merged repositories has the current release
+    branch returns its base merge results instead of raising.
+    """
+    selection = MergeSelection(base, head, curr_rel)
+
+    # a resumed run picks up the plan recorded by the run it continues, instead of scanning again
+    plan = journal.plan(base, head, curr_rel) if journal else None
+    if plan:
+        logging.info('Resuming from journal {}'.format(journal.path))
+        repositories = plan[1]
+    elif journal:
+        journal.start_plan(base, head, curr_rel)
+    if repositories is None:
+        repositories = client.iter_repositories_for_branches(selection.branches, selection.comparisons)
+
+    forecast = MergeForecast(stats.history(client.organization)) if stats else None
+    executor = ThreadPoolExecutor(max_workers=max(concurrency, 1))
+    stages = []
+    try:
+        with client.tracer.span('pipeline', base=base, head=head, current_release=curr_rel) as pipeline:
+            release = _MergeStage(curr_rel, base, client, executor, batch_size, concurrency, journal, fast_forward=fast_forward,
+                forecast=forecast, stop=stop) if curr_rel else None
+
+            def on_base_merged(repo: Repository, outcome: str):
+                if outcome == 'succeeded':
+                    # the base branch moved, so its comparison with the current release branch is stale
+                    repo.discard_comparisons(base)
+                # succeeded and unprocessed branches are eligible to be merged into the current release branch
+                if release and outcome != 'failed' and curr_rel in repo.refs:
+                    release.add(repo)
+
+            merges = _MergeStage(base, head, client, executor, batch_size, concurrency, journal, on_base_merged, fast_forward, forecast, stop)
+            stages.extend(stage for stage in (merges, release) if stage)
+
+            with client.tracer.span('scan', branches=selection.branches) as span:
+                for repo in selection.select(repositories):
+                    _check_stopped(stop, base, head)
+                    if journal and not plan:
+                        journal.record_repository(repo)
+                    logging.info("{}: {} ==>> {}".format(repo.name, head, base))
+                    merges.add(repo)
+                    _harvest(stages, block=False)
+                span.update(head_matches=selection.head_count, base_matches=selection.matches)
+
+            if journal and not plan:
+                journal.finish_plan(selection.head_count)
+            check_scan(base, head, plan[0] if plan else selection.head_count, merges.repos)
+
+            merges.flush()
+            while any(stage.busy for stage in stages):
+                _check_stopped(stop, base, head)
+                if release and not merges.busy:
+                    release.flush()
+                _harvest(stages, block=True)
+            pipeline.update(base_repositories=len(merges.repos), release_repositories=len(release.repos) if release else 0)
+    finally:
+        # batches that haven't started are dropped (shutdown's cancel_futures needs Python 3.9)
+        for stage in stages:
+            for future in stage.futures:
+                future.cancel()
+        executor.shutdown()
+        if stats:
+            # whatever was measured is kept, even when the run fails part way
+            for stage in stages:
+                for (name, (seconds, failed)) in stage.times.items():
+                    stats.record(client.organization, name, seconds, failed)
+            stats.flush()
+
+    order = {repo.name: i for (i, repo) in enumerate(merges.repos)}
+    auto_merge_results = [merges.report(order, report)]
+
+    logging.info('BASE MERGE COMPLETE')
+
+    (succeeded, unprocessed, _) = auto_merge_results[0]
+    if not curr_rel or not (succeeded or unprocessed):
+        if forecast:
+            _report_times(stages, forecast, report)
+        return auto_merge_results
+
+    if not release.repos:
+        if not require_current_release:
+            return auto_merge_results
+        raise Exception("No eligible repositories matching the current release branch")
+
+    auto_merge_results.append(release.report(order, report))
+
+    logging.info('CURRENT RELEASE MERGE COMPLETE')
+
+    # ... as did the current release branch, for whoever merges these repositories next
+    for repo in auto_merge_results[-1][0]:
+        repo.discard_comparisons(curr_rel)
+
+    if forecast:
+        _report_times(stages, forecast, report)
+    return auto_merge_results
+
+class _MergeStage:
+    """
+    One merge phase of the auto_merge pipeline. Repositories are added as they become ready and
+    merged on the shared executor in batches of `batch_size`, with at most `concurrency` batches
+    submitted at a time; `on_result` is called with each repository and its outcome as soon as the
+    outcome is known. With `fast_forward`, repositories whose base is an ancestor of head are batched
+    separately and fast-forwarded instead. With a `forecast`, queued batches start likely failures
+    first and then in order of expected seconds, longest first; otherwise they start in the order
+    they were queued. Once `stop` is set, queued batches are held back.
+    """
+
+    def __init__(self, base: str, head: str, client: GitHubClient, executor: ThreadPoolExecutor, batch_size: int, concurrency: int,
+            journal: RunJournal = None, on_result=None, fast_forward: bool = False, forecast: MergeForecast = None, stop: threading.Event = None):
+        self.base = base
+        self.head = head
+        self.client = client
+        self.executor = executor
+        self.batch_size = max(batch_size, 1)
+        self.concurrency = max(concurrency, 1)
+        self.journal = journal
+        self.on_result = on_result
+        self.fast_forward = fast_forward
+        self.forecast = forecast
+        self.stop = stop
+        self.message = merge_message(head)
+        self.repos = []
+        self.results = {}
+        self.finished = 0
+        self.up_to_date = 0
+        self.futures = {}
+        # repository name -> (seconds, failed) of each merge this stage sent
+        self.times = {}
+        # repositories waiting for a full batch, keyed by the function that sends the batch
+        self.__batches = {_merge_batch: [], _fast_forward_batch: []}
+        # heap of (priority, sequence, work, batch)
+        self.__queued = []
+        self.__sequence = itertools.count()
+
+    @property
+    def busy(self) -> bool:
+        return bool(self.futures or self.__queued or any(self.__batches.values()))
+
+    def add(self, repo: Repository):
+        self.repos.append(repo)
+        # repositories a resumed run already finished keep their journaled result
+        result = self.journal.result(self.base, self.head, repo) if self.journal else None
+        if result is not None:
+            self.finished += 1
+            self.complete(repo, result, record=False)
+        elif _is_up_to_date(repo, self.base, self.head):
+            # the scan showed head has no commits ahead of base, so no mutation is needed
+            self.up_to_date += 1
+            self.complete(repo, GitHubError('UP_TO_DATE', 'Already merged: {} has no commits ahead of {}'.format(self.head, self.base)))
+        elif self.fast_forward and _is_fast_forward(repo, self.base, self.head):
+            logging.info('Fast-forwarding {} to {}: {}'.format(self.base, self.head, repo.name))
+            self.__hold(_fast_forward_batch, repo)
+        else:
+            logging.info('Merging {} into {}: {}'.format(self.head, self.base, repo.name))
+            self.__hold(_merge_batch, repo)
+
+    def flush(self):
+        for (work, batch) in self.__batches.items():
+            if batch:
+                self.__queue(work, batch)
+                self.__batches[work] = []
+        self.__submit()
+
+    def harvest(self, done: set):
+        for future in [future for future in self.futures if future in done]:
+            batch = self.futures.pop(future)
+            (seconds, results) = future.result()
+            for (repo, result) in zip(batch, results):
+                outcome = self.complete(repo, result)
+                # a batch is one request, so each of its repositories is charged an equal share
+                self.times[repo.name] = (seconds / len(batch), outcome == 'failed')
+        self.__submit()
+
+    def complete(self, repo: Repository, result, record: bool = True) -> str:
+        self.results[repo.name] = result
+        outcome = _classify(repo, result)
+        if self.journal and record:
+            self.journal.record_result(self.base, self.head, repo, outcome, result)
+        if self.on_result:
+            self.on_result(repo, outcome)
+        return outcome
+
+    def report(self, order: dict, report: list = None) -> tuple:
+        repos = sorted(self.repos, key=lambda repo: order[repo.name])
+        return _report_results(self.base, self.head, repos, self.results, self.client, self.up_to_date, self.finished, report)
+
+    def __hold(self, work, repo: Repository):
+        batch = self.__batches[work]
+        batch.append(repo)
+        if len(batch) >= self.batch_size:
+            self.__queue(work, batch)
+            self.__batches[work] = []
+            self.__submit()
+
+    def __queue(self, work, batch: [Repository]):
+        priority = (0, 0.0)
+        if self.forecast:
+            # likely failures go first so they surface early, then the slowest merges so they don't finish the run
+            priority = (-any(self.forecast.likely_to_fail(repo.name) for repo in batch), -sum(self.forecast.seconds(repo.name) for repo in batch))
+        heapq.heappush(self.__queued, (priority, next(self.__sequence), work, batch))
+
+    def __submit(self):
+        # the scan usually outruns the merges; holding the surplus back keeps each harvest cheap
+        while self.__queued and len(self.futures) < self.concurrency and not (self.stop and self.stop.is_set()):
+            (_, _, work, batch) = heapq.heappop(self.__queued)
+            future = self.executor.submit(_timed, work, self.base, self.head, batch, self.client, self.message, self.batch_size)
+            self.futures[future] = batch
+
+def _check_stopped(stop: threading.Event, base: str, head: str):
+    if stop and stop.is_set():
+        raise Exception('Stopped merging {} into {}'.format(head, base))
+
+def _timed(work, *args) -> tuple:
+    start = time.perf_counter()
+    results = work(*args)
+    return (time.perf_counter() - start, results)
+
+def _report_times(stages: [_MergeStage], forecast: MergeForecast, report: list = None):
+    # (repository, base, predicted seconds or None without history, actual seconds) per merge request sent
+    times = [(name, stage.base, forecast.history[name].seconds if name in forecast.history else None, seconds)
+        for stage in stages for (name, (seconds, _)) in stage.times.items()]
+    predicted = [(expected, actual) for (_, _, expected, actual) in times if expected is not None]
+    unknown = [actual for (_, _, expected, actual) in times if expected is None]
+    summaries = []
+    if predicted:
+        summaries.append('Predicted {:.1f}s for the {} merges with history, which took {:.1f}s (off by {:.2f}s per merge on average)'.format(
+            sum(expected for (expected, _) in predicted), len(predicted), sum(actual for (_, actual) in predicted),
+            sum(abs(expected - actual) for (expected, actual) in predicted) / len(predicted)))
+    if unknown:
+        summaries.append('{} merges without history took {:.1f}s'.format(len(unknown), sum(unknown)))
+    summary = '; '.join(summaries) or 'No merge requests were sent'
+    logging.info(summary)
+    if report is None:
+        print_merge_times(times, summary)
 
-    logging.info('Found {} repositories matching head {}'.format(len(head_repos), head))
+def print_merge_times(times: list, summary: str, limit: int = 10):
+    """Prints the `limit` slowest of the (repository, base, predicted, actual) merge times of a run, then `summary`."""
+    print('-' * 30)
+    print('MERGE TIMES')
+    print('-' * 30)
+    for (name, base, expected, actual) in sorted(times, key=lambda entry: -entry[3])[:limit]:
+        print('{} ({}): {}, took {:.2f}s'.format(name, base, 'predicted {:.2f}s'.format(expected) if expected is not None else 'no history', actual))
+    print('-' * 30)
+    print(summary)
 
-    # get corresponding repositories with the base branch
-    names = [repo.name for repo in head_repos]
-    repos_for_merge = [repo for repo in client.get_repositories(base) if repo.ref and repo.name in names]
+def _harvest(stages: [_MergeStage], block: bool):
+    futures = [future for stage in stages for future in stage.futures]
+    if not futures:
+        return
+    (done, _) = wait(futures, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+    for stage in stages:
+        stage.harvest(done)
+
+def plan_merge(base: str, head: str, curr_rel: str, client: GitHubClient, repositories: [Repository] = None) -> tuple:
+    """
+    Finds the repositories to merge: those with both the head and base branches. Returns the number of
+    repositories with the head branch and the RepositorySet to merge, each carrying its head, base and
+    current release refs and comparisons.
+    """
+    (head_count, repos_for_merge) = _scan(base, head, curr_rel, client, repositories)
+    check_scan(base, head, head_count, repos_for_merge)
+    return (head_count, repos_for_merge)
+
+def check_scan(base: str, head: str, head_count: int, repos_for_merge: RepositorySet):
+    """Raises unless the scan found repositories with the head branch, and some of those with the base branch too."""
+    if not head_count:
+        raise Exception("No repositories were found matching the head: {}".format(head))
+
+    logging.info('Found {} repositories matching head {}'.format(head_count, head))
 
     if not repos_for_merge:
         raise Exception("No repositories were found matching the base: {}".format(base))
 
     logging.info('Found {} repositories matching base {}'.format(len(repos_for_merge), base))
 
-    logging.info('Preparing to merge the following repositories')
-    for repo in repos_for_merge:
-        logging.info("{}: {} ==>> {}".format(repo.name, head, base))
+def _scan(base: str, head: str, curr_rel: str, client: GitHubClient, repositories: [Repository] = None) -> tuple:
+    # one streamed scan of the organization fetches the head, base and current release refs for every
+    # repository; only repositories that have both the head and base branches are kept in memory
+    selection = MergeSelection(base, head, curr_rel)
+    if repositories is None:
+        repositories = client.iter_repositories_for_branches(selection.branches, selection.comparisons)
+    with client.tracer.span('scan', branches=selection.branches) as span:
+        repos_for_merge = RepositorySet(selection.select(repositories))
+        span.update(head_matches=selection.head_count, base_matches=selection.matches)
 
-    (succeeded, unprocessed, failed) = merge_branches(base, head, repos_for_merge, client)
-    auto_merge_results.append((succeeded, unprocessed, failed))
+    return (selection.head_count, repos_for_merge)
 
-    logging.info('BASE MERGE COMPLETE')
+class MergeSelection:
+    """
+    The branches and (base, head) comparisons to scan for to merge head into base, then base into
+    `curr_rel` (if given), and the filter picking the repositories to merge out of that scan: those
+    with both the head and base branches. `head_count` counts the repositories with the head branch
+    and `matches` those picked, so far.
+    """
 
-    # succeeded and unprocessed branches are eligible to be merged into the current release branch
-    eligible = []
-    eligible.extend(succeeded)
-    eligible.extend(unprocessed)
+    def __init__(self, base: str, head: str, curr_rel: str = ''):
+        self.base = base
+        self.head = head
+        self.branches = [head, base, curr_rel] if curr_rel else [head, base]
+        self.comparisons = [(base, head), (curr_rel, base)] if curr_rel else [(base, head)]
+        self.head_count = 0
+        self.matches = 0
 
-    if not curr_rel or not eligible:
-        return auto_merge_results
+    def select(self, repositories: [Repository]):
+        for repo in repositories:
+            # get repositories with the head branch (i.e. all repos with a 'REL-2910' branch)
+            if self.head not in repo.refs:
+                continue
 
-    logging.info('Beginning merge of base into current release branches...')
+            self.head_count += 1
+            # ... that also have the base branch
+            if self.base in repo.refs:
+                self.matches += 1
+                yield repo
 
-    # only merge repos that are eligible and have the current release branch
-    names = [repo.name for repo in eligible]
-    repos_for_merge = [repo for repo in client.get_repositories(curr_rel) if repo.ref and repo.name in names]
+def merge_message(head: str) -> str:
+    """The commit message of every merge of `head`."""
+    return 'Merge of {} completed by AutoMerge utility'.format(head)
 
-    if not repos_for_merge:
-        raise Exception("No eligible repositories matching the current release branch")
+def prepare_merges(base: str, head: str, repos: [Repository], journal: RunJournal) -> tuple:
+    """
+    Splits `repos` into the results a resumed run already journaled, keyed by repository name, the
+    names of repositories the scan found up to date, and the repositories still to merge.
+    """
+    # repositories a resumed run already finished keep their journaled result
+    finished = {repo.name: journal.result(base, head, repo) for repo in repos} if journal else {}
+    finished = {name: result for (name, result) in finished.items() if result is not None}
+    # repositories whose scan showed head has no commits ahead of base are skipped without a mutation
+    up_to_date = set(repo.name for repo in repos if repo.name not in finished and _is_up_to_date(repo, base, head))
+    pending = [repo for repo in repos if repo.name not in up_to_date and repo.name not in finished]
+    return (finished, up_to_date, pending)
 
-    auto_merge_results.append(merge_branches(curr_rel, base, repos_for_merge, client))
+def collect_results(base: str, head: str, repos: [Repository], client, finished: dict, up_to_date: set, results, journal: RunJournal, report: list) -> tuple:
+    """
+    Journals and reports the results of a phase split up by prepare_merges, returning its succeeded,
+    unprocessed and failed repositories. `results` yields the merge result of each pending repository, in order.
+    """
+    byName = {}
+    for repo in repos:
+        if repo.name in finished:
+            result = finished[repo.name]
+        elif repo.name in up_to_date:
+            result = GitHubError('UP_TO_DATE', 'Already merged: {} has no commits ahead of {}'.format(head, base))
+        else:
+            logging.info('Merging {}'.format(repo.name))
+            result = next(results)
 
-    logging.info('CURRENT RELEASE MERGE COMPLETE')
+        byName[repo.name] = result
+        outcome = _classify(repo, result)
+        if journal and repo.name not in finished:
+            journal.record_result(base, head, repo, outcome, result)
 
-    return auto_merge_results
+    return _report_results(base, head, repos, byName, client, len(up_to_date), len(finished), report)
 
-def merge_branches(base: str, head: str, repos: [Repository], client: GitHubClient):
+def _classify(repo: Repository, result) -> str:
+    if isinstance(result, UpdateRefResponse):
+        logging.info('{}: Fast-forwarded'.format(repo.name))
+        return 'succeeded'
+    if not isinstance(result, GitHubError):
+        logging.info('{}: Merge completed'.format(repo.name))
+        return 'succeeded'
+    if 'already merged' in result.message.lower():
+        logging.warning('{}: Already Merged'.format(repo.name))
+        return 'unprocessed'
+    logging.error('{}: Failed merge. {}'.format(repo.name, result.message))
+    return 'failed'
+
+def _report_results(base: str, head: str, repos: [Repository], results: dict, client, up_to_date: int, finished: int, report: list) -> tuple:
     succeeded = []
     unprocessed = []
     failed = []
     for repo in repos:
-        logging.info('Merging {}'.format(repo.name))
-        try:
-            merge_result = client.merge_branch(repo, base, head, 'Merge of {} completed by AutoMerge utility'.format(head))
-            logging.info('Merge completed')
-            succeeded.append((merge_result, repo))
-        except GitHubError as err:
-            if 'already merged' in err.message.lower():
-                logging.warn('{}: Already Merged'.format(repo.name))
-                unprocessed.append((err.message, repo))
-            else:
-                logging.exception('{}: Failed merge. {}'.format(repo.name, err.message))
-                failed.append((err.message, repo))
+        result = results[repo.name]
+        if not isinstance(result, GitHubError):
+            succeeded.append((result, repo))
+        elif 'already merged' in result.message.lower():
+            unprocessed.append((result.message, repo))
+        else:
+            failed.append((result.message, repo))
+
+    fast_forwarded = [(result, repo) for (result, repo) in succeeded if isinstance(result, UpdateRefResponse)]
+    outcomes = (('succeeded', len(succeeded) - len(fast_forwarded)), ('fast_forwarded', len(fast_forwarded)), ('unprocessed', len(unprocessed)), ('failed', len(failed)))
+    for (outcome, count) in outcomes:
+        client.tracer.increment('merges_total', count, base=base, outcome=outcome)
 
+    if report is not None:
+        report.append((base, head, succeeded, unprocessed, failed, up_to_date, finished))
+    else:
+        print_merge_results(succeeded, unprocessed, failed, up_to_date, finished)
+
+    succeeded = [repo for (_, repo) in succeeded]
+    unprocessed = [repo for (_, repo) in unprocessed]
+    failed = [repo for (_, repo) in failed]
+
+    return (succeeded, unprocessed, failed)
+
+def print_merge_results(succeeded: list, unprocessed: list, failed: list, up_to_date: int = 0, finished: int = 0):
+    """
+    Prints the (MergeResponse, repo) and (message, repo) pairs of one merge phase. Succeeded pairs
+    holding an UpdateRefResponse were fast-forwarded and get a block of their own.
+    """
+    fast_forwarded = [(result, repo) for (result, repo) in succeeded if isinstance(result, UpdateRefResponse)]
     print('-' * 30)
     print('SUCCEEDED')
     print('-' * 30)
     for (result, repo) in succeeded:
-        print("{}: {}".format(repo.name, result.commit_url))
+        if not isinstance(result, UpdateRefResponse):
+            print("{}: {}".format(repo.name, result.commit_url))
     print('-' * 30)
 
+    if fast_forwarded:
+        print('-' * 30)
+        print('FAST-FORWARDED')
+        print('-' * 30)
+        for (result, repo) in fast_forwarded:
+            print("{}: {}".format(repo.name, result.commit_url))
+        print('-' * 30)
+
     print('-' * 30)
     print('UNPROCESSED')
     print('-' * 30)
@@ -94,8 +458,43 @@ def merge_branches(base: str, head: str, repos: [Repository], client: GitHubClie
         print('{}: {}'.format(repo.name, message))
     print('-' * 30)
 
-    succeeded = [repo for (_, repo) in succeeded]
-    unprocessed = [repo for (_, repo) in unprocessed]
-    failed = [repo for (_, repo) in failed]
+    if up_to_date:
+        print('Skipped {} merge mutations for repositories already up to date'.format(up_to_date))
+    if finished:
+        print('Skipped {} repositories finished by the run being resumed'.format(finished))
+
+def _is_up_to_date(repo: Repository, base: str, head: str) -> bool:
+    comparison = repo.comparisons.get((base, head))
+    return comparison is not None and comparison.ahead_by == 0
+
+def _is_fast_forward(repo: Repository, base: str, head: str) -> bool:
+    # base is an ancestor of head, so moving base to head's commit loses nothing
+    comparison = repo.comparisons.get((base, head))
+    return comparison is not None and comparison.ahead_by > 0 and comparison.behind_by == 0
+
+def _merge_batch(base: str, head: str, batch: [Repository], client: GitHubClient, message: str, batch_size: int) -> list:
+    with client.tracer.span('merge', base=base, head=head, repositories=[repo.name for repo in batch]):
+        if batch_size > 1:
+            return client.merge_branches(batch, base, head, message, batch_size)
+
+        try:
+            return [client.merge_branch(batch[0], base, head, message)]
+        except GitHubError as err:
+            return [err]
+
+def _fast_forward_batch(base: str, head: str, batch: [Repository], client: GitHubClient, message: str, batch_size: int) -> list:
+    with client.tracer.span('fast_forward', base=base, head=head, repositories=[repo.name for repo in batch]):
+        if batch_size > 1:
+            results = client.fast_forward_branches(batch, base, head, batch_size)
+        else:
+            try:
+                results = [client.fast_forward(batch[0], base, head)]
+            except GitHubError as err:
+                results = [err]
 
-    return (succeeded, unprocessed, failed)
\ No newline at end of file
+    # GitHub refuses the update if base has moved off head's history since the scan; merge those instead
+    retry = [i for (i, result) in enumerate(results) if isinstance(result, GitHubError)]
+    if retry:
+        for (i, result) in zip(retry, _merge_batch(base, head, [batch[i] for i in retry], client, message, batch_size)):
+            results[i] = result
+    return results
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import time
+from http import HTTPStatus
+from github.async_connection import AsyncConnectionPool
+from github.cache import RepositoryCache
+from github.client import (GitHubClient, _batched_inputs, _batches, _branch_scan, _checked_response, _found_nodes, _merge_branch_input, _node_lookup, _page,
+    _ref_oids, _refresh_inventory, _request_body, _request_headers, _validate_write_permissions)
+from github.decoding import EdgeDecoder, decompress
+from github import queries
+from github.scheduler import RequestScheduler
+from github.tracing import Tracer
+from github.types import Repository, RepositorySet, GitHubError, GitHubHttpError, UpdateRefResponse, MergeResponse
+
+class AsyncGitHubClient:
+    """
+    asyncio counterpart of GitHubClient with its scan and merge methods, each a coroutine (or an
+    async generator for the iter_* methods); fast_forward and fast_forward_branches aren't ported. Requests share one AsyncConnectionPool, so any number of
+    them can be awaited together while at most `pool.size` are on the wire.
+    """
+
+    default_api_url = GitHubClient.default_api_url
+    __pageSize = 100
+
+    def __init__(self, token: str = '', org: str = '', pool: AsyncConnectionPool = None, scheduler: RequestScheduler = None, cache: RepositoryCache = None, tracer: Tracer = None,
+            nodeBatchSize: int = 100, scanConcurrency: int = 1):
+        if not 1 <= nodeBatchSize <= self.__pageSize:
+            raise ValueError('nodeBatchSize must be between 1 and {}'.format(self.__pageSize))
+        self.api_token = token
+        self.organization = org
+        self.pool = pool if pool else AsyncGitHubClient.create_pool()
+        self.scheduler = scheduler if scheduler else RequestScheduler()
+        self.cache = cache
+        self.tracer = tracer if tracer else Tracer()
+        self.node_batch_size = nodeBatchSize
+        self.scan_concurrency = max(scanConcurrency, 1)
+
+    @staticmethod
+    def create_pool(size: int = 50, apiUrl: str = default_api_url) -> AsyncConnectionPool:
+        return AsyncConnectionPool.from_url(apiUrl, size=size)
+
+    async def close(self):
+        await self.pool.close()
+        if self.cache:
+            self.cache.close()
+
+    async def get_repositories(self, branchName: str) -> [Repository]:
+        return [repository async for repository in self.iter_repositories(branchName)]
+
+    async def iter_repositories(self, branchName: str):
+        variables = {'org': self.organization, 'qualifiedName': queries.qualified_branch_name(branchName)}
+        async for repository in self.__iter_repository_pages(queries.REPOSITORIES, variables, lambda node: Repository.create_from_node(node)):
+            yield repository
+
+    async def get_repositories_for_branches(self, branchNames: [str], comparisons: [tuple] = ()) -> RepositorySet:
+        return RepositorySet([repository async for repository in self.iter_repositories_for_branches(branchNames, comparisons)])
+
+    async def iter_repositories_for_branches(self, branchNames: [str], comparisons: [tuple] = ()):
+        """See GitHubClient.iter_repositories_for_branches. Up to scan_concurrency node lookups are awaited at once."""
+        branchNames = list(dict.fromkeys(branchNames))
+        comparisons = list(dict.fromkeys(comparisons))
+        if self.scan_concurrency > 1:
+            if self.cache:
+                ids = [repository.id for repository in await self.get_repository_inventory()]
+            else:
+                ids = [id async for id in self.__iter_repository_pages(queries.REPOSITORY_IDS, {'org': self.organization}, lambda node: node['id'])]
+            async for repository in self.__iter_repository_nodes(ids, branchNames, comparisons):
+                yield repository
+            return
+
+        async for repository in self.__iter_repository_pages(*_branch_scan(self.organization, branchNames, comparisons)):
+            yield repository
+
+    async def __iter_repository_nodes(self, ids: [str], branchNames: [str], comparisons: [tuple]):
+        (query, refVariables, items) = _node_lookup(branchNames, comparisons)
+        batches = _batches(ids, self.node_batch_size)
+        pending = []
+
+        async def lookup(batch: list) -> list:
+            response = await self.__make_graphql_request(query, dict(refVariables, ids=batch), items=items)
+            return _found_nodes(batch, response, self.cache, self.organization)
+
+        try:
+            for batch in batches:
+                pending.append(asyncio.ensure_future(lookup(batch)))
+                if len(pending) >= self.scan_concurrency:
+                    for repository in await pending.pop(0):
+                        yield repository
+            while pending:
+                for repository in await pending.pop(0):
+                    yield repository
+        finally:
+            for page in pending:
+                page.cancel()
+
+    async def get_repository_inventory(self) -> [Repository]:
+        """See GitHubClient.get_repository_inventory."""
+        watermark = self.cache.watermark(self.organization) if self.cache else None
+        changed = []
+        async for repository in self.__iter_repository_pages(queries.REPOSITORY_INVENTORY, {'org': self.organization},
+                lambda node: Repository.create_from_node(node)):
+            if watermark and repository.updated_at < watermark:
+                break
+            changed.append(repository)
+
+        return _refresh_inventory(self.cache, self.organization, watermark, changed)
+
+    async def __iter_repository_pages(self, query: str, variables: dict, createRepository):
+        # organization pages are cursor-linked, so each page waits on the one before it
+        cursor = None
+        while True:
+            response = await self.__make_graphql_request(query, dict(variables, after=cursor), items=('edges', lambda edge: createRepository(edge['node'])))
+            (repositories, cursor) = _page(response)
+            for repository in repositories:
+                yield repository
+            if cursor is None:
+                return
+
+    async def get_ref_oids(self, refIds: [str]) -> dict:
+        """See GitHubClient.get_ref_oids. Every batch of 100 refs is looked up at once."""
+        batches = list(_batches(refIds, self.__pageSize))
+        responses = await asyncio.gather(*[self.__make_graphql_request(queries.REF_NODES, {'ids': ids}, raiseErrors=False) for ids in batches])
+        oids = {}
+        for (ids, response) in zip(batches, responses):
+            oids.update(_ref_oids(ids, response))
+        return oids
+
+    async def merge_branch(self, repository: Repository, base: str, head: str, commitMessage: str = '') -> MergeResponse:
+        _validate_write_permissions(repository)
+        variables = {'input': _merge_branch_input(repository, base, head, commitMessage)}
+        response = await self.__make_graphql_request(queries.MERGE_BRANCH, variables)
+
+        return MergeResponse.create(response)
+
+    async def merge_branches(self, repositories: [Repository], base: str, head: str, commitMessage: str = '', batchSize: int = 25) -> list:
+        """See GitHubClient.merge_branches. All batches are sent at once."""
+        (results, batches) = _batched_inputs(repositories, batchSize, lambda repository: _merge_branch_input(repository, base, head, commitMessage))
+
+        async def merge_batch(batch: [int], variables: dict):
+            try:
+                response = await self.__make_graphql_request(queries.merge_branches(len(batch)), variables, raiseErrors=False)
+                batchResults = MergeResponse.create_batch(response, len(batch))
+            except GitHubError as err:
+                # a request that fails as a whole fails each of its merges, not the run
+                batchResults = [err] * len(batch)
+            for (i, result) in zip(batch, batchResults):
+                results[i] = result
+
+        await asyncio.gather(*[merge_batch(batch, variables) for (batch, variables) in batches])
+        return results
+
+    async def update_ref(self, repository: Repository, commitHash: str, force: bool = False) -> UpdateRefResponse:
+        _validate_write_permissions(repository)
+        variables = {'input': {'refId': repository.ref.id, 'oid': commitHash, 'force': force}}
+        response = await self.__make_graphql_request(queries.UPDATE_REF, variables)
+
+        return UpdateRefResponse.create(response)
+
+    async def __make_graphql_request(self, query: str, variables: dict = None, raiseErrors: bool = True, items: tuple = None) -> dict:
+        # see GitHubClient.__make_graphql_request for `items`
+        (operation, body) = _request_body(query, variables)
+        return await self.scheduler.execute_async(lambda: self.__send_graphql_request(operation, body, raiseErrors, items))
+
+    async def __send_graphql_request(self, operation: str, body: str, raiseErrors: bool, items: tuple = None) -> dict:
+        headers = _request_headers(self.api_token)
+        start = time.perf_counter()
+        response = await self.pool.request('POST', '/graphql', body=body, headers=headers)
+        latency = time.perf_counter() - start
+        self.scheduler.record_headers(response.headers)
+        wireBytes = len(response.read())
+        content = decompress(response.read(), response.getheader('Content-Encoding'))
+
+        if response.status != HTTPStatus.OK:
+            self.tracer.record_request(operation, response.status, latency, wireBytes, 0.0)
+            raise GitHubHttpError.create(response.status, response.reason, response.headers, content)
+
+        start = time.perf_counter()
+        if items:
+            # the body is already here, but decoding it element by element still skips building the page's dict tree
+            decoder = EdgeDecoder(items[1], items[0])
+            decoder.feed(content)
+            data = decoder.close()
+        else:
+            data = json.loads(content)
+        rateLimit = ((data or {}).get('data') or {}).get('rateLimit')
+        self.tracer.record_request(operation, response.status, latency, wireBytes, time.perf_counter() - start,
+            rateLimit.get('cost') if rateLimit else None)
+
+        return _checked_response(data, self.scheduler, raiseErrors)
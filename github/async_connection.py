@@ -0,0 +1,154 @@
+import asyncio
+import http.client
+import ssl
+import time
+from collections import deque
+from email.parser import BytesParser
+from urllib.parse import urlsplit
+
+class AsyncResponse:
+    """A fully read HTTP response; the connection it arrived on is already back in its pool."""
+
+    __slots__ = ('status', 'reason', 'headers', 'body')
+
+    def __init__(self, status: int, reason: str, headers, body: bytes):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def read(self) -> bytes:
+        return self.body
+
+    def getheader(self, name: str, default: str = None) -> str:
+        return self.headers.get(name, default)
+
+class AsyncConnectionPool:
+    """
+    Pool of keep-alive HTTP/1.1 connections to a single host, built on asyncio streams.
+
+    At most `size` requests are in flight at once, each on its own connection; any number of
+    coroutines may wait their turn on the pool's semaphore without holding a thread. Idle
+    connections older than `idle_timeout` seconds are discarded rather than reused, and a request
+    that fails on a reused socket the server has already dropped is retried once on a fresh one.
+    """
+
+    __droppedSocketErrors = (ConnectionError, asyncio.IncompleteReadError)
+
+    def __init__(self, host: str, port: int = 443, secure: bool = True, size: int = 50, idle_timeout: float = 30.0, timeout: float = 60.0):
+        if size < 1:
+            raise ValueError('Connection pool size must be at least 1')
+
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connections_opened = 0
+        self.requests_sent = 0
+        self.__idle = deque()
+        self.__available = asyncio.BoundedSemaphore(size)
+        self.__sslContext = ssl.create_default_context() if secure else None
+        self.__hostHeader = host if port == (443 if secure else 80) else '{}:{}'.format(host, port)
+
+    @staticmethod
+    def from_url(url: str, **kwargs) -> 'AsyncConnectionPool':
+        parts = urlsplit(url)
+        secure = parts.scheme != 'http'
+        return AsyncConnectionPool(parts.hostname, parts.port or (443 if secure else 80), secure, **kwargs)
+
+    async def request(self, method: str, url: str, body=None, headers: dict = None) -> AsyncResponse:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        message = self.__encode_request(method, url, body or b'', headers or {})
+
+        async with self.__available:
+            (conn, reused) = await self.__acquire()
+            try:
+                (response, reusable) = await self.__send(conn, message)
+            except self.__droppedSocketErrors:
+                self.__discard(conn)
+                if not reused:
+                    raise
+                # the server closed the idle socket under us; retry once on a new connection
+                (conn, _) = await self.__acquire(fresh=True)
+                (response, reusable) = await self.__send(conn, message)
+
+            if reusable:
+                self.__idle.append((conn, time.monotonic()))
+            else:
+                self.__discard(conn)
+            return response
+
+    async def close(self):
+        while self.__idle:
+            ((_, writer), _) = self.__idle.pop()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    def __encode_request(self, method: str, url: str, body: bytes, headers: dict) -> bytes:
+        lines = ['{} {} HTTP/1.1'.format(method, url), 'Host: {}'.format(self.__hostHeader)]
+        lines += ['{}: {}'.format(name, value) for (name, value) in headers.items()]
+        lines.append('Content-Length: {}'.format(len(body)))
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+    async def __send(self, conn, message: bytes) -> tuple:
+        self.requests_sent += 1
+        try:
+            return await asyncio.wait_for(self.__exchange(conn, message), self.timeout)
+        except BaseException:
+            self.__discard(conn)
+            raise
+
+    async def __exchange(self, conn, message: bytes) -> tuple:
+        (reader, writer) = conn
+        writer.write(message)
+        await writer.drain()
+
+        statusLine = await reader.readuntil(b'\r\n')
+        (version, status, reason) = (statusLine.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        headers = BytesParser(_class=http.client.HTTPMessage).parsebytes(await reader.readuntil(b'\r\n\r\n'))
+        body = await read_body(reader, headers)
+
+        reusable = version == 'HTTP/1.1' and (headers.get('Connection') or '').lower() != 'close' and (
+            'Content-Length' in headers or 'chunked' in (headers.get('Transfer-Encoding') or '').lower())
+        return (AsyncResponse(int(status), reason, headers, body), reusable)
+
+    async def __acquire(self, fresh: bool = False) -> tuple:
+        if not fresh:
+            now = time.monotonic()
+            while self.__idle:
+                (conn, last_used) = self.__idle.pop()
+                if now - last_used <= self.idle_timeout and not conn[0].at_eof():
+                    return (conn, True)
+                self.__discard(conn)
+
+        self.connections_opened += 1
+        conn = await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=self.__sslContext), self.timeout)
+        return (conn, False)
+
+    def __discard(self, conn):
+        conn[1].close()
+
+async def read_body(reader: asyncio.StreamReader, headers) -> bytes:
+    """Reads a response body delimited by Content-Length, chunked transfer encoding or end of stream."""
+    if 'chunked' in (headers.get('Transfer-Encoding') or '').lower():
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # skip any trailers up to the blank line that ends the message
+                while (await reader.readuntil(b'\r\n')) != b'\r\n':
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    if 'Content-Length' in headers:
+        return await reader.readexactly(int(headers['Content-Length']))
+
+    return await reader.read()
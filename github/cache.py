@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import threading
+import time
+from github.types import Repository
+
+class RepositoryCache:
+    """
+    Local SQLite store of each organization's repository inventory (id, name, viewerPermission).
+
+    The inventory is refreshed incrementally: GitHubClient lists repositories ordered by
+    UPDATED_AT and stops at the watermark saved by the previous refresh. Renames and new
+    repositories bump updatedAt, but deletions and permission changes do not, so an inventory
+    older than `ttl` seconds is rebuilt from a full listing. Organizations that haven't been
+    used for `evict_after` seconds are dropped from the cache.
+    """
+
+    def __init__(self, path: str, ttl: float = 24 * 60 * 60, evict_after: float = 30 * 24 * 60 * 60, clock=time.time):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl
+        self.evict_after = evict_after
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript("""
+            CREATE TABLE IF NOT EXISTS inventories (
+                org TEXT PRIMARY KEY,
+                watermark TEXT,
+                refreshed_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS repositories (
+                org TEXT NOT NULL,
+                id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                permission TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (org, id)
+            );
+        """)
+        self.evict()
+
+    @staticmethod
+    def default_path(cacheDir: str) -> str:
+        return os.path.join(os.path.expanduser(cacheDir), 'inventory.sqlite3')
+
+    def watermark(self, org: str) -> str:
+        """The newest updatedAt seen for the organization, or None when a full listing is required."""
+        with self.__lock:
+            row = self.__db.execute('SELECT watermark, refreshed_at FROM inventories WHERE org = ?', (org,)).fetchone()
+
+        if not row or self.__clock() - row[1] > self.ttl:
+            return None
+
+        return row[0]
+
+    def store(self, org: str, repositories: [Repository], watermark: str, replace: bool = False):
+        """Upserts changed repositories. `replace` discards everything else, for full listings."""
+        now = self.__clock()
+        rows = [(org, repo.id, repo.name, repo.permission, repo.updated_at) for repo in repositories]
+        with self.__lock, self.__db:
+            if replace:
+                self.__db.execute('DELETE FROM repositories WHERE org = ?', (org,))
+                self.__db.execute('DELETE FROM inventories WHERE org = ?', (org,))
+            self.__db.executemany('INSERT OR REPLACE INTO repositories VALUES (?, ?, ?, ?, ?)', rows)
+            # only a full listing resets the ttl clock; incremental refreshes just advance the watermark
+            self.__db.execute("""
+                INSERT INTO inventories VALUES (?, ?, ?, ?)
+                ON CONFLICT (org) DO UPDATE SET watermark = excluded.watermark, used_at = excluded.used_at
+            """, (org, watermark, now, now))
+
+    def remove(self, org: str, ids: [str]):
+        """Drops repositories that no longer exist, which the next full listing would otherwise have done."""
+        with self.__lock, self.__db:
+            self.__db.executemany('DELETE FROM repositories WHERE org = ? AND id = ?', [(org, id) for id in ids])
+
+    def repositories(self, org: str) -> [Repository]:
+        with self.__lock:
+            rows = self.__db.execute(
+                'SELECT id, name, permission, updated_at FROM repositories WHERE org = ? ORDER BY name', (org,)).fetchall()
+
+        return [Repository(id, name, permission, None, updated_at=updated_at) for (id, name, permission, updated_at) in rows]
+
+    def evict(self):
+        cutoff = self.__clock() - self.evict_after
+        with self.__lock, self.__db:
+            self.__db.execute('DELETE FROM repositories WHERE org IN (SELECT org FROM inventories WHERE used_at < ?)', (cutoff,))
+            self.__db.execute('DELETE FROM inventories WHERE used_at < ?', (cutoff,))
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
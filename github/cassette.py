@@ -0,0 +1,166 @@
+import base64
+import http.client
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from github import queries
+
+class CassetteError(Exception):
+    """A replayed request that the cassette has no (more) recorded responses for."""
+
+class CassetteResponse:
+    """A response held in memory, with the part of the PooledResponse interface GitHubClient reads."""
+
+    def __init__(self, status: int, reason: str, headers: list, content: bytes):
+        self.status = status
+        self.reason = reason
+        self.headers = http.client.HTTPMessage()
+        for (name, value) in headers:
+            self.headers[name] = value
+        self.__content = io.BytesIO(content)
+
+    def read(self, amt: int = None) -> bytes:
+        return self.__content.read(amt)
+
+    def getheader(self, name: str, default: str = None) -> str:
+        return self.headers.get(name, default)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class RecordingTransport:
+    """
+    Wraps a ConnectionPool (or any transport with its `request` method) and appends every request
+    and response it carries to a cassette: a JSON Lines file with one interaction per line holding
+    the request, the response status, headers and body exactly as received (still compressed, if
+    it was), and when the request started and how long it took. The access token is scrubbed from
+    everything written.
+    """
+
+    def __init__(self, transport, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.transport = transport
+        self.path = path
+        self.interactions = 0
+        self.__lock = threading.Lock()
+        self.__start = time.perf_counter()
+        self.__file = open(path, 'w', encoding='utf-8')
+        self.__file.write(json.dumps({'type': 'cassette', 'version': 1, 'recorded_at': time.time()}) + '\n')
+
+    @property
+    def size(self) -> int:
+        return self.transport.size
+
+    @property
+    def requests_sent(self) -> int:
+        return self.transport.requests_sent
+
+    @property
+    def connections_opened(self) -> int:
+        return self.transport.connections_opened
+
+    def request(self, method: str, url: str, body=None, headers: dict = None) -> CassetteResponse:
+        headers = headers or {}
+        start = time.perf_counter()
+        with self.transport.request(method, url, body=body, headers=headers) as response:
+            (status, reason, responseHeaders, content) = (response.status, response.reason, list(response.headers.items()), response.read())
+        latency = time.perf_counter() - start
+
+        token = _token(headers)
+        body = body.decode() if isinstance(body, bytes) else body or ''
+        interaction = {
+            'type': 'interaction',
+            'method': method,
+            'url': url,
+            'operation': queries.operation_name(json.loads(body).get('query', '')) if body else None,
+            'request_headers': {name: _scrub(value, token) for (name, value) in headers.items()},
+            'body': _scrub(body, token),
+            'started': start - self.__start,
+            'latency': latency,
+            'status': status,
+            'reason': reason,
+            'headers': [[name, _scrub(value, token)] for (name, value) in responseHeaders],
+            'response': base64.b64encode(content).decode('ascii')
+        }
+        with self.__lock:
+            self.__file.write(json.dumps(interaction, separators=(',', ':')) + '\n')
+            self.__file.flush()
+            self.interactions += 1
+        return CassetteResponse(status, reason, responseHeaders, content)
+
+    def close(self):
+        self.transport.close()
+        with self.__lock:
+            self.__file.close()
+
+class ReplayTransport:
+    """
+    Serves the responses of a cassette written by RecordingTransport, without any network access.
+
+    A request is answered with the next unused response recorded for the same method, URL and body,
+    so retried and repeated requests get their responses in recorded order however concurrent
+    requests interleave. With `speed`, each response is held back for its recorded latency divided
+    by `speed` (1.0 replays at recorded speed), with at most `size` requests waiting at once like a
+    pool of that size; without it responses are served as fast as possible. A request the cassette
+    can't answer raises CassetteError.
+    """
+
+    def __init__(self, path: str, speed: float = None, size: int = 4):
+        self.path = path
+        self.speed = speed
+        self.size = size
+        self.requests_sent = 0
+        self.connections_opened = 0
+        self.__lock = threading.Lock()
+        self.__available = threading.BoundedSemaphore(size)
+        self.__responses = {}
+        with open(path, encoding='utf-8') as cassette:
+            for line in cassette:
+                record = json.loads(line)
+                if record['type'] == 'interaction':
+                    self.__responses.setdefault((record['method'], record['url'], record['body']), deque()).append(record)
+
+    @property
+    def remaining(self) -> int:
+        """Recorded responses no request has asked for yet."""
+        with self.__lock:
+            return sum(len(responses) for responses in self.__responses.values())
+
+    def request(self, method: str, url: str, body=None, headers: dict = None) -> CassetteResponse:
+        body = body.decode() if isinstance(body, bytes) else body or ''
+        token = _token(headers or {})
+        with self.__lock:
+            self.requests_sent += 1
+            # the cassette holds scrubbed bodies, so the live token is scrubbed before matching
+            responses = self.__responses.get((method, url, _scrub(body, token)))
+            record = responses.popleft() if responses else None
+        if record is None:
+            operation = queries.operation_name(json.loads(body).get('query', '')) if body else url
+            raise CassetteError('No recorded response left for {} {} ({})'.format(method, url, operation))
+
+        if self.speed:
+            with self.__available:
+                time.sleep(record['latency'] / self.speed)
+        return CassetteResponse(record['status'], record['reason'], record['headers'], base64.b64decode(record['response']))
+
+    def close(self):
+        pass
+
+def _token(headers: dict) -> str:
+    authorization = headers.get('Authorization') or ''
+    return authorization.partition(' ')[2] or None
+
+def _scrub(text: str, token: str) -> str:
+    return text.replace(token, '<scrubbed>') if token and text else text
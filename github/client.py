@@ -1,160 +1,333 @@
-import http.client
 import json
-import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
-from string import Template
-from github.types import Repository, Ref, GitHubError, UpdateRefResponse, MergeResponse, GitHubPermissionError
+from itertools import islice
+from github.cache import RepositoryCache
+from github.connection import ConnectionPool
+from github.decoding import ACCEPT_ENCODING, EdgeDecoder, ResponseBody
+from github import queries
+from github.scheduler import RequestScheduler
+from github.tracing import Tracer
+from github.types import Repository, RepositorySet, GitHubError, GitHubHttpError, UpdateRefResponse, MergeResponse, GitHubPermissionError
+
+_USER_AGENT = 'OT-AutoMergeUtility'
+_MERGE_PERMISSIONS = ['ADMIN','MAINTAIN', 'WRITE']
 
 class GitHubClient:
 
-    __apiUrl = 'api.github.com'
-    __userAgent = 'OT-AutoMergeUtility'
-    __validMergePermissions = ['ADMIN','MAINTAIN', 'WRITE']
+    default_api_url = 'https://api.github.com'
+    __pageSize = 100
 
-    def __init__(self, token: str = '', org: str = ''):
+    def __init__(self, token: str = '', org: str = '', pool: ConnectionPool = None, scheduler: RequestScheduler = None, cache: RepositoryCache = None, tracer: Tracer = None,
+            nodeBatchSize: int = 100, scanConcurrency: int = 1):
+        if not 1 <= nodeBatchSize <= self.__pageSize:
+            raise ValueError('nodeBatchSize must be between 1 and {}'.format(self.__pageSize))
         self.api_token = token
         self.organization = org
+        # all client methods share one pool so repeated calls reuse the same TLS sessions. Anything with
+        # the pool's request method will do, i.e. a RecordingTransport or ReplayTransport from github.cassette
+        self.pool = pool if pool else GitHubClient.create_pool()
+        # ... and one scheduler so concurrent callers draw on the same rate limit budget
+        self.scheduler = scheduler if scheduler else RequestScheduler()
+        self.cache = cache
+        self.tracer = tracer if tracer else Tracer()
+        # repositories per nodes(ids: [...]) lookup, and how many lookups a scan keeps in flight
+        self.node_batch_size = nodeBatchSize
+        self.scan_concurrency = max(scanConcurrency, 1)
+
+    @staticmethod
+    def create_pool(size: int = 4, apiUrl: str = default_api_url) -> ConnectionPool:
+        return ConnectionPool.from_url(apiUrl, size=size)
+
+    def close(self):
+        self.pool.close()
+        if self.cache:
+            self.cache.close()
 
     def get_repositories(self, branchName: str) -> [Repository]:
+        return list(self.iter_repositories(branchName))
+
+    def iter_repositories(self, branchName: str):
+        """Lazily yields every repository in the organization, one page at a time."""
+        variables = {'org': self.organization, 'qualifiedName': queries.qualified_branch_name(branchName)}
+        yield from self.__iter_repository_pages(queries.REPOSITORIES, variables, lambda node: Repository.create_from_node(node))
+
+    def get_repositories_for_branches(self, branchNames: [str], comparisons: [tuple] = ()) -> RepositorySet:
+        return RepositorySet(self.iter_repositories_for_branches(branchNames, comparisons))
+
+    def iter_repositories_for_branches(self, branchNames: [str], comparisons: [tuple] = ()):
+        """
+        Yields repositories carrying a Ref for each requested branch they have. Each (base, head)
+        pair in `comparisons` is also compared in the same request, so callers can tell which
+        repositories have nothing to merge before issuing any mutation.
+        """
+        branchNames = list(dict.fromkeys(branchNames))
+        comparisons = list(dict.fromkeys(comparisons))
+        if self.scan_concurrency > 1:
+            # two stages: list the repository ids (from the cache when there is one), then look up the
+            # refs of each batch of ids by node id. Unlike cursor pages, the lookups don't depend on
+            # each other, so they can be sent in parallel while the listing is still running. A
+            # sequential scan gains nothing from the cache: one page of refs costs a request either way.
+            if self.cache:
+                ids = [repository.id for repository in self.get_repository_inventory()]
+            else:
+                ids = self.__iter_repository_pages(queries.REPOSITORY_IDS, {'org': self.organization}, lambda node: node['id'])
+            yield from self.__iter_repository_nodes(ids, branchNames, comparisons)
+            return
+
+        # a single paginated scan fetches every requested branch via aliased ref fields
+        yield from self.__iter_repository_pages(*_branch_scan(self.organization, branchNames, comparisons))
+
+    def __iter_repository_nodes(self, ids, branchNames: [str], comparisons: [tuple]):
+        (query, refVariables, items) = _node_lookup(branchNames, comparisons)
+
+        def lookup(batch: list) -> list:
+            response = self.__make_graphql_request(query, dict(refVariables, ids=batch), items=items)
+            return _found_nodes(batch, response, self.cache, self.organization)
+
+        batches = _batches(ids, self.node_batch_size)
+        # batches are yielded in listing order; at most scan_concurrency of them are requested ahead of the caller
+        with ThreadPoolExecutor(self.scan_concurrency, thread_name_prefix='scan') as executor:
+            pending = deque()
+            try:
+                for batch in batches:
+                    pending.append(executor.submit(lookup, batch))
+                    if len(pending) >= self.scan_concurrency:
+                        yield from pending.popleft().result()
+                while pending:
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
 
-        def inner_get_repositories(branchName: str, cursor: str = '', limit: int = 100):
-            query = self.__get_repositories_graphql_query(self.organization, branchName, cursor)
-            response = self.__make_graphql_request(query)
-            repositories = Repository.create(response)
+    def get_repository_inventory(self) -> [Repository]:
+        """
+        Lists the id, name and viewer permission of every repository in the organization.
+        When a cache is configured only repositories updated since the last refresh are fetched.
+        """
+        watermark = self.cache.watermark(self.organization) if self.cache else None
+        changed = []
+        for repository in self.__iter_repository_pages(queries.REPOSITORY_INVENTORY, {'org': self.organization},
+                lambda node: Repository.create_from_node(node)):
+            # repositories arrive most recently updated first, so everything past the watermark is already cached
+            if watermark and repository.updated_at < watermark:
+                break
+            changed.append(repository)
 
-            if len(repositories) >= limit:
-                cursor = response["data"]["organization"]["repositories"]["edges"][-1]["cursor"]
-                repositories.extend(inner_get_repositories(branchName, cursor, limit))
+        return _refresh_inventory(self.cache, self.organization, watermark, changed)
 
-            return repositories
+    def __iter_repository_pages(self, query: str, variables: dict, createRepository):
+        cursor = None
+        while True:
+            response = self.__make_graphql_request(query, dict(variables, after=cursor), items=('edges', lambda edge: createRepository(edge['node'])))
+            (repositories, cursor) = _page(response)
+            yield from repositories
+            if cursor is None:
+                return
 
-        return inner_get_repositories(branchName)
+    def get_ref_oids(self, refIds: [str]) -> dict:
+        """Maps each ref node id to the oid it points at now, or to None if the ref no longer exists."""
+        oids = {}
+        for start in range(0, len(refIds), self.__pageSize):
+            ids = refIds[start:start + self.__pageSize]
+            # a deleted ref only nulls its own node, so per-node errors don't fail the batch
+            oids.update(_ref_oids(ids, self.__make_graphql_request(queries.REF_NODES, {'ids': ids}, raiseErrors=False)))
+        return oids
 
     def merge_branch(self, repository: Repository, base: str, head: str, commitMessage: str = '') -> MergeResponse:
-        self.__validate_write_permissions(repository)
-        query = self.__get_merge_branch_graphql_query(repository.id, base, head, commitMessage)
-        response = self.__make_graphql_request(query)
+        _validate_write_permissions(repository)
+        variables = {'input': _merge_branch_input(repository, base, head, commitMessage)}
+        response = self.__make_graphql_request(queries.MERGE_BRANCH, variables)
 
         return MergeResponse.create(response)
 
+    def merge_branches(self, repositories: [Repository], base: str, head: str, commitMessage: str = '', batchSize: int = 25) -> list:
+        """
+        Merges head into base for each repository, packing up to `batchSize` aliased mergeBranch
+        mutations into each request. Returns one entry per repository, in order: either the
+        MergeResponse or the GitHubError raised for that repository.
+        """
+        return self.__send_batches(repositories, batchSize, lambda repository: _merge_branch_input(repository, base, head, commitMessage),
+            queries.merge_branches, MergeResponse.create_batch)
+
+    def fast_forward(self, repository: Repository, base: str, head: str) -> UpdateRefResponse:
+        """
+        Moves base to head's commit without a merge commit. The update is not forced, so GitHub
+        refuses it unless base is still an ancestor of head.
+        """
+        _validate_write_permissions(repository)
+        variables = {'input': _fast_forward_input(repository, base, head)}
+        response = self.__make_graphql_request(queries.UPDATE_REF, variables)
+
+        return UpdateRefResponse.create(response)
+
+    def fast_forward_branches(self, repositories: [Repository], base: str, head: str, batchSize: int = 25) -> list:
+        """
+        fast_forward for each repository, packing up to `batchSize` aliased updateRef mutations into
+        each request. Returns the UpdateRefResponse or GitHubError of each repository, in order.
+        """
+        return self.__send_batches(repositories, batchSize, lambda repository: _fast_forward_input(repository, base, head),
+            queries.update_refs, UpdateRefResponse.create_batch)
+
+    def __send_batches(self, repositories: [Repository], batchSize: int, createInput, createDocument, createBatch) -> list:
+        # createDocument(n) is a document of n aliased mutations, whose results createBatch(response, n) maps back
+        (results, batches) = _batched_inputs(repositories, batchSize, createInput)
+        for (batch, variables) in batches:
+            try:
+                response = self.__make_graphql_request(createDocument(len(batch)), variables, raiseErrors=False)
+                batchResults = createBatch(response, len(batch))
+            except GitHubError as err:
+                # a request that fails as a whole fails each of its mutations, not the run
+                batchResults = [err] * len(batch)
+            for (i, result) in zip(batch, batchResults):
+                results[i] = result
+
+        return results
+
     def update_ref(self, repository: Repository, commitHash: str, force: bool = False) -> UpdateRefResponse:
-        self.__validate_write_permissions(repository)
-        query = self.__get_update_ref_graphql_query(repository.ref.id, commitHash, force)
-        response = self.__make_graphql_request(query)
+        _validate_write_permissions(repository)
+        variables = {'input': {'refId': repository.ref.id, 'oid': commitHash, 'force': force}}
+        response = self.__make_graphql_request(queries.UPDATE_REF, variables)
 
         return UpdateRefResponse.create(response)
 
-    def __validate_write_permissions(self, repository: Repository):
-        if repository.permission not in self.__validMergePermissions:
-            raise GitHubPermissionError("Invalid Permission for merge ({}). Valid permissions are: [{}]".format(repository.permission, ','.join(self.__validMergePermissions)))
+    def __make_graphql_request(self, query: str, variables: dict = None, raiseErrors: bool = True, items: tuple = None) -> dict:
+        """
+        `items`, if given, is a (key, create) pair naming the response's page array (`edges` or `nodes`).
+        Each element is passed to `create` as soon as it has been received, and the array in the
+        returned response holds what `create` returned instead of the decoded elements.
+        """
+        (operation, body) = _request_body(query, variables)
+        return self.scheduler.execute(lambda: self.__send_graphql_request(operation, body, raiseErrors, items))
+
+    def __send_graphql_request(self, operation: str, body: str, raiseErrors: bool, items: tuple = None) -> dict:
+        headers = _request_headers(self.api_token)
+        start = time.perf_counter()
+        decodeSeconds = 0.0
+        with self.pool.request('POST', '/graphql', body=body, headers=headers) as response:
+            self.scheduler.record_headers(response.headers)
+            content = ResponseBody(response)
+            if response.status == HTTPStatus.OK and items:
+                # pages are decoded element by element while the rest of the body is still arriving
+                decoder = EdgeDecoder(items[1], items[0])
+                for chunk in content.chunks():
+                    decodeStart = time.perf_counter()
+                    decoder.feed(chunk)
+                    decodeSeconds += time.perf_counter() - decodeStart
+            else:
+                data = content.read()
+        latency = time.perf_counter() - start - decodeSeconds
 
-    def __make_graphql_request(self, query: str) -> dict:
-        try:
-            conn = http.client.HTTPSConnection(GitHubClient.__apiUrl, 443)
-            body = {
-                'query': query.replace('\r\n', '').replace('\n', '')
-            }
-            headers = {
-                'Authorization': "Token {}".format(self.api_token),
-                'User-Agent': self.__userAgent
-            }
-            conn.request('POST', '/graphql', body=json.dumps(body), headers=headers)
-            response = conn.getresponse()
-            return self.__get_response_as_dict(response)
-        finally:
-            conn.close()
-
-    def __get_response_as_dict(self, response) -> dict:
         if response.status != HTTPStatus.OK:
-            raise Exception('Request attempt failed: {}'.format(response.reason))
-
-        data = json.load(response)
-        self.__validate_graphql_response(data)
-
-        return data
-
-    def __validate_graphql_response(self, response):
-        if not response:
-            raise Exception('Request returned no response... huh???')
-
-        if 'errors' in response:
-            raise GitHubError.create(response)
-
-    def __get_update_ref_graphql_query(self, refId: str, hash: str, force: bool):
-        force_str = str(force).lower()
-        query = Template("""
-            mutation {
-                updateRef(input: {
-                    force: $force,
-                    oid: "$hash",
-                    refId: "$refId"
-                }) {
-                    ref {
-                        id
-                        name
-                        target {
-                            oid
-                            commitUrl
-                        }
-                    }
-                }
-            }
-        """)
-        query = query.substitute(refId=refId, hash=hash, force=force_str)
-        return query
-
-    def __get_merge_branch_graphql_query(self, repoId: str, baseName: str, headName: str, commitMessage: str):
-        query = Template("""
-            mutation {
-                mergeBranch(input: {
-                    base: "$baseName",
-                    commitMessage: "$commitMessage",
-                    head: "$headName",
-                    repositoryId: "$repoId"
-                }) {
-                    mergeCommit {
-                        id
-                        oid
-                        commitUrl
-                        message
-                    }
-                }
-            }
-        """)
-        query = query.substitute(repoId=repoId, baseName=baseName, headName=headName, commitMessage=commitMessage)
-        return query
-
-
-    def __get_repositories_graphql_query(self, org: str, branch: str, after: str) -> str:
-        after = "\"{}\"".format(after) if after else 'null'
-        query = Template("""
-            query {
-                organization(login: "$org") {
-                    repositories(after: $after, first: 100) {
-                        edges {
-                            cursor
-                            node {
-                                id
-                                name
-                                viewerPermission
-                                ref(qualifiedName: "refs/heads/$branch") {
-                                    id
-                                    name
-                                    target {
-                                        id
-                                        oid
-                                        commitUrl
-                                        commitResourcePath
-                                        ... on Commit {
-                                            message
-                                        }
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        """)
-        query = query.substitute(org=org, branch=branch, after=after)
-        return query
\ No newline at end of file
+            self.tracer.record_request(operation, response.status, latency, content.wire_bytes, 0.0)
+            raise GitHubHttpError.create(response.status, response.reason, response.headers, data)
+
+        decodeStart = time.perf_counter()
+        data = decoder.close() if items else json.loads(data)
+        decodeSeconds += time.perf_counter() - decodeStart
+        rateLimit = ((data or {}).get('data') or {}).get('rateLimit')
+        self.tracer.record_request(operation, response.status, latency, content.wire_bytes, decodeSeconds,
+            rateLimit.get('cost') if rateLimit else None)
+
+        return _checked_response(data, self.scheduler, raiseErrors)
+
+# the request building and response handling below is shared with AsyncGitHubClient, which only differs in its I/O
+
+def _request_body(query: str, variables: dict) -> tuple:
+    # documents are minified once at import time; only the variables change per request
+    return (queries.operation_name(query), json.dumps({'query': query, 'variables': variables or {}}, separators=(',', ':')))
+
+def _request_headers(token: str) -> dict:
+    return {
+        'Authorization': "Token {}".format(token),
+        'User-Agent': _USER_AGENT,
+        'Content-Type': 'application/json',
+        'Accept-Encoding': ACCEPT_ENCODING
+    }
+
+def _checked_response(data: dict, scheduler: RequestScheduler, raiseErrors: bool = True) -> dict:
+    if not data:
+        raise Exception('Request returned no response... huh???')
+
+    scheduler.record_rate_limit((data.get('data') or {}).get('rateLimit'))
+    if raiseErrors:
+        errors = [error for error in data.get('errors') or [] if not (queries.is_comparison_error(error) or queries.is_missing_node_error(error))]
+        if errors:
+            raise GitHubError.create({'errors': errors})
+    elif any(error.get('type') == 'RATE_LIMITED' for error in data.get('errors') or []):
+        raise GitHubError.create(data)
+
+    return data
+
+def _validate_write_permissions(repository: Repository):
+    if repository.permission not in _MERGE_PERMISSIONS:
+        raise GitHubPermissionError("Invalid Permission for merge ({}). Valid permissions are: [{}]".format(repository.permission, ','.join(_MERGE_PERMISSIONS)))
+
+def _batched_inputs(repositories: [Repository], batchSize: int, createInput) -> tuple:
+    # (results with a GitHubPermissionError for each repository that can't be written to,
+    #  (indexes, variables) of each batch of up to batchSize of the rest)
+    results = [None] * len(repositories)
+    pending = []
+    for (i, repository) in enumerate(repositories):
+        try:
+            _validate_write_permissions(repository)
+            pending.append(i)
+        except GitHubPermissionError as err:
+            results[i] = err
+    batches = [(batch, {'input{}'.format(n): createInput(repositories[i]) for (n, i) in enumerate(batch)}) for batch in _batches(pending, batchSize)]
+    return (results, batches)
+
+def _merge_branch_input(repository: Repository, base: str, head: str, commitMessage: str) -> dict:
+    return {'repositoryId': repository.id, 'base': base, 'head': head, 'commitMessage': commitMessage}
+
+def _fast_forward_input(repository: Repository, base: str, head: str) -> dict:
+    return {'refId': repository.refs[base].id, 'oid': repository.refs[head].oid, 'force': False}
+
+def _branch_scan(org: str, branchNames: [str], comparisons: [tuple]) -> tuple:
+    # (query, variables, createRepository) of a single-pass scan of the organization's repository pages
+    variables = dict(queries.ref_variables(branchNames, comparisons), org=org)
+    return (queries.repositories_for_branches(len(branchNames), len(comparisons)), variables,
+        lambda node: Repository.create_from_node(node, branchNames, comparisons))
+
+def _node_lookup(branchNames: [str], comparisons: [tuple]) -> tuple:
+    # (query, variables without the ids, items) of a two-stage scan's lookups by node id.
+    # nodes(ids: [...]) returns null for ids that no longer resolve (i.e. deleted repositories)
+    items = ('nodes', lambda node: Repository.create_from_node(node, branchNames, comparisons) if node else None)
+    return (queries.repository_nodes(len(branchNames), len(comparisons)), queries.ref_variables(branchNames, comparisons), items)
+
+def _page(response: dict) -> tuple:
+    # (repositories, cursor of the next page or None after the last one) of an organization page
+    repositories = response["data"]["organization"]["repositories"]
+    return (repositories["edges"], repositories["pageInfo"]["endCursor"] if repositories["pageInfo"]["hasNextPage"] else None)
+
+def _refresh_inventory(cache: RepositoryCache, org: str, watermark: str, changed: [Repository]) -> [Repository]:
+    if not cache:
+        return changed
+
+    newest = max((repository.updated_at for repository in changed), default=watermark)
+    cache.store(org, changed, newest, replace=watermark is None)
+    return cache.repositories(org)
+
+def _ref_oids(ids: [str], response: dict) -> dict:
+    # a deleted ref only nulls its own node, so per-node errors don't fail the batch
+    if not response.get('data'):
+        raise GitHubError.create(response)
+    return {id: node['target']['oid'] if node else None for (id, node) in zip(ids, response['data']['nodes'])}
+
+def _found_nodes(ids: [str], response: dict, cache: RepositoryCache, org: str) -> [Repository]:
+    # the decoder drops null nodes, so ids that no longer resolve are told apart by their errors' paths.
+    # A cached id outlives its deleted repository until the next full listing, unless it's forgotten here
+    missing = [ids[error['path'][1]] for error in response.get('errors') or [] if queries.is_missing_node_error(error)]
+    if missing and cache:
+        cache.remove(org, missing)
+    return [node for node in response['data']['nodes'] if node]
+
+def _batches(items, size: int):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
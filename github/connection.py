@@ -0,0 +1,140 @@
+import http.client
+from urllib.parse import urlsplit
+import threading
+import time
+from collections import deque
+
+class PooledResponse:
+    """
+    Wraps an http.client.HTTPResponse so the underlying connection is handed back
+    to its pool once the response has been consumed and closed.
+    """
+
+    def __init__(self, pool, conn, response):
+        self.__pool = pool
+        self.__conn = conn
+        self.__response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt: int = None) -> bytes:
+        return self.__response.read(amt)
+
+    def getheader(self, name: str, default: str = None) -> str:
+        return self.__response.getheader(name, default)
+
+    def close(self):
+        if self.__conn is None:
+            return
+
+        conn, self.__conn = self.__conn, None
+        # a connection can only be reused once the previous response is fully drained
+        reusable = self.__response.isclosed() and not self.__response.will_close
+        self.__response.close()
+        self.__pool._release(conn, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections to a single host.
+
+    At most `size` connections are checked out at once; callers block until one is
+    returned. Idle connections older than `idle_timeout` seconds are discarded rather
+    than reused, and a request that fails on a reused socket the server has already
+    dropped is transparently retried once on a fresh connection.
+    """
+
+    __droppedSocketErrors = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+    def __init__(self, host: str, port: int = 443, secure: bool = True, size: int = 4, idle_timeout: float = 30.0, timeout: float = 60.0):
+        if size < 1:
+            raise ValueError('Connection pool size must be at least 1')
+
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connections_opened = 0
+        self.requests_sent = 0
+        self.__idle = deque()
+        self.__lock = threading.Lock()
+        self.__available = threading.BoundedSemaphore(size)
+
+    @staticmethod
+    def from_url(url: str, **kwargs) -> 'ConnectionPool':
+        parts = urlsplit(url)
+        secure = parts.scheme != 'http'
+        return ConnectionPool(parts.hostname, parts.port or (443 if secure else 80), secure, **kwargs)
+
+    def request(self, method: str, url: str, body=None, headers: dict = None) -> PooledResponse:
+        headers = headers or {}
+        self.__available.acquire()
+        try:
+            (conn, reused) = self.__acquire()
+            try:
+                response = self.__send(conn, method, url, body, headers)
+            except self.__droppedSocketErrors:
+                conn.close()
+                if not reused:
+                    raise
+                # the server closed the idle socket under us; retry once on a new connection
+                (conn, _) = self.__acquire(fresh=True)
+                response = self.__send(conn, method, url, body, headers)
+        except BaseException:
+            self.__available.release()
+            raise
+
+        return PooledResponse(self, conn, response)
+
+    def close(self):
+        with self.__lock:
+            while self.__idle:
+                (conn, _) = self.__idle.pop()
+                conn.close()
+
+    def _release(self, conn, reusable: bool):
+        try:
+            if reusable:
+                with self.__lock:
+                    self.__idle.append((conn, time.monotonic()))
+            else:
+                conn.close()
+        finally:
+            self.__available.release()
+
+    def __send(self, conn, method, url, body, headers):
+        with self.__lock:
+            self.requests_sent += 1
+        try:
+            conn.request(method, url, body=body, headers=headers)
+            return conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+
+    def __acquire(self, fresh: bool = False):
+        if not fresh:
+            now = time.monotonic()
+            with self.__lock:
+                while self.__idle:
+                    (conn, last_used) = self.__idle.pop()
+                    if now - last_used <= self.idle_timeout:
+                        return (conn, True)
+                    conn.close()
+
+        return (self.__connect(), False)
+
+    def __connect(self):
+        with self.__lock:
+            self.connections_opened += 1
+        if self.secure:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
@@ -0,0 +1,145 @@
+import codecs
+import json
+import re
+import zlib
+
+ACCEPT_ENCODING = 'gzip, deflate'
+
+def decompressor(encoding: str):
+    """A zlib decompressor for a gzip or deflate Content-Encoding, or None for an uncompressed body."""
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return _DeflateDecompressor()
+    if encoding == 'identity':
+        return None
+    raise ValueError('Unsupported Content-Encoding: {}'.format(encoding))
+
+def decompress(content: bytes, encoding: str) -> bytes:
+    decoder = decompressor(encoding)
+    return decoder.decompress(content) + decoder.flush() if decoder else content
+
+class _DeflateDecompressor:
+    # "deflate" is meant to be zlib-wrapped, but some servers send a raw deflate stream instead
+
+    def __init__(self):
+        self.__decompressor = None
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.__decompressor is None:
+            if not data:
+                return b''
+            wrapped = len(data) > 1 and data[0] & 0x0f == 8 and ((data[0] << 8) | data[1]) % 31 == 0
+            self.__decompressor = zlib.decompressobj(zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS)
+        return self.__decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        return self.__decompressor.flush() if self.__decompressor else b''
+
+class ResponseBody:
+    """Reads a response body in chunks, undoing any gzip or deflate Content-Encoding and counting the bytes on the wire."""
+
+    def __init__(self, response, chunk_size: int = 64 * 1024):
+        self.__response = response
+        self.__decompressor = decompressor(response.getheader('Content-Encoding'))
+        self.chunk_size = chunk_size
+        self.wire_bytes = 0
+
+    def chunks(self):
+        while True:
+            chunk = self.__response.read(self.chunk_size)
+            if not chunk:
+                break
+            self.wire_bytes += len(chunk)
+            yield self.__decompressor.decompress(chunk) if self.__decompressor else chunk
+        if self.__decompressor:
+            yield self.__decompressor.flush()
+
+    def read(self) -> bytes:
+        return b''.join(self.chunks())
+
+class EdgeDecoder:
+    """
+    Incremental decoder for a GraphQL page whose items sit in one `edges` (or `nodes`) array.
+
+    Bytes are fed in as they arrive. Each element of the array is decoded on its own as soon as it is
+    complete and handed to `create`, so a page of repositories becomes Repository objects without
+    the whole response ever existing as one string or dict tree. `close()` decodes the rest of the
+    document (page info, rate limit, errors) with the array replaced by the non-None results of `create`.
+    """
+
+    __separators = re.compile(r'[\s,]*')
+
+    def __init__(self, create, key: str = 'edges'):
+        self.__create = create
+        self.__start = re.compile(r'"{}"\s*:\s*\['.format(re.escape(key)))
+        self.__key = key
+        self.__text = codecs.getincrementaldecoder('utf-8')()
+        self.__decoder = json.JSONDecoder()
+        self.__buffer = ''
+        self.__head = None
+        self.__tail = None
+        self.items = []
+
+    def feed(self, data: bytes):
+        self.__feed_text(self.__text.decode(data))
+
+    def close(self) -> dict:
+        self.__feed_text(self.__text.decode(b'', final=True))
+        if self.__head is None:
+            # no array in this response (i.e. an error); decode it whole
+            return json.loads(self.__buffer) if self.__buffer.strip() else None
+        if self.__tail is None:
+            raise ValueError('Response ended inside the {} array'.format(self.__key))
+
+        document = json.loads(self.__head + '[]' + self.__tail)
+        _place_items(document, self.__key, self.items)
+        return document
+
+    def __feed_text(self, text: str):
+        if self.__tail is not None:
+            self.__tail += text
+            return
+
+        self.__buffer += text
+        if self.__head is None:
+            match = self.__start.search(self.__buffer)
+            if not match:
+                return
+            (self.__head, self.__buffer) = (self.__buffer[:match.end() - 1], self.__buffer[match.end():])
+        self.__decode_items()
+
+    def __decode_items(self):
+        text = self.__buffer
+        position = 0
+        while True:
+            position = self.__separators.match(text, position).end()
+            if position >= len(text):
+                break
+            if text[position] == ']':
+                self.__tail = text[position + 1:]
+                break
+            try:
+                (value, end) = self.__decoder.raw_decode(text, position)
+            except ValueError:
+                # the element is still arriving
+                break
+            item = self.__create(value)
+            if item is not None:
+                self.items.append(item)
+            position = end
+        self.__buffer = text[position:] if self.__tail is None else ''
+
+def _place_items(document, key: str, items: list) -> bool:
+    # the array is the first `key` in document order, the same one the decoder split out
+    if isinstance(document, dict):
+        for (name, value) in document.items():
+            if name == key and value == []:
+                document[name] = items
+                return True
+            if _place_items(value, key, items):
+                return True
+    elif isinstance(document, list):
+        return any(_place_items(value, key, items) for value in document)
+    return False
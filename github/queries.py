@@ -0,0 +1,233 @@
+import re
+from functools import lru_cache
+
+def minify(document: str) -> str:
+    """Collapses a GraphQL document onto one line, dropping whitespace around punctuation."""
+    document = re.sub(r'\s+', ' ', document)
+    return re.sub(r'\s*([{}():,!\[\]=])\s*', r'\1', document).strip()
+
+def qualified_branch_name(branch: str) -> str:
+    return 'refs/heads/{}'.format(branch)
+
+def ref_alias(index: int) -> str:
+    return 'ref{}'.format(index)
+
+def merge_alias(index: int) -> str:
+    return 'merge{}'.format(index)
+
+def update_alias(index: int) -> str:
+    return 'update{}'.format(index)
+
+def comparison_alias(index: int) -> str:
+    return 'cmp{}'.format(index)
+
+def operation_name(document: str) -> str:
+    match = re.match(r'(?:query|mutation)\s+(\w+)', document)
+    return match.group(1) if match else 'anonymous'
+
+def is_comparison_error(error: dict) -> bool:
+    # a comparison against a missing head ref only invalidates that comparison, not the whole page
+    return any(isinstance(field, str) and re.fullmatch(r'cmp\d+', field) for field in error.get('path') or [])
+
+def is_missing_node_error(error: dict) -> bool:
+    # an id in nodes(ids: [...]) that no longer resolves (i.e. a deleted repository) only nulls its own node
+    path = error.get('path') or []
+    return error.get('type') == 'NOT_FOUND' and len(path) == 2 and path[0] == 'nodes' and isinstance(path[1], int)
+
+RATE_LIMIT_FIELDS = """
+    rateLimit {
+        cost
+        remaining
+        resetAt
+    }
+"""
+
+PAGE_INFO_FIELDS = """
+    pageInfo {
+        hasNextPage
+        endCursor
+    }
+"""
+
+# scans only need enough of each ref to merge (the repository id) and to update it (ref id and oid)
+REF_FIELDS = """
+    id
+    target {
+        oid
+    }
+"""
+
+REPOSITORIES = minify("""
+    query Repositories($org: String!, $after: String, $qualifiedName: String!) {
+        %s
+        organization(login: $org) {
+            repositories(after: $after, first: 100) {
+                %s
+                edges {
+                    node {
+                        id
+                        name
+                        viewerPermission
+                        ref(qualifiedName: $qualifiedName) {
+                            name
+                            %s
+                        }
+                    }
+                }
+            }
+        }
+    }
+""" % (RATE_LIMIT_FIELDS, PAGE_INFO_FIELDS, REF_FIELDS))
+
+REPOSITORY_INVENTORY = minify("""
+    query RepositoryInventory($org: String!, $after: String) {
+        %s
+        organization(login: $org) {
+            repositories(after: $after, first: 100, orderBy: {field: UPDATED_AT, direction: DESC}) {
+                %s
+                edges {
+                    node {
+                        id
+                        name
+                        viewerPermission
+                        updatedAt
+                    }
+                }
+            }
+        }
+    }
+""" % (RATE_LIMIT_FIELDS, PAGE_INFO_FIELDS))
+
+# first stage of a two-stage scan: just enough to look each repository up again by node id
+REPOSITORY_IDS = minify("""
+    query RepositoryIds($org: String!, $after: String) {
+        %s
+        organization(login: $org) {
+            repositories(after: $after, first: 100) {
+                %s
+                edges {
+                    node {
+                        id
+                    }
+                }
+            }
+        }
+    }
+""" % (RATE_LIMIT_FIELDS, PAGE_INFO_FIELDS))
+
+# current target of each ref in $ids; refs that no longer exist come back as null
+REF_NODES = minify("""
+    query RefNodes($ids: [ID!]!) {
+        %s
+        nodes(ids: $ids) {
+            ... on Ref {
+                id
+                target {
+                    oid
+                }
+            }
+        }
+    }
+""" % RATE_LIMIT_FIELDS)
+
+MERGE_BRANCH = minify("""
+    mutation MergeBranch($input: MergeBranchInput!) {
+        mergeBranch(input: $input) {
+            mergeCommit {
+                oid
+                commitUrl
+                message
+            }
+        }
+    }
+""")
+
+UPDATE_REF = minify("""
+    mutation UpdateRef($input: UpdateRefInput!) {
+        updateRef(input: $input) {
+            ref {
+                target {
+                    oid
+                    commitUrl
+                }
+            }
+        }
+    }
+""")
+
+def _ref_variables(count: int, comparisons: int) -> str:
+    refs = ''.join(', ${}: String!'.format(ref_alias(i)) for i in range(count))
+    return refs + ''.join(', $cmpBase{0}: String!, $cmpHead{0}: String!'.format(i) for i in range(comparisons))
+
+def _ref_selections(count: int, comparisons: int) -> str:
+    refs = ''.join('{0}: ref(qualifiedName: ${0}) {{ {1} }}'.format(ref_alias(i), REF_FIELDS) for i in range(count))
+    return refs + ''.join(
+        '{0}: ref(qualifiedName: $cmpBase{1}) {{ compare(headRef: $cmpHead{1}) {{ aheadBy behindBy status }} }}'.format(comparison_alias(i), i)
+        for i in range(comparisons))
+
+def ref_variables(branches: [str], comparisons: [tuple] = ()) -> dict:
+    variables = {ref_alias(i): qualified_branch_name(branch) for (i, branch) in enumerate(branches)}
+    for (i, (base, head)) in enumerate(comparisons):
+        variables['cmpBase{}'.format(i)] = qualified_branch_name(base)
+        variables['cmpHead{}'.format(i)] = qualified_branch_name(head)
+    return variables
+
+@lru_cache(maxsize=None)
+def repositories_for_branches(count: int, comparisons: int = 0) -> str:
+    """
+    Organization scan fetching `count` aliased refs ($ref0, $ref1, ...) per repository, plus
+    `comparisons` base/head comparisons ($cmpBase0/$cmpHead0, ...).
+    """
+    return minify("""
+        query RepositoriesForBranches($org: String!, $after: String%s) {
+            %s
+            organization(login: $org) {
+                repositories(after: $after, first: 100) {
+                    %s
+                    edges {
+                        node {
+                            id
+                            name
+                            viewerPermission
+                            %s
+                        }
+                    }
+                }
+            }
+        }
+    """ % (_ref_variables(count, comparisons), RATE_LIMIT_FIELDS, PAGE_INFO_FIELDS, _ref_selections(count, comparisons)))
+
+@lru_cache(maxsize=None)
+def repository_nodes(count: int, comparisons: int = 0) -> str:
+    """Same projection as repositories_for_branches, for the repositories in $ids."""
+    return minify("""
+        query RepositoryNodes($ids: [ID!]!%s) {
+            %s
+            nodes(ids: $ids) {
+                ... on Repository {
+                    id
+                    name
+                    viewerPermission
+                    %s
+                }
+            }
+        }
+    """ % (_ref_variables(count, comparisons), RATE_LIMIT_FIELDS, _ref_selections(count, comparisons)))
+
+@lru_cache(maxsize=None)
+def merge_branches(count: int) -> str:
+    """`count` aliased mergeBranch mutations (merge0, merge1, ...) taking $input0, $input1, ..."""
+    inputs = ', '.join('$input{}: MergeBranchInput!'.format(i) for i in range(count))
+    mutations = ''.join(
+        '{}: mergeBranch(input: $input{}) {{ mergeCommit {{ oid commitUrl message }} }}'.format(merge_alias(i), i)
+        for i in range(count))
+    return minify('mutation MergeBranches({}) {{ {} }}'.format(inputs, mutations))
+
+@lru_cache(maxsize=None)
+def update_refs(count: int) -> str:
+    """`count` aliased updateRef mutations (update0, update1, ...) taking $input0, $input1, ..."""
+    inputs = ', '.join('$input{}: UpdateRefInput!'.format(i) for i in range(count))
+    mutations = ''.join(
+        '{}: updateRef(input: $input{}) {{ ref {{ target {{ oid commitUrl }} }} }}'.format(update_alias(i), i)
+        for i in range(count))
+    return minify('mutation UpdateRefs({}) {{ {} }}'.format(inputs, mutations))
@@ -0,0 +1,137 @@
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime
+from github.types import GitHubError, GitHubHttpError
+
+class RequestScheduler:
+    """
+    Paces GraphQL requests against GitHub's rate limits and retries transient failures.
+
+    The remaining budget is tracked from the `X-RateLimit-*` response headers and from any
+    `rateLimit { cost remaining resetAt }` block in the response body. Once fewer than
+    `reserve` points remain, requests are spread evenly over the time left until the
+    budget resets. Transient failures (502/503/504, secondary rate limits, dropped
+    connections) are retried with jittered exponential backoff, honouring `Retry-After`.
+    """
+
+    __transientStatuses = (429, 502, 503, 504)
+    __transientErrorTypes = ('RATE_LIMITED',)
+
+    def __init__(self, max_retries: int = 5, backoff: float = 1.0, max_backoff: float = 60.0, reserve: int = 100,
+            sleep=time.sleep, clock=time.time, jitter=random.random):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reserve = reserve
+        self.remaining = None
+        self.reset_at = None
+        self.cost = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self.__sleep = sleep
+        self.__clock = clock
+        self.__jitter = jitter
+        self.__lock = threading.Lock()
+        self.__next_request_at = 0.0
+        self.__paused_until = 0.0
+
+    def execute(self, send):
+        """Calls `send()` once its turn comes up, retrying transient failures."""
+        attempt = 0
+        while True:
+            delay = self.__claim_turn()
+            if delay > 0:
+                self.__sleep(delay)
+            try:
+                return send()
+            except Exception as err:
+                self.__schedule_retry(err, attempt)
+                attempt += 1
+
+    async def execute_async(self, send):
+        """Awaits `send()` once its turn comes up, retrying transient failures, without blocking the event loop."""
+        attempt = 0
+        while True:
+            delay = self.__claim_turn()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await send()
+            except Exception as err:
+                self.__schedule_retry(err, attempt)
+                attempt += 1
+
+    def is_transient(self, err: Exception) -> bool:
+        if isinstance(err, GitHubHttpError):
+            return err.status in self.__transientStatuses or (err.status == 403 and (err.retry_after is not None or err.rate_limited))
+        if isinstance(err, GitHubError):
+            return err.error_type in self.__transientErrorTypes
+        return isinstance(err, (ConnectionError, TimeoutError))
+
+    def record_headers(self, headers):
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        with self.__lock:
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset is not None:
+                self.reset_at = float(reset)
+
+    def record_rate_limit(self, rateLimit: dict):
+        if not rateLimit:
+            return
+
+        with self.__lock:
+            self.cost += rateLimit.get('cost') or 0
+            if rateLimit.get('remaining') is not None:
+                self.remaining = rateLimit['remaining']
+            if rateLimit.get('resetAt'):
+                self.reset_at = datetime.fromisoformat(rateLimit['resetAt'].replace('Z', '+00:00')).timestamp()
+
+    def __schedule_retry(self, err: Exception, attempt: int):
+        # re-raises anything that should not be retried
+        if attempt >= self.max_retries or not self.is_transient(err):
+            raise err
+        delay = self.__retry_delay(attempt, getattr(err, 'retry_after', None))
+        with self.__lock:
+            self.retries += 1
+            self.__paused_until = max(self.__paused_until, self.__clock() + delay)
+
+    def __claim_turn(self) -> float:
+        # returns how long the caller has to wait before sending
+        with self.__lock:
+            now = self.__clock()
+            start = max(now, self.__next_request_at, self.__paused_until)
+            if self.remaining is not None and self.remaining <= 0 and self.reset_at:
+                # the budget is spent; nothing will succeed before it resets
+                start = max(start, self.reset_at)
+            self.__next_request_at = start + self.__pacing_interval(start)
+            if self.remaining:
+                # assume each request costs at least a point until the response says otherwise
+                self.remaining -= 1
+            delay = start - now
+            if delay > 0:
+                self.throttled_seconds += delay
+
+        return delay
+
+    def __pacing_interval(self, now: float) -> float:
+        if self.remaining is None or self.reset_at is None or self.remaining > self.reserve:
+            return 0.0
+
+        window = max(self.reset_at - now, 0.0)
+        if self.remaining <= 0:
+            return window
+
+        # spread what is left of the budget evenly over the rest of the window
+        return window / self.remaining
+
+    def __retry_delay(self, attempt: int, retry_after: float = None) -> float:
+        if retry_after is not None:
+            return float(retry_after)
+
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        # jitter between half and the full backoff so parallel workers don't retry in lockstep
+        return delay * (0.5 + self.__jitter() / 2)
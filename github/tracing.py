@@ -0,0 +1,141 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+class Tracer:
+    """
+    Collects timing spans for the phases of a run and one record per GraphQL request.
+
+    Spans nest per thread (or asyncio task) and are exported in the Chrome trace event format (load the JSON
+    file in chrome://tracing or https://ui.perfetto.dev). Request records and counters are
+    aggregated per operation for the Prometheus textfile export.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.__clock = clock
+        self.__origin = clock()
+        self.__lock = threading.Lock()
+        self.__parent = contextvars.ContextVar('span', default=None)
+        self.spans = []
+        self.requests = []
+        self.counters = {}
+        self.gauges = {}
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = self.__parent.get()
+        token = self.__parent.set(name)
+        start = self.__clock()
+        try:
+            yield attributes
+        finally:
+            end = self.__clock()
+            self.__parent.reset(token)
+            with self.__lock:
+                self.spans.append({
+                    'name': name,
+                    'parent': parent,
+                    'start': start - self.__origin,
+                    'duration': end - start,
+                    'thread': threading.get_ident(),
+                    'attributes': attributes
+                })
+
+    def record_request(self, operation: str, status: int, latency: float, responseBytes: int, decodeSeconds: float, cost: int = None):
+        with self.__lock:
+            self.requests.append({
+                'operation': operation,
+                'status': status,
+                'start': self.__clock() - latency - self.__origin,
+                'latency': latency,
+                'bytes': responseBytes,
+                'decode_seconds': decodeSeconds,
+                'cost': cost,
+                'thread': threading.get_ident()
+            })
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self.__lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def to_trace(self) -> dict:
+        events = []
+        for span in self.spans:
+            events.append({
+                'name': span['name'], 'cat': 'phase', 'ph': 'X', 'pid': 1, 'tid': span['thread'],
+                'ts': span['start'] * 1e6, 'dur': span['duration'] * 1e6, 'args': span['attributes']
+            })
+        for request in self.requests:
+            events.append({
+                'name': request['operation'], 'cat': 'request', 'ph': 'X', 'pid': 1, 'tid': request['thread'],
+                'ts': request['start'] * 1e6, 'dur': request['latency'] * 1e6,
+                'args': {key: request[key] for key in ('status', 'bytes', 'decode_seconds', 'cost')}
+            })
+        events.sort(key=lambda event: event['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, help: str, samples: list):
+            lines.append('# HELP automerge_{} {}'.format(name, help))
+            lines.append('# TYPE automerge_{} {}'.format(name, kind))
+            for (suffix, labels, value) in samples:
+                lines.append('automerge_{}{}{} {}'.format(name, suffix, _format_labels(labels), _format_value(value)))
+
+        phases = {}
+        for span in self.spans:
+            phases[span['name']] = phases.get(span['name'], 0.0) + span['duration']
+        metric('phase_duration_seconds', 'gauge', 'Total time spent in each phase of the run.',
+            [('', {'phase': phase}, duration) for (phase, duration) in sorted(phases.items())])
+
+        operations = {}
+        for request in self.requests:
+            totals = operations.setdefault(request['operation'], {'count': 0, 'latency': 0.0, 'bytes': 0, 'decode': 0.0, 'cost': 0})
+            totals['count'] += 1
+            totals['latency'] += request['latency']
+            totals['bytes'] += request['bytes']
+            totals['decode'] += request['decode_seconds']
+            totals['cost'] += request['cost'] or 0
+        operations = sorted(operations.items())
+        metric('graphql_request_duration_seconds', 'summary', 'GraphQL request latency per operation.',
+            [(suffix, {'operation': operation}, totals[key]) for (operation, totals) in operations for (suffix, key) in (('_sum', 'latency'), ('_count', 'count'))])
+        metric('graphql_response_bytes_total', 'counter', 'Response body bytes received per operation.',
+            [('', {'operation': operation}, totals['bytes']) for (operation, totals) in operations])
+        metric('graphql_decode_seconds_total', 'counter', 'Time spent decoding JSON responses per operation.',
+            [('', {'operation': operation}, totals['decode']) for (operation, totals) in operations])
+        metric('graphql_cost_total', 'counter', 'GraphQL rate limit points reported per operation.',
+            [('', {'operation': operation}, totals['cost']) for (operation, totals) in operations])
+
+        for (kind, values) in (('counter', self.counters), ('gauge', self.gauges)):
+            names = sorted(set(name for (name, _) in values))
+            for name in names:
+                metric(name, kind, name.replace('_', ' ') + '.',
+                    [('', dict(labels), value) for ((metricName, labels), value) in sorted(values.items()) if metricName == name])
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, prefix: str):
+        """Writes `<prefix>.json` (trace events) and `<prefix>.prom` (Prometheus textfile)."""
+        with open(prefix + '.json', 'w') as trace:
+            json.dump(self.to_trace(), trace)
+        # write then rename so a textfile collector never scrapes a half-written file
+        with open(prefix + '.prom.tmp', 'w') as textfile:
+            textfile.write(self.to_prometheus())
+        os.replace(prefix + '.prom.tmp', prefix + '.prom')
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for (key, value) in labels.items()) + '}'
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -1,45 +1,139 @@
 
+from github.queries import ref_alias, merge_alias, update_alias, comparison_alias
+
 class Ref:
 
+    __slots__ = ('id', 'name', 'oid', 'message')
+
     def __init__(self, id: str, name: str, oid: str, message: str):
         self.id = id
         self.name = name
         self.oid = oid
         self.message = message
 
+    @staticmethod
+    def create(refDict: dict, name: str = None):
+        if not refDict:
+            return None
+
+        # scans project only the ref id and target oid; name and message are filled in when present
+        targetDict = refDict["target"]
+        return Ref(
+            refDict["id"],
+            refDict.get("name", name),
+            targetDict["oid"],
+            targetDict.get("message"))
+
+class Comparison:
+
+    __slots__ = ('ahead_by', 'behind_by', 'status')
+
+    def __init__(self, ahead_by: int, behind_by: int, status: str):
+        self.ahead_by = ahead_by
+        self.behind_by = behind_by
+        self.status = status
+
+    @staticmethod
+    def create(cmpDict: dict):
+        if not cmpDict or not cmpDict.get("compare"):
+            return None
+
+        info = cmpDict["compare"]
+        return Comparison(info["aheadBy"], info["behindBy"], info["status"])
+
 class Repository:
 
-    def __init__(self, id: str, name: str, permission: str, ref: Ref):
+    __slots__ = ('id', 'name', 'ref', 'permission', 'refs', 'comparisons', 'updated_at')
+
+    def __init__(self, id: str, name: str, permission: str, ref: Ref, refs: dict = None, updated_at: str = None, comparisons: dict = None):
         self.id = id
         self.name = name
         self.ref = ref
         self.permission = permission
+        # branch name -> Ref, populated by multi-branch scans
+        self.refs = refs if refs is not None else {}
+        # (base, head) -> Comparison of head against base, when the scan asked for one
+        self.comparisons = comparisons if comparisons is not None else {}
+        self.updated_at = updated_at
+
+    def discard_comparisons(self, branch: str):
+        """Forgets comparisons involving `branch`, i.e. after it has moved."""
+        for key in [key for key in self.comparisons if branch in key]:
+            del self.comparisons[key]
 
     @staticmethod
-    def create(data: dict):
-        repos = []
-        for edge in data["data"]["organization"]["repositories"]["edges"]:
-            repoDict = edge["node"]
-            refDict = edge["node"]["ref"]
-            repo = Repository(
-                repoDict["id"], 
-                repoDict["name"], 
-                repoDict["viewerPermission"],
-                None)
-            if refDict:
-                targetDict = refDict["target"]
-                ref = Ref(
-                    refDict["id"],
-                    refDict["name"],
-                    targetDict["oid"],
-                    targetDict["message"])
-                repo.ref = ref
-            repos.append(repo)
-            
-        return repos
+    def create_from_node(repoDict: dict, branches: [str] = None, comparisons: [tuple] = ()):
+        repo = Repository(
+            repoDict["id"], 
+            repoDict["name"], 
+            repoDict["viewerPermission"],
+            None,
+            updated_at=repoDict.get("updatedAt"))
+        if branches is None:
+            repo.ref = Ref.create(repoDict.get("ref"))
+        else:
+            for (i, branch) in enumerate(branches):
+                ref = Ref.create(repoDict[ref_alias(i)], branch)
+                if ref:
+                    repo.refs[branch] = ref
+
+        for (i, pair) in enumerate(comparisons):
+            comparison = Comparison.create(repoDict.get(comparison_alias(i)))
+            if comparison:
+                repo.comparisons[pair] = comparison
+
+        return repo
+
+class RepositorySet:
+    """
+    Insertion-ordered collection of repositories indexed by name and id, so membership tests
+    and intersections across branch scans are constant time per repository.
+    """
+
+    __slots__ = ('__byName', '__byId')
+
+    def __init__(self, repositories = ()):
+        self.__byName = {}
+        self.__byId = {}
+        for repository in repositories:
+            self.add(repository)
+
+    def add(self, repository: Repository):
+        self.__byName[repository.name] = repository
+        if repository.id:
+            self.__byId[repository.id] = repository
+
+    def get(self, name: str) -> Repository:
+        return self.__byName.get(name)
+
+    def get_by_id(self, id: str) -> Repository:
+        return self.__byId.get(id)
+
+    def intersection(self, other) -> 'RepositorySet':
+        """Repositories of this set (in this set's order) whose name also appears in `other`."""
+        other = other if isinstance(other, RepositorySet) else RepositorySet(other)
+        return RepositorySet(repository for repository in self if repository.name in other)
+
+    def __and__(self, other) -> 'RepositorySet':
+        return self.intersection(other)
+
+    def __contains__(self, item) -> bool:
+        name = item.name if isinstance(item, Repository) else item
+        return name in self.__byName
+
+    def __iter__(self):
+        return iter(self.__byName.values())
+
+    def __len__(self) -> int:
+        return len(self.__byName)
+
+    def __bool__(self) -> bool:
+        return bool(self.__byName)
 
 class MergeResponse:
 
+    __slots__ = ('commit_hash', 'commit_url', 'commit_message')
+
     def __init__(self, hash: str, url: str, message: str):
         self.commit_hash = hash
         self.commit_url = url
@@ -50,8 +144,22 @@ class MergeResponse:
         info = data['data']['mergeBranch']["mergeCommit"]
         return MergeResponse(info["oid"], info["commitUrl"], info["message"])
 
+    @staticmethod
+    def create_batch(data: dict, count: int) -> list:
+        return _create_batch(data, [merge_alias(i) for i in range(count)], MergeResponse.__from_info)
+
+    @staticmethod
+    def __from_info(info: dict):
+        commit = info['mergeCommit']
+        if not commit:
+            # GitHub reports nothing to merge with an empty merge commit
+            return GitHubError('UNPROCESSABLE', 'Already merged')
+        return MergeResponse(commit["oid"], commit["commitUrl"], commit["message"])
+
 class UpdateRefResponse:
 
+    __slots__ = ('commit_hash', 'commit_url')
+
     def __init__(self, hash: str, url: str):
         self.commit_hash = hash
         self.commit_url = url
@@ -61,6 +169,11 @@ class UpdateRefResponse:
         info = data['data']['updateRef']['ref']['target']
         return UpdateRefResponse(info['oid'], info['commitUrl'])
 
+    @staticmethod
+    def create_batch(data: dict, count: int) -> list:
+        return _create_batch(data, [update_alias(i) for i in range(count)],
+            lambda info: UpdateRefResponse(info['ref']['target']['oid'], info['ref']['target']['commitUrl']))
+
 class GitHubError(Exception):
 
     def __init__(self, error_type: str, message: str):
@@ -75,7 +188,47 @@ class GitHubError(Exception):
             err_type = firstError['type']
         return GitHubError(err_type, firstError['message'])
 
+    @staticmethod
+    def create_by_path(data: dict) -> dict:
+        # first error per top-level response field; errors without a path are keyed by None
+        errors = {}
+        for error in data.get('errors') or []:
+            path = error.get('path') or [None]
+            errors.setdefault(path[0], GitHubError(error.get('type', ''), error['message']))
+        return errors
+
+class GitHubHttpError(GitHubError):
+
+    def __init__(self, status: int, reason: str, retry_after: float = None, rate_limited: bool = False):
+        super().__init__('HTTP', 'Request attempt failed: {} {}'.format(status, reason))
+        self.status = status
+        self.retry_after = retry_after
+        self.rate_limited = rate_limited
+
+    @staticmethod
+    def create(status: int, reason: str, headers, body: bytes):
+        retry_after = headers.get('Retry-After')
+        rate_limited = headers.get('X-RateLimit-Remaining') == '0' or b'rate limit' in body.lower()
+        return GitHubHttpError(status, reason, float(retry_after) if retry_after else None, rate_limited)
+
 class GitHubPermissionError(GitHubError):
     
     def __init__(self, message):
         super().__init__('PERMISSION', message)
+
+def _create_batch(data: dict, aliases: [str], create) -> list:
+    # map each aliased mutation back to its own result (create(info)) or error, in alias order
+    errors = GitHubError.create_by_path(data)
+    results = (data.get('data') or {})
+    batch = []
+    for alias in aliases:
+        info = results.get(alias)
+        if alias in errors:
+            batch.append(errors[alias])
+        elif info:
+            batch.append(create(info))
+        elif None in errors:
+            batch.append(errors[None])
+        else:
+            batch.append(GitHubError('', 'No result returned for {}'.format(alias)))
+    return batch
@@ -0,0 +1,124 @@
+import unittest
+import asyncio
+import http.client
+from email.parser import BytesParser
+from automerge import async_utilities
+from automerge.utilities import auto_merge
+from github.async_client import AsyncGitHubClient
+from github.async_connection import read_body
+from github.client import GitHubClient
+from github.scheduler import RequestScheduler
+from github.types import GitHubError
+from tests.mock_github_server import MockGitHubServer, MockOrganization
+
+class AsyncGitHubClientTest(unittest.TestCase):
+
+    def new_client(self, server: MockGitHubServer, size: int = 8, **kwargs) -> AsyncGitHubClient:
+        return AsyncGitHubClient('token', server.organization.login, AsyncGitHubClient.create_pool(size, server.url), **kwargs)
+
+    def test_should_scan_merge_and_update_refs(self):
+        organization = MockOrganization(250, coverage={'REL-1': 0.5})
+
+        async def run(server):
+            client = self.new_client(server)
+            repos = await client.get_repositories_for_branches(['REL-1', 'master'])
+            single = await client.get_repositories('REL-1')
+            repo = next(repo for repo in repos if 'REL-1' in repo.refs)
+            merged = await client.merge_branch(repo, 'master', 'REL-1', 'merge')
+            repo.ref = repo.refs['REL-1']
+            updated = await client.update_ref(repo, merged.commit_hash)
+            with self.assertRaises(GitHubError):
+                await client.merge_branch(repo, 'master', 'REL-1')
+            await client.close()
+            return (repos, single, merged, updated)
+
+        with MockGitHubServer(organization) as server:
+            (repos, single, merged, updated) = asyncio.run(run(server))
+
+        self.assertEqual(len(repos), 250)
+        self.assertEqual(len(single), 250)
+        self.assertEqual(updated.commit_hash, merged.commit_hash)
+        self.assertEqual(server.stats()['connections'], 1)
+
+    def test_should_match_the_synchronous_auto_merge(self):
+        def new_organization():
+            return MockOrganization(300, coverage={'REL-1': 0.6, 'REL-2': 0.5}, up_to_date=0.2, conflicts=0.05, read_only=0.02)
+
+        with MockGitHubServer(new_organization()) as server:
+            client = GitHubClient('token', server.organization.login, GitHubClient.create_pool(4, server.url))
+            expected = auto_merge('master', 'REL-1', 'REL-2', client, batch_size=10)
+            client.close()
+
+        async def run(server):
+            client = self.new_client(server, 16)
+            results = await async_utilities.auto_merge('master', 'REL-1', 'REL-2', client, batch_size=10)
+            await client.close()
+            return results
+
+        with MockGitHubServer(new_organization()) as server:
+            results = asyncio.run(run(server))
+
+        names = lambda results: [[[repo.name for repo in repos] for repos in phase] for phase in results]
+        self.assertEqual(names(results), names(expected))
+        self.assertTrue(server.stats()['connections'] <= 16)
+
+    def test_should_share_a_bounded_pool_between_thousands_of_requests(self):
+        organization = MockOrganization(2000, coverage={'REL-1': 1.0})
+
+        async def run(server):
+            client = self.new_client(server, 20)
+            repos = list(await client.get_repositories_for_branches(['REL-1', 'master']))
+            results = await client.merge_branches(repos, 'master', 'REL-1', batchSize=1)
+            await client.close()
+            return results
+
+        with MockGitHubServer(organization, mutation_latency=0.001) as server:
+            results = asyncio.run(run(server))
+
+        self.assertEqual(len(results), 2000)
+        self.assertFalse([result for result in results if isinstance(result, GitHubError)])
+        self.assertTrue(server.stats()['connections'] <= 20)
+
+    def test_should_look_up_refs_by_id_in_bounded_parallel_batches(self):
+        organization = MockOrganization(450, coverage={'REL-1': 0.5})
+
+        async def run(server):
+            client = self.new_client(server, nodeBatchSize=50, scanConcurrency=3)
+            repos = await client.get_repositories_for_branches(['REL-1', 'master'])
+            await client.close()
+            return repos
+
+        with MockGitHubServer(organization) as server:
+            repos = asyncio.run(run(server))
+
+        self.assertEqual([repo.name for repo in repos], [repo['name'] for repo in organization.repositories])
+        self.assertEqual([repo.name for repo in repos if 'REL-1' in repo.refs], [repo['name'] for repo in organization.repositories if 'REL-1' in repo['branches']])
+        self.assertEqual(server.stats()['operations'], {'RepositoryIds': 5, 'RepositoryNodes': 9})
+
+    def test_should_retry_injected_errors(self):
+        organization = MockOrganization(500, coverage={'REL-1': 1.0})
+        scheduler = RequestScheduler(backoff=0.001, max_retries=10)
+
+        async def run(server):
+            client = self.new_client(server, scheduler=scheduler)
+            repos = await client.get_repositories_for_branches(['REL-1', 'master'])
+            await client.close()
+            return repos
+
+        with MockGitHubServer(organization, error_rate=0.3, secondary_limit_every=4) as server:
+            repos = asyncio.run(run(server))
+
+        self.assertEqual(len(repos), 500)
+        self.assertTrue(scheduler.retries > 0)
+
+    def test_should_read_chunked_bodies(self):
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'5\r\nhello\r\n7;ext=1\r\n, world\r\n0\r\nTrailer: x\r\n\r\nnext')
+            headers = BytesParser(_class=http.client.HTTPMessage).parsebytes(b'Transfer-Encoding: chunked\r\n\r\n')
+            return (await read_body(reader, headers), await reader.read(4))
+
+        self.assertEqual(asyncio.run(run()), (b'hello, world', b'next'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,32 @@
 import unittest
+import os
+import tempfile
 import types
+import threading
+import time
 from unittest.mock import Mock
+from automerge.stats import MergeStatistics
 from automerge.utilities import auto_merge
 from github.client import GitHubClient
-from github.types import Repository, Ref, MergeResponse, GitHubError
+from github.scheduler import RequestScheduler
+from tests.github_client_test import FakePool, FakeResponse
+from github.types import Repository, Ref, MergeResponse, GitHubError, Comparison, UpdateRefResponse
+
+def combine_scans(branches, scans):
+    # fold per-branch listings into the branch -> Ref map returned by a multi-branch scan
+    combined = {}
+    for (branch, scan) in zip(branches, scans):
+        for repo in scan:
+            combined.setdefault(repo.name, Repository(repo.id, repo.name, repo.permission, None))
+            if repo.ref:
+                combined[repo.name].refs[branch] = repo.ref
+    return list(combined.values())
 
 class AutoMergeTest(unittest.TestCase):
 
     def test_should_raise_exception_when_no_head_branch_is_found(self):
         client = GitHubClient('', '')
-        client.get_repositories = Mock(return_value=[])
+        client.iter_repositories_for_branches = Mock(return_value=[])
 
         with self.assertRaises(Exception):
             auto_merge('master', 'rel', '', client)
@@ -24,7 +41,7 @@ class AutoMergeTest(unittest.TestCase):
             [
             ]
         ]
-        client.get_repositories = Mock(side_effect=mock_repos)
+        client.iter_repositories_for_branches = Mock(return_value=combine_scans(['release', 'master'], mock_repos))
 
         with self.assertRaises(Exception):
             auto_merge('master', 'release', '', client)
@@ -55,7 +72,7 @@ class AutoMergeTest(unittest.TestCase):
         mock_merge_response = MergeResponse('', 'https://github.com/org/repo/commits/#hash', 'merged')
         expected_merged_repos = 3
 
-        client.get_repositories = Mock(side_effect=mock_repos)
+        client.iter_repositories_for_branches = Mock(return_value=combine_scans(['release', 'master'], mock_repos))
         client.merge_branch = Mock(return_value=mock_merge_response)
 
         results = auto_merge('master', 'release', '', client)
@@ -96,7 +113,7 @@ class AutoMergeTest(unittest.TestCase):
         expected_succeeded_repos = 1
         expected_unprocessed_repos = 1
 
-        client.get_repositories = Mock(side_effect=mock_repos)
+        client.iter_repositories_for_branches = Mock(return_value=combine_scans(['release', 'master'], mock_repos))
         client.merge_branch = Mock(side_effect=mock_merge_branch)
 
         results = auto_merge('master', 'release', '', client)
@@ -121,7 +138,7 @@ class AutoMergeTest(unittest.TestCase):
         ]
         expected_failed_repos = 1
 
-        client.get_repositories = Mock(side_effect=mock_repos)
+        client.iter_repositories_for_branches = Mock(return_value=combine_scans(['release', 'master'], mock_repos))
 
         results = auto_merge('master', 'release', '', client)
         (succeeded, unprocessed, failed) = results[0]
@@ -170,7 +187,7 @@ class AutoMergeTest(unittest.TestCase):
 
         expected_curr_release_succeeded_repos = 2
 
-        client.get_repositories = Mock(side_effect=mock_repos)
+        client.iter_repositories_for_branches = Mock(return_value=combine_scans(['release', 'master', 'current_release'], mock_repos))
         client.merge_branch = Mock(side_effect=mock_merge_branch)
 
         results = auto_merge('master', 'release', 'current_release', client)
@@ -189,6 +206,241 @@ class AutoMergeTest(unittest.TestCase):
         self.assertEqual(len(unprocessed), 0)
         self.assertEqual(len(failed), 0)        
 
+    def test_should_scan_all_branches_in_a_single_call(self):
+        client = GitHubClient('', '')
+        client.iter_repositories_for_branches = Mock(return_value=[
+            Repository('', 'RepoA', 'WRITE', None, {
+                'release': Ref('', '', 'release', ''),
+                'master': Ref('', '', 'master', ''),
+                'current_release': Ref('', '', 'current_release', '')
+            })
+        ])
+        client.merge_branch = Mock(return_value=MergeResponse('', 'https://github.com/org/repo/commits/#hash', 'merged'))
+
+        auto_merge('master', 'release', 'current_release', client)
+
+        client.iter_repositories_for_branches.assert_called_once_with(
+            ['release', 'master', 'current_release'], [('master', 'release'), ('current_release', 'master')])
+        self.assertEqual(client.merge_branch.call_count, 2)
+
+    def test_should_classify_batched_merge_results_per_repository(self):
+        client = GitHubClient('', '')
+        client.iter_repositories_for_branches = Mock(return_value=[
+            Repository('', name, 'WRITE', None, {
+                'release': Ref('', '', 'release', ''),
+                'master': Ref('', '', 'master', '')
+            }) for name in ['RepoA', 'RepoB', 'RepoC']
+        ])
+        client.merge_branches = Mock(return_value=[
+            MergeResponse('', 'https://github.com/org/repo/commits/#hash', 'merged'),
+            GitHubError('UNPROCESSABLE', 'Failed to merge: \"Already merged\"'),
+            GitHubError('UNPROCESSABLE', 'Merge conflict')
+        ])
+        client.merge_branch = Mock()
+
+        (succeeded, unprocessed, failed) = auto_merge('master', 'release', '', client, batch_size=10)[0]
+
+        client.merge_branch.assert_not_called()
+        self.assertEqual(client.merge_branches.call_count, 1)
+        self.assertEqual([repo.name for repo in succeeded], ['RepoA'])
+        self.assertEqual([repo.name for repo in unprocessed], ['RepoB'])
+        self.assertEqual([repo.name for repo in failed], ['RepoC'])
+
+    def test_should_merge_concurrently_and_report_in_repository_order(self):
+        client = GitHubClient('', '')
+        names = ['Repo{}'.format(i) for i in range(8)]
+        client.iter_repositories_for_branches = Mock(return_value=[
+            Repository('', name, 'WRITE', None, {
+                'release': Ref('', '', 'release', ''),
+                'master': Ref('', '', 'master', '')
+            }) for name in names
+        ])
+
+        lock = threading.Lock()
+        in_flight = 0
+        peak = 0
+        def mock_merge_branch(repo, base, head, message):
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            # later repositories finish first so ordering can't come from completion time
+            time.sleep(0.01 * (len(names) - names.index(repo.name)))
+            with lock:
+                in_flight -= 1
+            if repo.name == 'Repo3':
+                raise GitHubError('UNPROCESSABLE', 'Merge conflict')
+            return MergeResponse('', 'https://github.com/org/repo/commits/#hash', 'merged')
+
+        client.merge_branch = Mock(side_effect=mock_merge_branch)
+
+        (succeeded, unprocessed, failed) = auto_merge('master', 'release', '', client, concurrency=4)[0]
+
+        self.assertTrue(1 < peak <= 4)
+        self.assertEqual([repo.name for repo in succeeded], [name for name in names if name != 'Repo3'])
+        self.assertEqual(unprocessed, [])
+        self.assertEqual([repo.name for repo in failed], ['Repo3'])
+
+    def test_should_skip_merges_for_repositories_already_up_to_date(self):
+        client = GitHubClient('', '')
+        refs = lambda: {
+            'release': Ref('', '', 'release', ''),
+            'master': Ref('', '', 'master', ''),
+            'current_release': Ref('', '', 'current_release', '')
+        }
+        client.iter_repositories_for_branches = Mock(return_value=[
+            # RepoA: release has new commits, so master moves and its current release comparison goes stale
+            Repository('', 'RepoA', 'WRITE', None, refs(), comparisons={
+                ('master', 'release'): Comparison(2, 0, 'AHEAD'),
+                ('current_release', 'master'): Comparison(0, 3, 'BEHIND')
+            }),
+            # RepoB: nothing to merge anywhere
+            Repository('', 'RepoB', 'WRITE', None, refs(), comparisons={
+                ('master', 'release'): Comparison(0, 1, 'BEHIND'),
+                ('current_release', 'master'): Comparison(0, 0, 'IDENTICAL')
+            })
+        ])
+        client.merge_branch = Mock(return_value=MergeResponse('', 'https://github.com/org/repo/commits/#hash', 'merged'))
+
+        results = auto_merge('master', 'release', 'current_release', client)
+
+        merged = [(call.args[0].name, call.args[1]) for call in client.merge_branch.call_args_list]
+        self.assertEqual(merged, [('RepoA', 'master'), ('RepoA', 'current_release')])
+        self.assertEqual([repo.name for repo in results[0][0]], ['RepoA'])
+        self.assertEqual([repo.name for repo in results[0][1]], ['RepoB'])
+        self.assertEqual([repo.name for repo in results[1][0]], ['RepoA'])
+        self.assertEqual([repo.name for repo in results[1][1]], ['RepoB'])
+
+    def test_should_merge_while_the_scan_is_still_running(self):
+        client = GitHubClient('', '')
+        refs = lambda: {
+            'release': Ref('', '', 'release', ''),
+            'master': Ref('', '', 'master', ''),
+            'current_release': Ref('', '', 'current_release', '')
+        }
+        first_base_merge = threading.Event()
+        first_release_merge = threading.Event()
+        def mock_merge_branch(repo, base, head, message):
+            if base == 'master':
+                first_base_merge.set()
+            if base == 'current_release':
+                first_release_merge.set()
+            if (repo.name, base) == ('RepoB', 'master'):
+                # there is no barrier between the phases: RepoA moves on while RepoB is still merging
+                self.assertTrue(first_release_merge.wait(5))
+            return MergeResponse('', 'https://github.com/org/repo/commits/#hash', 'merged')
+
+        def scan(branches, comparisons):
+            yield Repository('', 'RepoA', 'WRITE', None, refs())
+            # RepoA is merged before the rest of the organization has been found
+            self.assertTrue(first_base_merge.wait(5))
+            yield Repository('', 'RepoB', 'WRITE', None, refs())
+
+        client.iter_repositories_for_branches = Mock(side_effect=scan)
+        client.merge_branch = Mock(side_effect=mock_merge_branch)
+
+        results = auto_merge('master', 'release', 'current_release', client, concurrency=2)
+
+        self.assertEqual([repo.name for repo in results[0][0]], ['RepoA', 'RepoB'])
+        self.assertEqual([repo.name for repo in results[1][0]], ['RepoA', 'RepoB'])
+
+    def test_should_fast_forward_bases_that_are_ancestors_of_head(self):
+        client = GitHubClient('', '')
+        def new_repository(name: str, comparison: Comparison) -> Repository:
+            refs = {branch: Ref('ref-' + branch, branch, name + '-' + branch, '') for branch in ('release', 'master')}
+            return Repository('id-' + name, name, 'WRITE', None, refs, comparisons={('master', 'release'): comparison})
+        client.iter_repositories_for_branches = Mock(return_value=[
+            new_repository('RepoA', Comparison(2, 0, 'AHEAD')),
+            new_repository('RepoB', Comparison(2, 1, 'DIVERGED')),
+            new_repository('RepoC', Comparison(1, 0, 'AHEAD'))
+        ])
+        def fast_forward(repo, base, head):
+            if repo.name != 'RepoA':
+                raise GitHubError('UNPROCESSABLE', 'Update is not a fast forward')
+            return UpdateRefResponse(repo.refs[head].oid, 'https://github.com/org/{}/commit/{}'.format(repo.name, repo.refs[head].oid))
+        client.fast_forward = Mock(side_effect=fast_forward)
+        client.merge_branch = Mock(return_value=MergeResponse('merged', 'https://github.com/org/repo/commit/merged', 'merged'))
+        report = []
+
+        (succeeded, unprocessed, failed) = auto_merge('master', 'release', '', client, report=report, fast_forward=True)[0]
+
+        self.assertEqual([call.args[0].name for call in client.fast_forward.call_args_list], ['RepoA', 'RepoC'])
+        # RepoB has diverged, and master moved off RepoC's release branch after the scan
+        self.assertEqual(sorted(call.args[0].name for call in client.merge_branch.call_args_list), ['RepoB', 'RepoC'])
+        self.assertEqual([repo.name for repo in succeeded], ['RepoA', 'RepoB', 'RepoC'])
+        results = {repo.name: result for (result, repo) in report[0][2]}
+        self.assertIsInstance(results['RepoA'], UpdateRefResponse)
+        self.assertEqual(results['RepoA'].commit_hash, 'RepoA-release')
+        self.assertIsInstance(results['RepoC'], MergeResponse)
+
+    def test_should_merge_ancestors_without_fast_forward(self):
+        client = GitHubClient('', '')
+        client.iter_repositories_for_branches = Mock(return_value=[
+            Repository('', 'RepoA', 'WRITE', None, {'release': Ref('', '', 'release', ''), 'master': Ref('', '', 'master', '')},
+                comparisons={('master', 'release'): Comparison(2, 0, 'AHEAD')})
+        ])
+        client.fast_forward = Mock()
+        client.merge_branch = Mock(return_value=MergeResponse('', 'https://github.com/org/repo/commits/#hash', 'merged'))
+
+        auto_merge('master', 'release', '', client)
+
+        client.fast_forward.assert_not_called()
+        self.assertEqual(client.merge_branch.call_count, 1)
+
+    def test_should_fail_each_repository_of_a_request_that_fails_whatever_the_batch_size(self):
+        refs = lambda: {'release': Ref('', '', 'release', ''), 'master': Ref('', '', 'master', '')}
+        for batch_size in (1, 10):
+            # every attempt, retries included, gets a 502
+            pool = FakePool([FakeResponse({'message': 'Server Error'}, status=502, reason='Bad Gateway') for _ in range(100)])
+            client = GitHubClient('', 'org', pool, RequestScheduler(sleep=lambda seconds: None, clock=lambda: 0.0))
+            client.iter_repositories_for_branches = Mock(return_value=[
+                Repository('idA', 'RepoA', 'WRITE', None, refs()),
+                Repository('idB', 'RepoB', 'WRITE', None, refs()),
+                Repository('idC', 'RepoC', 'WRITE', None, refs(), comparisons={('master', 'release'): Comparison(2, 0, 'AHEAD')})
+            ])
+
+            report = []
+            (succeeded, unprocessed, failed) = auto_merge('master', 'release', '', client, batch_size, fast_forward=True, report=report)[0]
+
+            self.assertEqual((succeeded, unprocessed), ([], []))
+            self.assertEqual(sorted(repo.name for repo in failed), ['RepoA', 'RepoB', 'RepoC'])
+            self.assertTrue(all('502' in message for (message, _) in report[0][4]))
+
+    def test_should_start_likely_failures_and_slow_merges_first(self):
+        names = ['RepoA', 'RepoB', 'RepoC', 'RepoD', 'RepoE']
+        scanned = threading.Event()
+        def scan(branches, comparisons):
+            for name in names:
+                yield Repository('id-' + name, name, 'WRITE', None, {'release': Ref('', '', 'release', ''), 'master': Ref('', '', 'master', '')})
+            scanned.set()
+
+        merged = []
+        def merge(repo, base, head, message):
+            # the first merge holds its slot until every repository has been queued behind it
+            if not merged:
+                scanned.wait(5)
+            merged.append(repo.name)
+            return MergeResponse('', 'https://github.com/org/repo/commits/#hash', 'merged')
+
+        client = GitHubClient('', 'org')
+        client.iter_repositories_for_branches = Mock(side_effect=scan)
+        client.merge_branch = Mock(side_effect=merge)
+        with tempfile.TemporaryDirectory() as directory:
+            stats = MergeStatistics(os.path.join(directory, 'merge_stats.sqlite3'))
+            for (name, seconds, failed) in (('RepoA', 1.0, False), ('RepoB', 10.0, False), ('RepoC', 5.0, True), ('RepoE', 3.0, False)):
+                stats.record('org', name, seconds, failed)
+            stats.flush()
+
+            auto_merge('master', 'release', '', client, report=[], stats=stats)
+            history = stats.history('org')
+            stats.close()
+
+        # RepoC conflicted last time, RepoB is the slowest, RepoD is expected to take the average 4.75s
+        self.assertEqual(merged, ['RepoA', 'RepoC', 'RepoB', 'RepoD', 'RepoE'])
+        self.assertEqual(sorted(history), names)
+        self.assertEqual(history['RepoD'].samples, 1)
+        self.assertEqual(history['RepoC'].samples, 2)
+        self.assertTrue(history['RepoC'].failure_rate < 1.0)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+End-to-end benchmark of AutoMerge.py against the local MockGitHubServer.
+
+Each scenario runs AutoMerge.py in a subprocess against a simulated organization and
+records wall time, request count, bytes transferred and the peak RSS of the process.
+
+    python tests/benchmark.py                         # 10, 100, 1000 and 5000 repositories
+    python tests/benchmark.py --sizes 10 100 --check  # fail if worse than the baseline
+    python tests/benchmark.py --update_baseline
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from tests.mock_github_server import MockGitHubServer, MockOrganization
+
+AUTOMERGE = os.path.join(ROOT, 'AutoMerge.py')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+SIZES = [10, 100, 1000, 5000]
+
+# rusage of a child still carries the parent's peak RSS from before exec, so the child reports
+# its own high water mark (VmHWM) on exit instead
+PEAK_RSS_SHIM = """
+import atexit, resource, runpy, sys
+def report(path=sys.argv.pop(1)):
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open('/proc/self/status') as status:
+            peak = next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        pass
+    with open(path, 'w') as output:
+        output.write(str(peak))
+atexit.register(report)
+sys.argv.pop(0)
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+SCENARIOS = {
+    'default': [],
+    'tuned': ['--batch_size', '25', '--concurrency', '8'],
+    'parallel_scan': ['--batch_size', '25', '--concurrency', '8', '--scan_concurrency', '8'],
+    'cached_scan': ['--batch_size', '25', '--concurrency', '8', '--scan_concurrency', '8']
+}
+
+# scenarios that keep the repository inventory cache; a plan run fills it before the measured run
+CACHED_SCENARIOS = {'cached_scan'}
+
+# a metric regresses when it exceeds baseline * (1 + relative) + absolute
+TOLERANCES = {
+    'requests': (0.0, 0),
+    'bytes': (0.05, 1024),
+    'wall_time': (0.5, 1.0),
+    'peak_rss_kb': (0.25, 4096)
+}
+# the metrics that depend only on the code, not on how busy the machine running it is
+DETERMINISTIC_METRICS = ('requests', 'bytes')
+
+def run_benchmark(size: int, arguments: list = (), latency: float = 0.0, ref_latency: float = 0.0, cached: bool = False) -> dict:
+    organization = MockOrganization(size, coverage={'REL-1': 0.6, 'REL-2': 0.4}, up_to_date=0.2, conflicts=0.05, read_only=0.02)
+    with MockGitHubServer(organization, latency=latency, mutation_latency=latency, ref_latency=ref_latency) as server:
+        with tempfile.NamedTemporaryFile('r') as peak_rss, tempfile.TemporaryDirectory() as state:
+            common = ['master', 'REL-1', '--current_rel_branch', 'REL-2', '--token', 'benchmark', '--org', organization.login,
+                '--api_url', server.url, '--config_path', os.devnull, '--cache_dir', state]
+            if cached:
+                # scans and merges nothing, leaving a warm cache for the measured run; a plan takes only the scan options
+                scan = [argument for (option, value) in zip(arguments[::2], arguments[1::2]) if option.startswith('--scan_') for argument in (option, value)]
+                subprocess.check_call([sys.executable, AUTOMERGE, 'plan', '--plan', os.path.join(state, 'plan.json')] + common + scan,
+                    cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            before = server.stats()
+            command = [sys.executable, '-c', PEAK_RSS_SHIM, peak_rss.name, AUTOMERGE] + common + list(arguments) + ([] if cached else ['--no_cache'])
+            start = time.perf_counter()
+            exit_code = subprocess.call(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wall_time = time.perf_counter() - start
+            peak_rss_kb = int(peak_rss.read() or 0)
+
+    stats = server.stats()
+    return {
+        'exit_code': exit_code,
+        'wall_time': round(wall_time, 3),
+        'requests': stats['requests'] - before['requests'],
+        'bytes': stats['bytes_received'] + stats['bytes_sent'] - before['bytes_received'] - before['bytes_sent'],
+        'peak_rss_kb': peak_rss_kb
+    }
+
+def run_benchmarks(sizes: list, scenarios: list, latency: float = 0.0, ref_latency: float = 0.0) -> dict:
+    results = {}
+    for scenario in scenarios:
+        for size in sizes:
+            results['{}/{}'.format(scenario, size)] = run_benchmark(size, SCENARIOS[scenario], latency, ref_latency, scenario in CACHED_SCENARIOS)
+    return results
+
+def load_baseline(path: str = BASELINE) -> dict:
+    with open(path) as baseline:
+        return json.load(baseline)
+
+def find_regressions(results: dict, baseline: dict, metrics: list = tuple(TOLERANCES)) -> list:
+    regressions = []
+    for (key, result) in results.items():
+        if result['exit_code'] != 0:
+            regressions.append('{}: AutoMerge.py exited with {}'.format(key, result['exit_code']))
+        if key not in baseline:
+            continue
+        for metric in metrics:
+            (relative, absolute) = TOLERANCES[metric]
+            limit = baseline[key][metric] * (1 + relative) + absolute
+            if result[metric] > limit:
+                regressions.append('{}: {} regressed from {} to {} (limit {:.0f})'.format(
+                    key, metric, baseline[key][metric], result[metric], limit))
+    return regressions
+
+def print_results(results: dict):
+    print('{:<16} {:>10} {:>10} {:>14} {:>12}'.format('scenario', 'wall (s)', 'requests', 'bytes', 'peak RSS KB'))
+    for (key, result) in results.items():
+        print('{:<16} {:>10.3f} {:>10} {:>14} {:>12}'.format(key, result['wall_time'], result['requests'], result['bytes'], result['peak_rss_kb']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark AutoMerge.py end to end against a local mock GitHub server")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="Organization sizes to simulate")
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds of simulated server latency per request")
+    parser.add_argument('--ref_latency', type=float, default=0.0, help="Seconds of simulated server latency per ref resolved per repository")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--check', action='store_true', help="Exit non-zero if any result is worse than the baseline")
+    parser.add_argument('--update_baseline', action='store_true', help="Record these results as the new baseline")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.scenarios, args.latency, args.ref_latency)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.update_baseline:
+        baseline = load_baseline() if os.path.exists(BASELINE) else {}
+        baseline.update(results)
+        with open(BASELINE, 'w') as output:
+            json.dump(baseline, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+    if args.check:
+        regressions = find_regressions(results, load_baseline())
+        for regression in regressions:
+            print('REGRESSION: ' + regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,25 @@
+import unittest
+import os
+from tests.benchmark import run_benchmarks, load_baseline, find_regressions, SCENARIOS, TOLERANCES, DETERMINISTIC_METRICS
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_should_not_regress_against_baseline(self):
+        results = run_benchmarks([10, 100], list(SCENARIOS))
+        # wall time and memory vary with the machine, so they are only checked on request (or with benchmark.py --check)
+        metrics = tuple(TOLERANCES) if os.environ.get('AUTOMERGE_BENCHMARK_TIMING') else DETERMINISTIC_METRICS
+
+        self.assertEqual(find_regressions(results, load_baseline(), metrics), [])
+
+    def test_should_flag_metrics_worse_than_baseline(self):
+        baseline = {'default/10': {'exit_code': 0, 'wall_time': 1.0, 'requests': 8, 'bytes': 10000, 'peak_rss_kb': 20000}}
+        results = {'default/10': dict(baseline['default/10'], requests=9)}
+        slow = {'default/10': dict(baseline['default/10'], wall_time=60.0)}
+
+        self.assertEqual(len(find_regressions(results, baseline)), 1)
+        self.assertEqual(len(find_regressions(slow, baseline)), 1)
+        self.assertEqual(find_regressions(slow, baseline, DETERMINISTIC_METRICS), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
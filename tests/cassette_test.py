@@ -0,0 +1,69 @@
+import unittest
+import json
+import os
+import tempfile
+import time
+from tests.mock_github_server import MockGitHubServer, MockOrganization
+from github.cassette import CassetteError, RecordingTransport, ReplayTransport
+from github.client import GitHubClient
+from automerge.utilities import auto_merge
+
+class CassetteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cassettes', 'run.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_auto_merge(self, transport) -> list:
+        client = GitHubClient('s3cr3t-token', 'mock-org', transport)
+        report = []
+        auto_merge('master', 'REL-1', 'REL-2', client, report=report)
+        client.close()
+        return [(base, head, [(repo.name, type(result).__name__, getattr(result, 'commit_hash', None) or str(result)) for (result, repo) in succeeded + unprocessed + failed])
+            for (base, head, succeeded, unprocessed, failed, up_to_date, finished) in report]
+
+    def record(self, **kwargs) -> list:
+        organization = MockOrganization(120, login='mock-org', coverage={'REL-1': 0.6, 'REL-2': 0.5}, up_to_date=0.2, conflicts=0.1)
+        with MockGitHubServer(organization, **kwargs) as server:
+            return self.run_auto_merge(RecordingTransport(GitHubClient.create_pool(4, server.url), self.path))
+
+    def test_should_replay_a_recorded_run_without_the_network(self):
+        recorded = self.record()
+
+        with open(self.path, encoding='utf-8') as cassette:
+            contents = cassette.read()
+        self.assertNotIn('s3cr3t-token', contents)
+        operations = [json.loads(line).get('operation') for line in contents.splitlines()[1:]]
+        self.assertIn('RepositoriesForBranches', operations)
+        self.assertIn('MergeBranch', operations)
+
+        replay = ReplayTransport(self.path)
+        self.assertEqual(self.run_auto_merge(replay), recorded)
+        self.assertEqual(replay.remaining, 0)
+        self.assertEqual(replay.requests_sent, len(operations))
+        # a request the recorded run never made can't be answered
+        with self.assertRaises(CassetteError):
+            GitHubClient('s3cr3t-token', 'mock-org', replay).get_repositories_for_branches(['master', 'REL-3'])
+
+    def test_should_replay_at_recorded_latency_when_asked(self):
+        self.record(latency=0.01, mutation_latency=0.01)
+        with open(self.path, encoding='utf-8') as cassette:
+            latency = sum(json.loads(line).get('latency', 0) for line in cassette)
+
+        start = time.perf_counter()
+        self.run_auto_merge(ReplayTransport(self.path, speed=1.0))
+        faithful = time.perf_counter() - start
+        start = time.perf_counter()
+        self.run_auto_merge(ReplayTransport(self.path))
+        fast = time.perf_counter() - start
+
+        # the scan overlaps the merges, so the replay takes at least the slowest single stream of them
+        self.assertTrue(faithful >= latency / 4)
+        self.assertTrue(fast < faithful)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from github.connection import ConnectionPool
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    drop_after_response = False
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if KeepAliveHandler.drop_after_response:
+            # simulate the server reaping an idle keep-alive socket without telling the client
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        KeepAliveHandler.drop_after_response = False
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def new_pool(self, **kwargs):
+        return ConnectionPool('127.0.0.1', self.server.server_address[1], secure=False, **kwargs)
+
+    def test_should_reuse_connection_across_requests(self):
+        pool = self.new_pool()
+
+        for i in range(5):
+            with pool.request('POST', '/graphql', body=str(i)) as response:
+                self.assertEqual(response.read(), str(i).encode())
+
+        self.assertEqual(pool.requests_sent, 5)
+        self.assertEqual(pool.connections_opened, 1)
+        pool.close()
+
+    def test_should_discard_connections_past_idle_timeout(self):
+        pool = self.new_pool(idle_timeout=-1)
+
+        for i in range(3):
+            with pool.request('POST', '/graphql', body='x') as response:
+                response.read()
+
+        self.assertEqual(pool.connections_opened, 3)
+        pool.close()
+
+    def test_should_reconnect_when_server_drops_idle_socket(self):
+        KeepAliveHandler.drop_after_response = True
+        pool = self.new_pool()
+
+        for i in range(3):
+            with pool.request('POST', '/graphql', body='x') as response:
+                self.assertEqual(response.read(), b'x')
+
+        self.assertTrue(pool.requests_sent >= 3)
+        self.assertEqual(pool.connections_opened, 3)
+        pool.close()
+
+    def test_should_bound_concurrent_connections_to_pool_size(self):
+        pool = self.new_pool(size=2)
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(10):
+                    with pool.request('POST', '/graphql', body='x') as response:
+                        response.read()
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(pool.requests_sent, 60)
+        self.assertTrue(pool.connections_opened <= 2)
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
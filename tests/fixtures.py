@@ -0,0 +1,7 @@
+from github.types import Repository, Ref
+
+def new_repository(name: str, branches) -> Repository:
+    # branches is a list of names, or a dict of each name to its head oid
+    oids = branches if isinstance(branches, dict) else {branch: 'oid-{}-{}'.format(name, branch) for branch in branches}
+    refs = {branch: Ref('ref-{}-{}'.format(name, branch), branch, oid, None) for (branch, oid) in oids.items()}
+    return Repository('id-' + name, name, 'WRITE', None, refs)
@@ -0,0 +1,228 @@
+import unittest
+import io
+import json
+import os
+import tempfile
+from github.cache import RepositoryCache
+from github.client import GitHubClient
+from github.scheduler import RequestScheduler
+from github.types import Repository, MergeResponse, GitHubError, GitHubPermissionError
+
+class FakeResponse(io.BytesIO):
+
+    def __init__(self, payload: dict, status: int = 200, reason: str = 'OK', headers: dict = None):
+        super().__init__(json.dumps(payload).encode())
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+    def getheader(self, name: str, default: str = None) -> str:
+        return self.headers.get(name, default)
+
+class FakePool:
+    """Stands in for ConnectionPool, answering each request with the next canned payload."""
+
+    def __init__(self, responses: list):
+        self.responses = list(responses)
+        self.requests = []
+        self.requests_sent = 0
+        self.connections_opened = 1
+
+    def request(self, method: str, url: str, body=None, headers: dict = None):
+        self.requests.append(json.loads(body))
+        self.requests_sent += 1
+        response = self.responses.pop(0)
+        return response if isinstance(response, FakeResponse) else FakeResponse(response)
+
+    def close(self):
+        pass
+
+def repository_node(name: str, refs: dict, permission: str = 'WRITE') -> dict:
+    node = {'id': 'id-' + name, 'name': name, 'viewerPermission': permission}
+    for (alias, oid) in refs.items():
+        node[alias] = {'id': 'ref-' + oid, 'name': alias, 'target': {'id': oid, 'oid': oid, 'message': ''}} if oid else None
+    return node
+
+def repositories_page(nodes: list, has_next_page: bool = False) -> dict:
+    edges = [{'node': node} for node in nodes]
+    page_info = {'hasNextPage': has_next_page, 'endCursor': 'cursor-' + nodes[-1]['name'] if nodes else None}
+    return {'data': {'organization': {'repositories': {'pageInfo': page_info, 'edges': edges}}}}
+
+class GitHubClientTest(unittest.TestCase):
+
+    def test_should_fetch_every_branch_in_one_scan(self):
+        pool = FakePool([
+            repositories_page([
+                repository_node('RepoA', {'ref0': 'a-head', 'ref1': 'a-base'}),
+                repository_node('RepoB', {'ref0': None, 'ref1': 'b-base'})
+            ])
+        ])
+        client = GitHubClient('token', 'org', pool)
+
+        repos = client.get_repositories_for_branches(['REL-1', 'master'])
+
+        self.assertEqual(pool.requests_sent, 1)
+        request = pool.requests[0]
+        self.assertIn('ref0:ref(qualifiedName:$ref0)', request['query'])
+        self.assertIn('ref1:ref(qualifiedName:$ref1)', request['query'])
+        self.assertEqual(request['variables'], {'org': 'org', 'after': None, 'ref0': 'refs/heads/REL-1', 'ref1': 'refs/heads/master'})
+        self.assertEqual([repo.name for repo in repos], ['RepoA', 'RepoB'])
+        self.assertEqual(repos.get('RepoA').refs['REL-1'].oid, 'a-head')
+        self.assertEqual(repos.get('RepoA').refs['master'].oid, 'a-base')
+        self.assertNotIn('REL-1', repos.get('RepoB').refs)
+
+    def test_should_page_through_organization_once_for_all_branches(self):
+        first_page = [repository_node('Repo{}'.format(i), {'ref0': 'h', 'ref1': 'b'}) for i in range(100)]
+        pool = FakePool([
+            repositories_page(first_page, has_next_page=True),
+            repositories_page([repository_node('Last', {'ref0': 'h', 'ref1': None})])
+        ])
+        client = GitHubClient('token', 'org', pool)
+
+        repos = client.get_repositories_for_branches(['REL-1', 'master'])
+
+        self.assertEqual(pool.requests_sent, 2)
+        self.assertEqual(pool.requests[1]['variables']['after'], 'cursor-Repo99')
+        self.assertEqual(pool.requests[0]['query'], pool.requests[1]['query'])
+        self.assertEqual(len(repos), 101)
+
+    def test_should_stop_paging_when_there_is_no_next_page(self):
+        full_page = [repository_node('Repo{}'.format(i), {'ref': 'h'}) for i in range(100)]
+        pool = FakePool([repositories_page(full_page)])
+        client = GitHubClient('token', 'org', pool)
+
+        repos = client.iter_repositories('REL-1')
+
+        self.assertEqual(pool.requests_sent, 0)
+        self.assertEqual(len(list(repos)), 100)
+        self.assertEqual(pool.requests_sent, 1)
+
+    def test_should_batch_merge_mutations_and_map_results_per_repository(self):
+        commit = lambda oid: {'mergeCommit': {'oid': oid, 'commitUrl': 'url/' + oid, 'message': 'merged'}}
+        pool = FakePool([
+            {
+                'data': {'merge0': commit('a'), 'merge1': None},
+                'errors': [{'type': 'UNPROCESSABLE', 'path': ['merge1'], 'message': 'Failed to merge: "Already merged"'}]
+            },
+            {
+                'data': {'merge0': None},
+                'errors': [{'type': 'UNPROCESSABLE', 'path': ['merge0'], 'message': 'Merge conflict'}]
+            }
+        ])
+        client = GitHubClient('token', 'org', pool)
+        repos = [
+            Repository('idA', 'RepoA', 'WRITE', None),
+            Repository('idB', 'RepoB', 'WRITE', None),
+            Repository('idC', 'RepoC', 'READ', None),
+            Repository('idD', 'RepoD', 'ADMIN', None)
+        ]
+
+        results = client.merge_branches(repos, 'master', 'REL-1', 'message', batchSize=2)
+
+        self.assertEqual(pool.requests_sent, 2)
+        self.assertIn('merge1:mergeBranch(input:$input1)', pool.requests[0]['query'])
+        self.assertEqual([variables['repositoryId'] for variables in pool.requests[0]['variables'].values()], ['idA', 'idB'])
+        self.assertEqual([variables['repositoryId'] for variables in pool.requests[1]['variables'].values()], ['idD'])
+        self.assertIsInstance(results[0], MergeResponse)
+        self.assertEqual(results[0].commit_hash, 'a')
+        self.assertIn('already merged', results[1].message.lower())
+        self.assertIsInstance(results[2], GitHubPermissionError)
+        self.assertIsInstance(results[3], GitHubError)
+        self.assertEqual(results[3].message, 'Merge conflict')
+
+    def test_should_retry_requests_that_fail_with_a_transient_status(self):
+        pool = FakePool([
+            FakeResponse({'message': 'Server Error'}, status=502, reason='Bad Gateway'),
+            repositories_page([repository_node('RepoA', {'ref': 'h'})])
+        ])
+        sleeps = []
+        client = GitHubClient('token', 'org', pool, RequestScheduler(sleep=sleeps.append, clock=lambda: 0.0))
+
+        repos = client.get_repositories('REL-1')
+
+        self.assertEqual(pool.requests_sent, 2)
+        self.assertEqual(len(repos), 1)
+        self.assertEqual(len(sleeps), 1)
+
+    def test_should_refresh_cached_inventory_incrementally_and_look_up_refs_by_id(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RepositoryCache(os.path.join(directory, 'inventory.sqlite3'))
+            cache.store('org', [
+                Repository('id-RepoA', 'RepoA', 'WRITE', None, updated_at='2020-01-01T00:00:00Z'),
+                Repository('id-RepoB', 'RepoB', 'WRITE', None, updated_at='2020-01-02T00:00:00Z')
+            ], '2020-01-02T00:00:00Z', replace=True)
+            inventory_page = repositories_page([
+                dict(repository_node('RepoC', {}), updatedAt='2020-01-05T00:00:00Z'),
+                dict(repository_node('RepoB', {}), updatedAt='2020-01-01T00:00:00Z')
+            ], has_next_page=True)
+            pool = FakePool([
+                inventory_page,
+                {'data': {'nodes': [
+                    repository_node('RepoA', {'ref0': 'a'}),
+                    None,
+                    repository_node('RepoC', {'ref0': 'c'})
+                ]}}
+            ])
+            client = GitHubClient('token', 'org', pool, cache=cache, scanConcurrency=2)
+
+            repos = client.get_repositories_for_branches(['master'])
+
+            # the inventory listing stops at the watermark without fetching the next page
+            self.assertEqual(pool.requests_sent, 2)
+            self.assertIn('orderBy:{field:UPDATED_AT,direction:DESC}', pool.requests[0]['query'])
+            self.assertEqual(pool.requests[1]['variables']['ids'], ['id-RepoA', 'id-RepoB', 'id-RepoC'])
+            self.assertEqual([repo.name for repo in repos], ['RepoA', 'RepoC'])
+            self.assertEqual(repos.get('RepoC').refs['master'].oid, 'c')
+            self.assertEqual(cache.watermark('org'), '2020-01-05T00:00:00Z')
+            client.close()
+
+    def test_should_skip_and_forget_cached_repositories_that_were_deleted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RepositoryCache(os.path.join(directory, 'inventory.sqlite3'))
+            cache.store('org', [
+                Repository('id-RepoA', 'RepoA', 'WRITE', None, updated_at='2020-01-01T00:00:00Z'),
+                Repository('id-RepoB', 'RepoB', 'WRITE', None, updated_at='2020-01-02T00:00:00Z')
+            ], '2020-01-02T00:00:00Z', replace=True)
+            pool = FakePool([
+                repositories_page([dict(repository_node('RepoB', {}), updatedAt='2020-01-02T00:00:00Z')]),
+                {'data': {'nodes': [repository_node('RepoA', {'ref0': 'a'}), None]},
+                 'errors': [{'type': 'NOT_FOUND', 'path': ['nodes', 1], 'message': "Could not resolve to a node with the global id of 'id-RepoB'"}]}
+            ])
+            client = GitHubClient('token', 'org', pool, cache=cache, scanConcurrency=2)
+
+            repos = client.get_repositories_for_branches(['master'])
+
+            self.assertEqual([repo.name for repo in repos], ['RepoA'])
+            self.assertEqual([repo.name for repo in cache.repositories('org')], ['RepoA'])
+            client.close()
+
+    def test_should_send_minified_documents_with_variables(self):
+        pool = FakePool([{'data': {'mergeBranch': {'mergeCommit': {'oid': 'a', 'commitUrl': 'url', 'message': 'msg "quoted"'}}}}])
+        client = GitHubClient('token', 'org', pool)
+
+        result = client.merge_branch(Repository('idA', 'RepoA', 'WRITE', None), 'master', 'REL-1', 'msg "quoted"')
+
+        request = pool.requests[0]
+        self.assertNotIn('\n', request['query'])
+        self.assertNotIn('idA', request['query'])
+        self.assertEqual(request['variables']['input'], {'repositoryId': 'idA', 'base': 'master', 'head': 'REL-1', 'commitMessage': 'msg "quoted"'})
+        self.assertEqual(result.commit_message, 'msg "quoted"')
+
+    def test_should_compare_branches_in_the_scan_and_tolerate_missing_heads(self):
+        repo_a = dict(repository_node('RepoA', {'ref0': 'h', 'ref1': 'b'}), cmp0={'compare': {'aheadBy': 0, 'behindBy': 4, 'status': 'BEHIND'}})
+        repo_b = dict(repository_node('RepoB', {'ref0': None, 'ref1': 'b'}), cmp0=None)
+        page = repositories_page([repo_a, repo_b])
+        page['errors'] = [{'type': 'NOT_FOUND', 'path': ['organization', 'repositories', 'edges', 1, 'node', 'cmp0', 'compare'], 'message': 'No ref'}]
+        pool = FakePool([page])
+        client = GitHubClient('token', 'org', pool)
+
+        repos = client.get_repositories_for_branches(['REL-1', 'master'], [('master', 'REL-1')])
+
+        self.assertEqual(pool.requests[0]['variables']['cmpBase0'], 'refs/heads/master')
+        self.assertEqual(pool.requests[0]['variables']['cmpHead0'], 'refs/heads/REL-1')
+        self.assertEqual(repos.get('RepoA').comparisons[('master', 'REL-1')].ahead_by, 0)
+        self.assertEqual(repos.get('RepoB').comparisons, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
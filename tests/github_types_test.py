@@ -0,0 +1,39 @@
+import unittest
+from github.types import Repository, RepositorySet, Ref
+
+class RepositorySetTest(unittest.TestCase):
+
+    def test_should_index_repositories_by_name_and_id(self):
+        repos = RepositorySet([Repository('1', 'RepoA', 'WRITE', None), Repository('2', 'RepoB', 'READ', None)])
+
+        self.assertEqual(len(repos), 2)
+        self.assertIn('RepoA', repos)
+        self.assertIn(Repository('', 'RepoB', 'WRITE', None), repos)
+        self.assertNotIn('RepoC', repos)
+        self.assertEqual(repos.get('RepoB').permission, 'READ')
+        self.assertEqual(repos.get_by_id('1').name, 'RepoA')
+
+    def test_should_intersect_in_original_order(self):
+        heads = RepositorySet(Repository('', name, 'WRITE', None) for name in ['RepoC', 'RepoA', 'RepoB'])
+        bases = [Repository('', name, 'WRITE', None) for name in ['RepoA', 'RepoC', 'RepoD']]
+
+        self.assertEqual([repo.name for repo in heads.intersection(bases)], ['RepoC', 'RepoA'])
+        self.assertEqual([repo.name for repo in heads & RepositorySet(bases)], ['RepoC', 'RepoA'])
+
+    def test_should_populate_set_from_scanned_nodes(self):
+        nodes = [{'id': name, 'name': name, 'viewerPermission': 'WRITE', 'ref0': {'id': 'r', 'target': {'oid': 'o'}}} for name in ['RepoA', 'RepoB', 'RepoC']]
+
+        repos = RepositorySet(Repository.create_from_node(node, ['master']) for node in nodes)
+
+        self.assertEqual([repo.name for repo in repos], ['RepoA', 'RepoB', 'RepoC'])
+        self.assertEqual(repos.get('RepoC').refs['master'].name, 'master')
+
+    def test_should_not_carry_instance_dictionaries(self):
+        repo = Repository('1', 'RepoA', 'WRITE', Ref('r', 'master', 'o', None))
+
+        self.assertFalse(hasattr(repo, '__dict__'))
+        self.assertFalse(hasattr(repo.ref, '__dict__'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import json
+import os
+import tempfile
+from unittest.mock import Mock
+from automerge.manifest import ManifestJob, load_manifest, run_manifest, _chain_jobs
+from github.client import GitHubClient
+from github.types import MergeResponse
+from tests.mock_github_server import MockGitHubServer, MockOrganization
+from tests.fixtures import new_repository
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name: str, content: str) -> str:
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as manifest:
+            manifest.write(content)
+        return path
+
+    def test_should_load_json_yaml_and_ini_manifests(self):
+        paths = [
+            self.write('jobs.json', json.dumps({'org': 'org-a', 'jobs': [
+                {'base': 'master', 'head': 'REL-1', 'current_release': 'REL-2'},
+                {'org': 'org-b', 'base': 'master', 'head': 'REL-1'}]})),
+            self.write('jobs.yaml', 'org: org-a\njobs:\n  - {base: master, head: REL-1, current_release: REL-2}\n  - {org: org-b, base: master, head: REL-1}\n'),
+            self.write('jobs.ini', '[DEFAULT]\norg = org-a\n[first]\nbase = master\nhead = REL-1\ncurrent_release = REL-2\n[second]\norg = org-b\nbase = master\nhead = REL-1\n')
+        ]
+
+        for path in paths:
+            jobs = load_manifest(path)
+            self.assertEqual([str(job) for job in jobs], ['org-a: REL-1 ==>> master ==>> REL-2', 'org-b: REL-1 ==>> master'], path)
+
+    def test_should_reject_incomplete_jobs(self):
+        with self.assertRaises(Exception):
+            load_manifest(self.write('jobs.json', json.dumps([{'org': 'org-a', 'base': 'master'}])))
+        with self.assertRaises(Exception):
+            load_manifest(self.write('jobs.json', json.dumps([{'base': 'master', 'head': 'REL-1'}])))
+
+    def test_should_chain_jobs_sharing_a_branch_in_the_same_org(self):
+        jobs = [
+            ManifestJob('org-a', 'master', 'REL-1'),
+            ManifestJob('org-a', 'develop', 'feature'),
+            ManifestJob('org-b', 'master', 'REL-1'),
+            ManifestJob('org-a', 'REL-1', 'hotfix')
+        ]
+
+        chains = sorted(_chain_jobs(jobs), key=lambda chain: jobs.index(chain[0]))
+        self.assertEqual(chains, [[jobs[0], jobs[3]], [jobs[1]], [jobs[2]]])
+
+    def test_should_scan_each_org_once_and_keep_manifest_order(self):
+        clients = {}
+        for org in ('org-a', 'org-b'):
+            clients[org] = GitHubClient('', org)
+            clients[org].iter_repositories_for_branches = Mock(return_value=[
+                new_repository('RepoA', ['REL-1', 'REL-2', 'master', 'develop']), new_repository('RepoB', ['master'])])
+            clients[org].merge_branch = Mock(return_value=MergeResponse('', 'url', 'merged'))
+        jobs = [
+            ManifestJob('org-a', 'master', 'REL-1'),
+            ManifestJob('org-a', 'develop', 'REL-2'),
+            ManifestJob('org-b', 'master', 'missing')
+        ]
+
+        results = run_manifest(jobs, clients, parallel_jobs=3)
+
+        self.assertEqual(clients['org-a'].iter_repositories_for_branches.call_count, 1)
+        (branches, comparisons) = clients['org-a'].iter_repositories_for_branches.call_args.args
+        self.assertEqual(branches, ['REL-1', 'master', 'REL-2', 'develop'])
+        self.assertEqual(comparisons, [('master', 'REL-1'), ('develop', 'REL-2')])
+        self.assertEqual([result.job for result in results], jobs)
+        self.assertEqual([len(result.report[0][2]) for result in results[:2]], [1, 1])
+        self.assertIsNone(results[0].error)
+        self.assertIsNotNone(results[2].error)
+        self.assertEqual(clients['org-a'].merge_branch.call_count, 2)
+
+    def test_should_run_chained_jobs_against_the_mock_server(self):
+        organization = MockOrganization(60, coverage={'REL-1': 0.5, 'REL-2': 0.5})
+        with MockGitHubServer(organization) as server:
+            client = GitHubClient('token', organization.login, GitHubClient.create_pool(4, server.url))
+            jobs = [ManifestJob(organization.login, 'master', 'REL-1'), ManifestJob(organization.login, 'master', 'REL-2')]
+            results = run_manifest(jobs, {organization.login: client})
+            client.close()
+
+        operations = server.stats()['operations']
+        self.assertEqual(operations['RepositoriesForBranches'], 1)
+        self.assertTrue(all(result.error is None and result.report[0][2] for result in results))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import json
+import os
+import tempfile
+from automerge.plan import MergePlan
+from automerge.utilities import auto_merge, plan_merge
+from github.client import GitHubClient
+from tests.github_client_test import FakePool
+from tests.mock_github_server import MockGitHubServer, MockOrganization
+
+class MergePlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'plan.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_should_apply_a_saved_plan_without_scanning(self):
+        organization = MockOrganization(120, coverage={'REL-1': 0.5, 'REL-2': 0.5})
+        with MockGitHubServer(organization) as server:
+            client = GitHubClient('token', organization.login, GitHubClient.create_pool(4, server.url))
+            (_, repos) = plan_merge('master', 'REL-1', 'REL-2', client)
+            MergePlan(organization.login, 'master', 'REL-1', 'REL-2', repos).save(self.path)
+
+            plan = MergePlan.load(self.path)
+            (moved_repo, deleted_repo) = [organization.by_id[repo.id] for repo in plan.repositories[:2]]
+            moved_repo['branches']['master'] = moved_repo['branches']['REL-1']
+            del deleted_repo['branches']['REL-1']
+            scans = server.stats()['operations']['RepositoriesForBranches']
+
+            (current, moved) = plan.verify(client)
+            results = auto_merge(plan.base, plan.head, plan.current_release, client, repositories=current)
+            client.close()
+
+        operations = server.stats()['operations']
+        self.assertEqual(operations['RepositoriesForBranches'], scans)
+        refs = sum(len(repo.refs) for repo in plan.repositories)
+        self.assertEqual(operations['RefNodes'], (refs + 99) // 100)
+        self.assertEqual([repo.name for (_, repo) in moved], [plan.repositories[0].name, plan.repositories[1].name])
+        self.assertIn('master moved from', moved[0][0])
+        self.assertIn('REL-1 moved from', moved[1][0])
+        self.assertIn('to deleted', moved[1][0])
+        self.assertEqual(len(results[0][0]), len(plan.repositories) - 2)
+
+    def test_should_write_a_reviewable_plan(self):
+        organization = MockOrganization(3, coverage={'REL-1': 1.0})
+        with MockGitHubServer(organization) as server:
+            client = GitHubClient('token', organization.login, GitHubClient.create_pool(1, server.url))
+            (_, repos) = plan_merge('master', 'REL-1', '', client)
+            client.close()
+        MergePlan(organization.login, 'master', 'REL-1', '', repos).save(self.path)
+
+        with open(self.path) as plan:
+            data = json.load(plan)
+        repo = data['repositories'][0]
+        self.assertEqual((data['org'], data['base'], data['head'], data['current_release']), ('mock-org', 'master', 'REL-1', ''))
+        self.assertEqual((repo['id'], repo['name'], repo['permission']), ('R_00000', 'repo-00000', 'WRITE'))
+        self.assertEqual(repo['refs']['master']['oid'], organization.repositories[0]['branches']['master'])
+        self.assertEqual(os.listdir(self.directory.name), ['plan.json'])
+
+    def test_should_refuse_unknown_plan_versions(self):
+        with open(self.path, 'w') as plan:
+            json.dump({'version': 99}, plan)
+
+        with self.assertRaises(Exception):
+            MergePlan.load(self.path)
+
+    def test_client_should_map_missing_refs_to_none(self):
+        pool = FakePool([{
+            'data': {'nodes': [{'id': 'ref-a', 'target': {'oid': 'aaa'}}, None]},
+            'errors': [{'type': 'NOT_FOUND', 'path': ['nodes', 1], 'message': 'Could not resolve to a node'}]
+        }])
+        client = GitHubClient('token', 'org', pool)
+
+        self.assertEqual(client.get_ref_oids(['ref-a', 'ref-b']), {'ref-a': 'aaa', 'ref-b': None})
+        self.assertEqual(pool.requests[0]['variables'], {'ids': ['ref-a', 'ref-b']})
+
+if __name__ == '__main__':
+    unittest.main()
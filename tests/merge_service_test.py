@@ -0,0 +1,160 @@
+import unittest
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import tempfile
+import time
+from unittest.mock import Mock
+from urllib.parse import urlsplit
+from automerge.service import BranchIndex, MergeService
+from github.client import GitHubClient
+from github.types import RepositorySet
+from tests.mock_github_server import MockGitHubServer, MockOrganization
+from tests.fixtures import new_repository
+
+def event(name: str, **payload) -> dict:
+    return dict(payload, repository={'name': name, 'node_id': 'id-' + name, 'owner': {'login': 'org'}})
+
+class MergeServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def new_index(self) -> BranchIndex:
+        client = GitHubClient('', 'org')
+        client.get_repositories_for_branches = Mock(return_value=RepositorySet([
+            new_repository('RepoA', {'master': 'a1', 'release': 'a2'}),
+            new_repository('RepoB', {'master': 'b1'})
+        ]))
+        index = BranchIndex('org', ['master', 'release'])
+        index.reconcile(client)
+        return index
+
+    def refs(self, index: BranchIndex, name: str) -> dict:
+        repo = index.get(name)
+        return {branch: ref.oid for (branch, ref) in repo.refs.items()} if repo else None
+
+    def test_should_apply_branch_and_repository_events(self):
+        index = self.new_index()
+
+        self.assertTrue(index.apply_event('push', event('RepoA', ref='refs/heads/master', after='a3')))
+        self.assertTrue(index.apply_event('create', event('RepoB', ref='release', ref_type='branch')))
+        self.assertTrue(index.apply_event('push', event('RepoB', ref='refs/heads/release', after='b2', created=True)))
+        self.assertTrue(index.apply_event('delete', event('RepoA', ref='release', ref_type='branch')))
+        # untracked branches, tags and other organizations are ignored
+        self.assertFalse(index.apply_event('push', event('RepoA', ref='refs/heads/feature', after='a4')))
+        self.assertFalse(index.apply_event('push', event('RepoA', ref='refs/tags/v1', after='a5')))
+        self.assertFalse(index.apply_event('push', dict(event('RepoA', ref='refs/heads/master', after='a6'), repository={'name': 'RepoA', 'owner': {'login': 'other'}})))
+
+        self.assertEqual(self.refs(index, 'RepoA'), {'master': 'a3'})
+        self.assertEqual(self.refs(index, 'RepoB'), {'master': 'b1', 'release': 'b2'})
+
+        self.assertTrue(index.apply_event('repository', event('RepoC', action='renamed', changes={'repository': {'name': {'from': 'RepoB'}}})))
+        self.assertTrue(index.apply_event('repository', event('RepoA', action='deleted')))
+        self.assertTrue(index.apply_event('repository', event('RepoD', action='created')))
+
+        self.assertEqual([repo.name for repo in index.repositories(['master'])], ['RepoC', 'RepoD'])
+        self.assertEqual(self.refs(index, 'RepoC'), {'master': 'b1', 'release': 'b2'})
+
+    def test_should_keep_webhook_changes_made_while_reconciling(self):
+        index = self.new_index()
+        client = GitHubClient('', 'org')
+
+        def scan(branches):
+            # the push lands after GitHub answered the scan but before the scan is applied
+            index.apply_event('push', event('RepoA', ref='refs/heads/master', after='a9'))
+            return RepositorySet([new_repository('RepoA', {'master': 'a1', 'release': 'a2'}), new_repository('RepoC', {'master': 'c1'})])
+
+        client.get_repositories_for_branches = Mock(side_effect=scan)
+        index.reconcile(client)
+
+        self.assertEqual(self.refs(index, 'RepoA'), {'master': 'a9', 'release': 'a2'})
+        self.assertIsNone(index.get('RepoB'))
+        self.assertEqual(self.refs(index, 'RepoC'), {'master': 'c1'})
+
+    def test_should_save_and_load_the_index(self):
+        index = self.new_index()
+        path = os.path.join(self.directory.name, 'indexes', 'org.json')
+        index.save(path)
+
+        loaded = BranchIndex.load(path, 'org')
+
+        self.assertFalse(index.dirty)
+        self.assertEqual(loaded.branches, ['master', 'release'])
+        self.assertEqual(loaded.reconciled_at, index.reconciled_at)
+        self.assertEqual(self.refs(loaded, 'RepoA'), {'master': 'a1', 'release': 'a2'})
+        with self.assertRaises(Exception):
+            BranchIndex.load(path, 'other')
+
+    def test_should_only_serve_other_hosts_with_a_webhook_secret(self):
+        service = MergeService(GitHubClient('', 'org'), self.new_index())
+
+        with self.assertRaises(ValueError):
+            service.start('0.0.0.0', 0)
+        self.assertIsNone(service.httpd)
+
+    def test_should_merge_from_the_warm_index_over_http(self):
+        organization = MockOrganization(50, coverage={'REL-1': 0.5}, login='org')
+        with MockGitHubServer(organization) as server:
+            client = GitHubClient('token', 'org', GitHubClient.create_pool(4, server.url))
+            index = BranchIndex('org', ['master', 'REL-1'])
+            path = os.path.join(self.directory.name, 'org.json')
+            with MergeService(client, index, path, webhook_secret='secret', max_finished_jobs=1) as service:
+                address = urlsplit(service.url)
+                def request(method: str, url: str, payload=None, headers: dict = None) -> tuple:
+                    conn = http.client.HTTPConnection(address.hostname, address.port)
+                    headers = {'Authorization': 'Bearer secret'} if headers is None else headers
+                    conn.request(method, url, json.dumps(payload).encode() if payload is not None else None, headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                    conn.close()
+                    return (response.status, json.loads(body) if body else None)
+
+                # one repository loses its release branch after the service has indexed it
+                repos = [repo for repo in organization.repositories if 'REL-1' in repo['branches']]
+                deleted = repos[0]
+                del deleted['branches']['REL-1']
+                body = json.dumps(event(deleted['name'], ref='REL-1', ref_type='branch')).encode()
+                signature = 'sha256=' + hmac.new(b'secret', body, hashlib.sha256).hexdigest()
+                for (headers, expected) in (({}, 401), ({'X-Hub-Signature-256': signature}, 204)):
+                    conn = http.client.HTTPConnection(address.hostname, address.port)
+                    conn.request('POST', '/webhook', body, dict(headers, **{'X-GitHub-Event': 'delete'}))
+                    self.assertEqual(conn.getresponse().status, expected)
+                    conn.close()
+
+                # merges and reconciliations take the webhook secret as their token
+                self.assertEqual(request('POST', '/merges', {'base': 'master', 'head': 'REL-1'}, {})[0], 401)
+                self.assertEqual(request('POST', '/reconcile', None, {'Authorization': 'Bearer wrong'})[0], 401)
+                def run(payload: dict) -> dict:
+                    (status, job) = request('POST', '/merges', payload)
+                    self.assertEqual(status, 202)
+                    deadline = time.time() + 10
+                    while job['status'] in ('queued', 'running') and time.time() < deadline:
+                        time.sleep(0.01)
+                        (_, job) = request('GET', '/merges/' + job['id'])
+                    return job
+
+                job = run({'base': 'master', 'head': 'REL-1'})
+                self.assertEqual(request('POST', '/merges', {'base': 'master'})[0], 400)
+                # only the last finished job is kept
+                run({'base': 'REL-1', 'head': 'master'})
+                self.assertEqual(request('GET', '/merges/' + job['id'])[0], 404)
+                self.assertEqual(len(request('GET', '/merges')[1]), 1)
+                self.assertEqual(request('GET', '/index')[1]['repositories'], 50)
+            client.close()
+
+        self.assertEqual(job['status'], 'succeeded')
+        merged = [result['repository'] for result in job['phases'][0]['succeeded']]
+        self.assertEqual(sorted(merged), sorted(repo['name'] for repo in repos[1:]))
+        # the merge read the warm index; the organization was scanned once, when the service started
+        self.assertEqual(server.stats()['operations'].get('RepositoriesForBranches'), 1)
+        self.assertEqual(BranchIndex.load(path, 'org').get(repos[1]['name']).refs['master'].oid, repos[1]['branches']['master'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import os
+import tempfile
+from automerge.stats import MergeForecast, MergeStatistics
+
+class MergeStatisticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'stats', 'merge_stats.sqlite3')
+        self.stats = MergeStatistics(self.path, smoothing=0.5)
+
+    def tearDown(self):
+        self.stats.close()
+        self.directory.cleanup()
+
+    def test_should_keep_moving_averages_per_repository(self):
+        self.stats.record('org', 'RepoA', 4.0, False)
+        self.stats.record('org', 'RepoB', 1.0, True)
+        self.stats.record('other', 'RepoA', 9.0, False)
+        # nothing is written until the run flushes
+        self.assertEqual(self.stats.history('org'), {})
+        self.stats.flush()
+        self.stats.record('org', 'RepoA', 8.0, True)
+        self.stats.record('org', 'RepoB', 3.0, False)
+        self.stats.close()
+
+        history = MergeStatistics(self.path).history('org')
+
+        self.assertEqual(sorted(history), ['RepoA', 'RepoB'])
+        self.assertEqual((history['RepoA'].seconds, history['RepoA'].failure_rate, history['RepoA'].samples), (6.0, 0.5, 2))
+        self.assertEqual((history['RepoB'].seconds, history['RepoB'].failure_rate, history['RepoB'].samples), (2.0, 0.5, 2))
+
+    def test_should_predict_the_average_for_repositories_without_history(self):
+        self.stats.record('org', 'RepoA', 2.0, False)
+        self.stats.record('org', 'RepoB', 6.0, True)
+        self.stats.flush()
+
+        forecast = MergeForecast(self.stats.history('org'))
+
+        self.assertEqual(forecast.seconds('RepoA'), 2.0)
+        self.assertEqual(forecast.seconds('RepoC'), 4.0)
+        self.assertTrue(forecast.likely_to_fail('RepoB'))
+        self.assertFalse(forecast.likely_to_fail('RepoA'))
+        self.assertFalse(forecast.likely_to_fail('RepoC'))
+        self.assertEqual(MergeForecast({}).seconds('RepoA'), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,389 @@
+"""
+Local stand-in for the GitHub GraphQL API.
+
+MockGitHubServer simulates an organization of N repositories and answers the documents sent
+by GitHubClient (see github/queries.py) well enough to run AutoMerge end to end: organization
+scans, node lookups, comparisons, mergeBranch and updateRef. Branch coverage, latency,
+rate-limit headers and error injection are configurable. Responses are gzipped for clients
+that accept it, and the server counts requests, connections and bytes on the wire so
+benchmarks can measure the client.
+"""
+import gzip
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def _timestamp(seconds: int) -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1577836800 + seconds))
+
+def _fraction(*key) -> float:
+    # stable pseudo-random value in [0, 1) so an org looks the same on every run
+    digest = hashlib.sha1(':'.join(str(part) for part in key).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+class MockOrganization:
+    """
+    Repositories named repo-00000, repo-00001, ... each with a `base` branch. Every other
+    branch in `coverage` exists in that fraction of repositories. `up_to_date` is the fraction
+    of those branches that carry no commits beyond base, `conflicts` the fraction whose merges
+    fail, and `read_only` the fraction of repositories the viewer can only read.
+    """
+
+    def __init__(self, size: int, base: str = 'master', coverage: dict = None, up_to_date: float = 0.0,
+            conflicts: float = 0.0, read_only: float = 0.0, login: str = 'mock-org'):
+        self.login = login
+        self.lock = threading.Lock()
+        self.touches = 0
+        self.commits = {}
+        self.repositories = []
+        self.by_id = {}
+        coverage = coverage if coverage is not None else {}
+
+        for i in range(size):
+            name = 'repo-{:05d}'.format(i)
+            repo = {
+                'id': 'R_{:05d}'.format(i),
+                'name': name,
+                'permission': 'READ' if _fraction(name, 'read_only') < read_only else 'WRITE',
+                # spread over 2020, so an incremental inventory refresh can stop part way through the listing
+                'updatedAt': _timestamp(int(_fraction(name, 'updated') * 366 * 24 * 60 * 60)),
+                'conflicts': _fraction(name, 'conflicts') < conflicts,
+                'branches': {}
+            }
+            repo['branches'][base] = self.__commit(name, base, frozenset())
+            for (branch, fraction) in coverage.items():
+                if _fraction(name, branch) >= fraction:
+                    continue
+                parent = repo['branches'][base]
+                if _fraction(name, branch, 'up_to_date') < up_to_date:
+                    repo['branches'][branch] = parent
+                else:
+                    repo['branches'][branch] = self.__commit(name, branch, self.commits[parent])
+            self.repositories.append(repo)
+            self.by_id[repo['id']] = repo
+
+    def __commit(self, *key) -> str:
+        history = key[-1]
+        oid = hashlib.sha1(':'.join(str(part) for part in key[:-1] + (len(self.commits),)).encode()).hexdigest()
+        self.commits[oid] = frozenset(history | {oid})
+        return oid
+
+    def touch(self, repo_id: str):
+        """Bumps the repository's updatedAt past every other repository's, as a rename or settings change would."""
+        with self.lock:
+            self.touches += 1
+            self.by_id[repo_id]['updatedAt'] = _timestamp(366 * 24 * 60 * 60 + self.touches)
+
+    def delete(self, repo_id: str):
+        with self.lock:
+            repo = self.by_id.pop(repo_id)
+            self.repositories.remove(repo)
+
+    def ref_node(self, repo: dict, branch: str):
+        if branch not in repo['branches']:
+            return None
+        return {'id': '{}:{}'.format(repo['id'], branch), 'name': branch, 'target': {'oid': repo['branches'][branch]}}
+
+    def compare(self, repo: dict, base: str, head: str):
+        if base not in repo['branches'] or head not in repo['branches']:
+            return None
+        base_history = self.commits[repo['branches'][base]]
+        head_history = self.commits[repo['branches'][head]]
+        ahead = len(head_history - base_history)
+        behind = len(base_history - head_history)
+        status = 'IDENTICAL' if not ahead and not behind else 'AHEAD' if not behind else 'BEHIND' if not ahead else 'DIVERGED'
+        return {'aheadBy': ahead, 'behindBy': behind, 'status': status}
+
+    def merge(self, repo_id: str, base: str, head: str, message: str) -> dict:
+        with self.lock:
+            repo = self.by_id.get(repo_id)
+            if not repo:
+                raise MockGraphQLError('NOT_FOUND', 'Could not resolve to a node with the global id of \'{}\''.format(repo_id))
+            if repo['permission'] == 'READ':
+                raise MockGraphQLError('FORBIDDEN', 'Resource not accessible by integration')
+            if base not in repo['branches'] or head not in repo['branches']:
+                raise MockGraphQLError('NOT_FOUND', 'No such base or head branch')
+            base_history = self.commits[repo['branches'][base]]
+            head_history = self.commits[repo['branches'][head]]
+            if head_history <= base_history:
+                raise MockGraphQLError('UNPROCESSABLE', 'Failed to merge: "Already merged"')
+            if repo['conflicts']:
+                raise MockGraphQLError('UNPROCESSABLE', 'Failed to merge: "Merge conflict"')
+            oid = self.__commit(repo['name'], base, head, base_history | head_history)
+            repo['branches'][base] = oid
+            return {'oid': oid, 'commitUrl': 'https://github.com/{}/{}/commit/{}'.format(self.login, repo['name'], oid), 'message': message}
+
+    def update_ref(self, ref_id: str, oid: str, force: bool) -> dict:
+        with self.lock:
+            (repo_id, branch) = ref_id.split(':', 1)
+            repo = self.by_id.get(repo_id)
+            if not repo or branch not in repo['branches'] or oid not in self.commits:
+                raise MockGraphQLError('NOT_FOUND', 'Could not resolve ref or object')
+            if repo['permission'] == 'READ':
+                raise MockGraphQLError('FORBIDDEN', 'Resource not accessible by integration')
+            if not force and not self.commits[repo['branches'][branch]] <= self.commits[oid]:
+                raise MockGraphQLError('UNPROCESSABLE', 'Update is not a fast forward')
+            repo['branches'][branch] = oid
+            return {'oid': oid, 'commitUrl': 'https://github.com/{}/{}/commit/{}'.format(self.login, repo['name'], oid)}
+
+class MockGraphQLError(Exception):
+
+    def __init__(self, error_type: str, message: str):
+        self.error_type = error_type
+        self.message = message
+
+class MockGitHubServer:
+    """
+    Serves a MockOrganization over HTTP/1.1 keep-alive on 127.0.0.1.
+
+    `latency` seconds are added to every query and `mutation_latency` to every mutation.
+    `ref_latency` seconds are added for each ref a query resolves per repository, so a page of
+    branch refs costs more than a page listing repository ids, as it does on GitHub.
+    `rate_limit` is each token's per-window point budget reported through X-RateLimit-* headers and
+    rateLimit fields; requests past it get a 403. `error_rate` is the fraction of requests
+    answered with a 502, and `secondary_limit_every` sends a 403 with Retry-After every n requests.
+    """
+
+    def __init__(self, organization: MockOrganization, latency: float = 0.0, mutation_latency: float = 0.0, ref_latency: float = 0.0,
+            rate_limit: int = 5000, error_rate: float = 0.0, secondary_limit_every: int = 0, seed: int = 0):
+        self.organization = organization
+        self.latency = latency
+        self.mutation_latency = mutation_latency
+        self.ref_latency = ref_latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.secondary_limit_every = secondary_limit_every
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.points_used = 0
+        self.token_points = {}
+        self.operations = {}
+        self.reset_at = int(time.time()) + 3600
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.__handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    def start(self) -> 'MockGitHubServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'connections': self.connections,
+                'bytes_received': self.bytes_received,
+                'bytes_sent': self.bytes_sent,
+                'points_used': self.points_used,
+                'tokens': dict(self.token_points),
+                'operations': dict(self.operations)
+            }
+
+    def handle(self, body: bytes, headers) -> tuple:
+        """Returns (status, headers, payload) for one POST /graphql."""
+        with self.lock:
+            self.requests += 1
+            self.bytes_received += len(body)
+            count = self.requests
+            inject_error = self.error_rate and self.random.random() < self.error_rate
+
+        if self.secondary_limit_every and count % self.secondary_limit_every == 0:
+            return (403, {'Retry-After': '0'}, {'message': 'You have exceeded a secondary rate limit.'})
+        if inject_error:
+            return (502, {}, {'message': 'Server Error'})
+
+        request = json.loads(body)
+        query = request['query']
+        variables = request.get('variables') or {}
+        match = re.match(r'(query|mutation)\s*(\w+)', query)
+        operation = match.group(2) if match else 'anonymous'
+
+        with self.lock:
+            self.operations[operation] = self.operations.get(operation, 0) + 1
+            self.points_used += 1
+            # as on GitHub, every token has a budget of its own
+            token = (headers.get('Authorization') or '').partition(' ')[2]
+            used = self.token_points[token] = self.token_points.get(token, 0) + 1
+            remaining = self.rate_limit - used
+        rate_headers = {
+            'X-RateLimit-Limit': str(self.rate_limit),
+            'X-RateLimit-Remaining': str(max(remaining, 0)),
+            'X-RateLimit-Used': str(used),
+            'X-RateLimit-Reset': str(self.reset_at)
+        }
+        if remaining < 0:
+            return (403, rate_headers, {'message': 'API rate limit exceeded'})
+
+        time.sleep(self.mutation_latency if match and match.group(1) == 'mutation' else self.latency)
+
+        handler = getattr(self, '_MockGitHubServer__' + re.sub(r'(?<!^)([A-Z])', r'_\1', operation).lower(), None)
+        if not handler:
+            return (200, rate_headers, {'errors': [{'message': 'Unknown operation {}'.format(operation)}]})
+
+        (data, errors) = handler(query, variables)
+        if self.ref_latency:
+            repositories = data.get('nodes') or ((data.get('organization') or {}).get('repositories') or {}).get('edges') or []
+            time.sleep(self.ref_latency * query.count('ref(qualifiedName:') * len(repositories))
+        if 'rateLimit{' in query:
+            data['rateLimit'] = {'cost': 1, 'remaining': max(remaining, 0), 'resetAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.reset_at))}
+        payload = {'data': data}
+        if errors:
+            payload['errors'] = errors
+        return (200, rate_headers, payload)
+
+    def __repository_node(self, repo: dict, query: str, variables: dict, path: list, errors: list) -> dict:
+        org = self.organization
+        node = {'id': repo['id']}
+        if 'viewerPermission' in query:
+            node.update(name=repo['name'], viewerPermission=repo['permission'])
+        if 'updatedAt' in query:
+            node['updatedAt'] = repo['updatedAt']
+        if 'ref(qualifiedName:$qualifiedName)' in query:
+            node['ref'] = org.ref_node(repo, variables['qualifiedName'][len('refs/heads/'):])
+        for (alias, variable) in re.findall(r'(ref\d+):ref\(qualifiedName:\$(\w+)\)', query):
+            node[alias] = org.ref_node(repo, variables[variable][len('refs/heads/'):])
+        for (alias, base, head) in re.findall(r'(cmp\d+):ref\(qualifiedName:\$(\w+)\)\{compare\(headRef:\$(\w+)\)', query):
+            base_branch = variables[base][len('refs/heads/'):]
+            head_branch = variables[head][len('refs/heads/'):]
+            if base_branch not in repo['branches']:
+                node[alias] = None
+                continue
+            comparison = org.compare(repo, base_branch, head_branch)
+            node[alias] = {'compare': comparison}
+            if comparison is None:
+                errors.append({'type': 'NOT_FOUND', 'path': path + [alias, 'compare'], 'message': 'Could not resolve head ref'})
+        return node
+
+    def __repositories_page(self, query: str, variables: dict) -> tuple:
+        repositories = self.organization.repositories
+        if 'orderBy:{field:UPDATED_AT,direction:DESC}' in query:
+            repositories = sorted(repositories, key=lambda repo: repo['updatedAt'], reverse=True)
+        start = int(variables['after']) if variables.get('after') else 0
+        page = repositories[start:start + 100]
+        errors = []
+        edges = [
+            {'node': self.__repository_node(repo, query, variables, ['organization', 'repositories', 'edges', i, 'node'], errors)}
+            for (i, repo) in enumerate(page)
+        ]
+        end = start + len(page)
+        page_info = {'hasNextPage': end < len(repositories), 'endCursor': str(end) if page else None}
+        return ({'organization': {'repositories': {'pageInfo': page_info, 'edges': edges}}}, errors)
+
+    __repositories = __repositories_page
+    __repositories_for_branches = __repositories_page
+    __repository_inventory = __repositories_page
+    __repository_ids = __repositories_page
+
+    def __repository_nodes(self, query: str, variables: dict) -> tuple:
+        errors = []
+        nodes = []
+        for (i, id) in enumerate(variables['ids']):
+            repo = self.organization.by_id.get(id)
+            nodes.append(self.__repository_node(repo, query, variables, ['nodes', i], errors) if repo else None)
+            if not repo:
+                errors.append({'type': 'NOT_FOUND', 'path': ['nodes', i], 'message': 'Could not resolve to a node with the global id of \'{}\''.format(id)})
+        return ({'nodes': nodes}, errors)
+
+    def __ref_nodes(self, query: str, variables: dict) -> tuple:
+        errors = []
+        nodes = []
+        for (i, id) in enumerate(variables['ids']):
+            (repo_id, _, branch) = id.partition(':')
+            repo = self.organization.by_id.get(repo_id)
+            node = self.organization.ref_node(repo, branch) if repo else None
+            nodes.append({'id': node['id'], 'target': node['target']} if node else None)
+            if not node:
+                errors.append({'type': 'NOT_FOUND', 'path': ['nodes', i], 'message': 'Could not resolve to a node with the global id of \'{}\''.format(id)})
+        return ({'nodes': nodes}, errors)
+
+    def __merge_branch(self, query: str, variables: dict) -> tuple:
+        return self.__mutations([('mergeBranch', variables['input'])], self.__apply_merge)
+
+    def __merge_branches(self, query: str, variables: dict) -> tuple:
+        aliases = re.findall(r'(merge\d+):mergeBranch\(input:\$(\w+)\)', query)
+        return self.__mutations([(alias, variables[variable]) for (alias, variable) in aliases], self.__apply_merge)
+
+    def __update_ref(self, query: str, variables: dict) -> tuple:
+        return self.__mutations([('updateRef', variables['input'])], self.__apply_update)
+
+    def __update_refs(self, query: str, variables: dict) -> tuple:
+        aliases = re.findall(r'(update\d+):updateRef\(input:\$(\w+)\)', query)
+        return self.__mutations([(alias, variables[variable]) for (alias, variable) in aliases], self.__apply_update)
+
+    def __apply_update(self, input: dict) -> dict:
+        return {'ref': {'target': self.organization.update_ref(input['refId'], input['oid'], input.get('force', False))}}
+
+    def __apply_merge(self, input: dict) -> dict:
+        return {'mergeCommit': self.organization.merge(input['repositoryId'], input['base'], input['head'], input.get('commitMessage', ''))}
+
+    def __mutations(self, inputs: list, apply) -> tuple:
+        data = {}
+        errors = []
+        for (alias, input) in inputs:
+            try:
+                data[alias] = apply(input)
+            except MockGraphQLError as err:
+                data[alias] = None
+                errors.append({'type': err.error_type, 'path': [alias], 'message': err.message})
+        return (data, errors)
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # headers and body go out in separate writes; don't let Nagle hold the body back
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with server.lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                (status, headers, payload) = server.handle(body, self.headers)
+                self.send_payload(status, headers, json.dumps(payload).encode())
+
+            def send_payload(self, status: int, headers: dict, body: bytes):
+                if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+                    # like GitHub, compress whenever the client accepts it
+                    (body, headers) = (gzip.compress(body, compresslevel=6), dict(headers, **{'Content-Encoding': 'gzip'}))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                for (name, value) in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with server.lock:
+                    server.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,127 @@
+import unittest
+import os
+import tempfile
+from tests.mock_github_server import MockGitHubServer, MockOrganization
+from github.cache import RepositoryCache
+from github.client import GitHubClient
+from github.scheduler import RequestScheduler
+from automerge.utilities import auto_merge
+from github.types import MergeResponse, UpdateRefResponse
+
+class MockGitHubServerTest(unittest.TestCase):
+
+    def new_client(self, server: MockGitHubServer, **kwargs) -> GitHubClient:
+        return GitHubClient('token', server.organization.login, GitHubClient.create_pool(4, server.url), **kwargs)
+
+    def test_should_merge_an_organization_end_to_end(self):
+        organization = MockOrganization(150, coverage={'REL-1': 0.5, 'REL-2': 0.5}, up_to_date=0.2, conflicts=0.1)
+        with MockGitHubServer(organization) as server:
+            client = self.new_client(server)
+
+            (succeeded, unprocessed, failed) = auto_merge('master', 'REL-1', '', client)[0]
+            # a second run finds every successful merge already done without issuing mutations
+            (succeeded_again, unprocessed_again, failed_again) = auto_merge('master', 'REL-1', '', client)[0]
+            client.close()
+
+        self.assertTrue(succeeded and unprocessed and failed)
+        self.assertEqual(succeeded_again, [])
+        self.assertEqual(len(unprocessed_again), len(succeeded) + len(unprocessed))
+        self.assertEqual(len(failed_again), len(failed))
+        # the scan and the merges overlap, each on one kept-alive connection
+        self.assertEqual(server.stats()['connections'], 2)
+
+    def test_should_survive_injected_errors_and_secondary_rate_limits(self):
+        organization = MockOrganization(1000, coverage={'REL-1': 1.0})
+        with MockGitHubServer(organization, error_rate=0.3, secondary_limit_every=4) as server:
+            scheduler = RequestScheduler(backoff=0.001, max_retries=10)
+            client = self.new_client(server, scheduler=scheduler)
+
+            repos = client.get_repositories_for_branches(['REL-1', 'master'])
+            client.close()
+
+        self.assertEqual(len(repos), 1000)
+        self.assertTrue(scheduler.retries > 0)
+
+    def test_should_scan_in_two_stages_with_parallel_node_lookups(self):
+        organization = MockOrganization(1000, coverage={'REL-1': 0.5}, up_to_date=0.2)
+        comparisons = [('master', 'REL-1')]
+        with MockGitHubServer(organization) as server:
+            client = self.new_client(server)
+            expected = client.get_repositories_for_branches(['master', 'REL-1'], comparisons)
+            client.close()
+        with MockGitHubServer(organization, latency=0.002) as server:
+            client = self.new_client(server, nodeBatchSize=40, scanConcurrency=4)
+            repos = client.get_repositories_for_branches(['master', 'REL-1'], comparisons)
+            client.close()
+
+        describe = lambda repos: [(repo.id, repo.name, repo.permission, {branch: ref.oid for (branch, ref) in repo.refs.items()},
+            {key: (comparison.status, comparison.ahead_by, comparison.behind_by) for (key, comparison) in repo.comparisons.items()}) for repo in repos]
+        self.assertEqual(describe(repos), describe(expected))
+        operations = server.stats()['operations']
+        self.assertEqual(operations['RepositoryIds'], 10)
+        self.assertEqual(operations['RepositoryNodes'], 25)
+        self.assertNotIn('RepositoriesForBranches', operations)
+        # the listing and up to four lookups share the pool
+        self.assertTrue(server.stats()['connections'] <= 4)
+        with self.assertRaises(ValueError):
+            GitHubClient(nodeBatchSize=101)
+
+    def test_should_refresh_the_cached_inventory_incrementally_and_forget_deleted_repositories(self):
+        organization = MockOrganization(1000, coverage={'REL-1': 0.5})
+        with tempfile.TemporaryDirectory() as directory, MockGitHubServer(organization) as server:
+            path = os.path.join(directory, 'inventory.sqlite3')
+            client = self.new_client(server, cache=RepositoryCache(path), scanConcurrency=4)
+            first = client.get_repositories_for_branches(['master', 'REL-1'])
+            client.close()
+            full_listing = server.stats()['operations']['RepositoryInventory']
+
+            # one repository is renamed and another deleted while their ids are cached
+            organization.touch('R_00010')
+            organization.repositories[10]['name'] = 'renamed'
+            organization.delete('R_00020')
+            client = self.new_client(server, cache=RepositoryCache(path), scanConcurrency=4)
+            second = client.get_repositories_for_branches(['master', 'REL-1'])
+            inventory = client.cache.repositories('mock-org')
+            client.close()
+
+        self.assertEqual(len(first), 1000)
+        self.assertEqual(full_listing, 10)
+        # the refresh stops at the watermark on the first page instead of listing all ten again
+        self.assertEqual(server.stats()['operations']['RepositoryInventory'], full_listing + 1)
+        self.assertEqual(len(second), 999)
+        self.assertNotIn('repo-00020', second)
+        self.assertIn('renamed', second)
+        self.assertNotIn('R_00020', [repo.id for repo in inventory])
+        self.assertEqual(len(inventory), 999)
+
+    def test_should_fast_forward_instead_of_merging_where_possible(self):
+        organization = MockOrganization(200, coverage={'REL-1': 0.5, 'REL-2': 0.5}, up_to_date=0.2, conflicts=0.1, read_only=0.05)
+        ahead = lambda repo, branch: branch in repo['branches'] and repo['branches'][branch] != repo['branches']['master']
+        # master picks up a commit REL-1 doesn't have in one repository, so its branches have diverged
+        diverged = next(repo for repo in organization.repositories
+            if ahead(repo, 'REL-1') and ahead(repo, 'REL-2') and not repo['conflicts'] and repo['permission'] == 'WRITE')
+        organization.merge(diverged['id'], 'master', 'REL-2', 'unrelated')
+        expected = [repo['name'] for repo in organization.repositories
+            if ahead(repo, 'REL-1') and repo is not diverged and repo['permission'] == 'WRITE']
+
+        with MockGitHubServer(organization) as server:
+            client = self.new_client(server)
+            report = []
+            auto_merge('master', 'REL-1', '', client, batch_size=10, report=report, fast_forward=True)
+            client.close()
+
+        results = {repo.name: result for (result, repo) in report[0][2]}
+        fast_forwarded = [name for (name, result) in results.items() if isinstance(result, UpdateRefResponse)]
+        # conflicts don't matter to a fast-forward; only the diverged repository needed a merge commit
+        self.assertEqual(fast_forwarded, expected)
+        self.assertIsInstance(results[diverged['name']], MergeResponse)
+        for repo in organization.repositories:
+            if repo['name'] in fast_forwarded:
+                self.assertEqual(repo['branches']['master'], repo['branches']['REL-1'])
+        operations = server.stats()['operations']
+        self.assertEqual(operations['UpdateRefs'], (len(expected) + 9) // 10)
+        self.assertEqual(operations['MergeBranches'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
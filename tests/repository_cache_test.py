@@ -0,0 +1,70 @@
+import unittest
+import os
+import tempfile
+from github.cache import RepositoryCache
+from github.types import Repository
+
+class FakeClock:
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+class RepositoryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.clock = FakeClock()
+        self.cache = RepositoryCache(os.path.join(self.directory.name, 'inventory.sqlite3'), ttl=100, evict_after=1000, clock=self.clock.time)
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+    def test_should_require_full_listing_for_unknown_org(self):
+        self.assertIsNone(self.cache.watermark('org'))
+
+    def test_should_merge_incremental_changes_into_inventory(self):
+        self.cache.store('org', [
+            Repository('1', 'RepoA', 'WRITE', None, updated_at='2020-01-01T00:00:00Z'),
+            Repository('2', 'RepoB', 'WRITE', None, updated_at='2020-01-02T00:00:00Z')
+        ], '2020-01-02T00:00:00Z', replace=True)
+        self.cache.store('org', [
+            Repository('2', 'RepoB-renamed', 'ADMIN', None, updated_at='2020-01-03T00:00:00Z'),
+            Repository('3', 'RepoC', 'READ', None, updated_at='2020-01-03T00:00:00Z')
+        ], '2020-01-03T00:00:00Z')
+
+        repos = self.cache.repositories('org')
+
+        self.assertEqual(self.cache.watermark('org'), '2020-01-03T00:00:00Z')
+        self.assertEqual([(repo.id, repo.name, repo.permission) for repo in repos],
+            [('1', 'RepoA', 'WRITE'), ('2', 'RepoB-renamed', 'ADMIN'), ('3', 'RepoC', 'READ')])
+
+    def test_should_replace_inventory_on_full_listing(self):
+        self.cache.store('org', [Repository('1', 'Deleted', 'WRITE', None, updated_at='2020')], '2020', replace=True)
+        self.cache.store('org', [Repository('2', 'RepoB', 'WRITE', None, updated_at='2021')], '2021', replace=True)
+
+        self.assertEqual([repo.name for repo in self.cache.repositories('org')], ['RepoB'])
+
+    def test_should_expire_inventory_after_ttl(self):
+        self.cache.store('org', [], '2020', replace=True)
+        self.clock.now += 50
+        self.cache.store('org', [], '2021')
+        self.clock.now += 60
+
+        # incremental refreshes don't extend the ttl, so a full listing is due again
+        self.assertIsNone(self.cache.watermark('org'))
+
+    def test_should_evict_unused_organizations(self):
+        self.cache.store('org', [Repository('1', 'RepoA', 'WRITE', None, updated_at='2020')], '2020', replace=True)
+        self.clock.now += 2000
+
+        self.cache.evict()
+
+        self.assertEqual(self.cache.repositories('org'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from github.scheduler import RequestScheduler
+from github.types import GitHubError, GitHubHttpError
+
+class FakeClock:
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class RequestSchedulerTest(unittest.TestCase):
+
+    def new_scheduler(self, clock: FakeClock, **kwargs) -> RequestScheduler:
+        return RequestScheduler(sleep=clock.sleep, clock=clock.time, jitter=lambda: 1.0, **kwargs)
+
+    def test_should_retry_transient_failures_with_exponential_backoff(self):
+        clock = FakeClock()
+        scheduler = self.new_scheduler(clock, backoff=1.0)
+        outcomes = [GitHubHttpError(502, 'Bad Gateway'), GitHubHttpError(503, 'Service Unavailable'), 'ok']
+
+        def send():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.assertEqual(scheduler.execute(send), 'ok')
+        self.assertEqual(clock.sleeps, [1.0, 2.0])
+        self.assertEqual(scheduler.retries, 2)
+        self.assertEqual(scheduler.throttled_seconds, 3.0)
+
+    def test_should_honour_retry_after_on_secondary_rate_limit(self):
+        clock = FakeClock()
+        scheduler = self.new_scheduler(clock)
+        outcomes = [GitHubHttpError(403, 'Forbidden', retry_after=30), 'ok']
+
+        def send():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.assertEqual(scheduler.execute(send), 'ok')
+        self.assertEqual(clock.sleeps, [30.0])
+
+    def test_should_not_retry_permanent_failures(self):
+        clock = FakeClock()
+        scheduler = self.new_scheduler(clock)
+
+        def send():
+            raise GitHubError('UNPROCESSABLE', 'Merge conflict')
+
+        with self.assertRaises(GitHubError):
+            scheduler.execute(send)
+        self.assertEqual(clock.sleeps, [])
+
+    def test_should_give_up_after_max_retries(self):
+        clock = FakeClock()
+        scheduler = self.new_scheduler(clock, max_retries=2)
+        calls = 0
+
+        def send():
+            nonlocal calls
+            calls += 1
+            raise GitHubHttpError(502, 'Bad Gateway')
+
+        with self.assertRaises(GitHubHttpError):
+            scheduler.execute(send)
+        self.assertEqual(calls, 3)
+
+    def test_should_pace_requests_when_budget_runs_low(self):
+        clock = FakeClock()
+        scheduler = self.new_scheduler(clock, reserve=100)
+        scheduler.record_headers({'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': str(clock.now + 100)})
+
+        for _ in range(3):
+            scheduler.execute(lambda: None)
+
+        self.assertEqual(clock.sleeps, [10.0, 10.0])
+
+    def test_should_wait_for_reset_when_budget_is_spent(self):
+        clock = FakeClock()
+        scheduler = self.new_scheduler(clock)
+        scheduler.record_rate_limit({'cost': 1, 'remaining': 0, 'resetAt': '1970-01-01T00:20:00Z'})
+
+        scheduler.execute(lambda: None)
+
+        self.assertEqual(clock.now, 1200.0)
+        self.assertEqual(scheduler.cost, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import gzip
+import io
+import json
+import zlib
+from github.decoding import EdgeDecoder, ResponseBody, decompress
+from github.types import Repository
+
+class Response:
+    # the part of http.client.HTTPResponse that ResponseBody reads
+
+    def __init__(self, body: bytes, encoding: str = None):
+        self.body = io.BytesIO(body)
+        self.encoding = encoding
+
+    def read(self, amt: int = None) -> bytes:
+        return self.body.read(amt)
+
+    def getheader(self, name: str, default: str = None) -> str:
+        return self.encoding if name == 'Content-Encoding' and self.encoding else default
+
+def page(names: [str]) -> bytes:
+    data = {'data': {
+        'organization': {'repositories': {
+            'pageInfo': {'hasNextPage': False, 'endCursor': 'cursor'},
+            'edges': [{'node': {'id': 'id-' + name, 'name': name, 'viewerPermission': 'WRITE', 'ref0': None}} for name in names]
+        }},
+        'rateLimit': {'cost': 1, 'remaining': 4999, 'resetAt': '2020-01-01T00:00:00Z'}
+    }}
+    return json.dumps(data, ensure_ascii=False).encode()
+
+class ResponseDecodingTest(unittest.TestCase):
+
+    def test_should_decompress_gzip_and_both_kinds_of_deflate(self):
+        body = page(['RepoA']) * 50
+        raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+
+        self.assertEqual(decompress(gzip.compress(body), 'gzip'), body)
+        self.assertEqual(decompress(zlib.compress(body), 'deflate'), body)
+        self.assertEqual(decompress(raw.compress(body) + raw.flush(), 'deflate'), body)
+        self.assertEqual(decompress(body, None), body)
+        with self.assertRaises(ValueError):
+            decompress(body, 'br')
+
+    def test_should_read_compressed_bodies_in_chunks_and_count_wire_bytes(self):
+        body = page(['Repo{}'.format(i) for i in range(100)])
+        compressed = gzip.compress(body)
+
+        content = ResponseBody(Response(compressed, 'gzip'), chunk_size=100)
+
+        self.assertEqual(content.read(), body)
+        self.assertEqual(content.wire_bytes, len(compressed))
+
+    def test_should_create_items_as_the_page_arrives(self):
+        names = ['RepoA', 'Répo-ü', 'RepoC']
+        body = page(names)
+        created = []
+        decoder = EdgeDecoder(lambda edge: created.append(edge['node']['name']) or Repository.create_from_node(edge['node'], ['master']))
+
+        # one byte at a time, splitting every multi-byte character
+        for i in range(len(body)):
+            decoder.feed(body[i:i + 1])
+            if i == body.index(b'RepoC'):
+                self.assertEqual(created, names[:2])
+        response = decoder.close()
+
+        self.assertEqual(created, names)
+        repositories = response['data']['organization']['repositories']
+        self.assertEqual([repo.name for repo in repositories['edges']], names)
+        self.assertEqual(repositories['pageInfo']['endCursor'], 'cursor')
+        self.assertEqual(response['data']['rateLimit']['cost'], 1)
+
+    def test_should_drop_items_create_returns_none_for(self):
+        body = json.dumps({'data': {'nodes': [{'name': 'RepoA'}, None, {'name': 'RepoC'}]}}).encode()
+        decoder = EdgeDecoder(lambda node: node['name'] if node else None, 'nodes')
+        decoder.feed(body)
+
+        self.assertEqual(decoder.close(), {'data': {'nodes': ['RepoA', 'RepoC']}})
+
+    def test_should_decode_responses_without_a_page_whole(self):
+        errors = {'data': {'organization': None}, 'errors': [{'type': 'NOT_FOUND', 'message': 'Could not resolve to an Organization'}]}
+        decoder = EdgeDecoder(lambda edge: edge)
+        decoder.feed(json.dumps(errors).encode())
+
+        self.assertEqual(decoder.close(), errors)
+
+    def test_should_reject_a_page_cut_off_mid_array(self):
+        body = page(['RepoA', 'RepoB'])
+        decoder = EdgeDecoder(lambda edge: edge)
+        decoder.feed(body[:body.index(b'RepoB')])
+
+        with self.assertRaises(ValueError):
+            decoder.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import Mock
+from automerge.journal import RunJournal
+from automerge.utilities import auto_merge
+from github.client import GitHubClient
+from github.types import MergeResponse, GitHubError, Comparison, UpdateRefResponse
+from tests.fixtures import new_repository
+
+class RunJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'journal.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_should_round_trip_plan_and_outcomes(self):
+        repo = new_repository('RepoA', ['release', 'master'])
+        repo.comparisons[('master', 'release')] = Comparison(2, 0, 'AHEAD')
+        journal = RunJournal(self.path)
+        journal.record_plan('master', 'release', '', 1, [repo])
+        journal.record_result('master', 'release', repo, 'succeeded', MergeResponse('abc', 'https://github.com/org/RepoA/commit/abc', 'merged'))
+        journal.record_result('current', 'master', repo, 'succeeded', UpdateRefResponse('def', 'https://github.com/org/RepoA/commit/def'))
+        journal.close()
+
+        journal = RunJournal(self.path, resume=True)
+        (head_count, (restored,)) = journal.plan('master', 'release')
+        self.assertEqual(head_count, 1)
+        self.assertEqual((restored.id, restored.name, restored.permission), ('id-RepoA', 'RepoA', 'WRITE'))
+        self.assertEqual(restored.refs['master'].oid, 'oid-RepoA-master')
+        self.assertEqual(restored.comparisons[('master', 'release')].ahead_by, 2)
+        self.assertEqual(journal.result('master', 'release', restored).commit_hash, 'abc')
+        self.assertIsInstance(journal.result('current', 'master', restored), UpdateRefResponse)
+        journal.close()
+
+    def test_should_retry_failures_and_ignore_a_torn_last_line(self):
+        repos = [new_repository(name, ['release', 'master']) for name in ('RepoA', 'RepoB')]
+        journal = RunJournal(self.path)
+        journal.record_plan('master', 'release', '', 2, repos)
+        journal.record_result('master', 'release', repos[0], 'unprocessed', GitHubError('UNPROCESSABLE', 'Already merged'))
+        journal.record_result('master', 'release', repos[1], 'failed', GitHubError('CONFLICT', 'Merge conflict'))
+        journal.close()
+        with open(self.path, 'a') as file:
+            file.write('{"type":"outcome","base":"mas')
+
+        journal = RunJournal(self.path, resume=True)
+        self.assertEqual(journal.result('master', 'release', repos[0]).message, 'Already merged')
+        self.assertIsNone(journal.result('master', 'release', repos[1]))
+        journal.close()
+
+    def test_should_refuse_a_journal_for_other_branches(self):
+        journal = RunJournal(self.path)
+        journal.record_plan('master', 'release', '', 1, [new_repository('RepoA', ['release', 'master'])])
+        journal.close()
+
+        journal = RunJournal(self.path, resume=True)
+        with self.assertRaises(Exception):
+            journal.plan('master', 'other')
+        journal.close()
+
+    def test_should_start_over_without_resume(self):
+        journal = RunJournal(self.path)
+        journal.record_plan('master', 'release', '', 1, [new_repository('RepoA', ['release', 'master'])])
+        journal.close()
+
+        journal = RunJournal(self.path)
+        self.assertIsNone(journal.plan('master', 'release'))
+        journal.close()
+
+    def test_should_resume_both_phases_without_remerging(self):
+        repos = [new_repository(name, ['release', 'master', 'rel-2']) for name in ('RepoA', 'RepoB', 'RepoC')]
+        merged = MergeResponse('abc', 'https://github.com/org/repo/commit/abc', 'merged')
+
+        def merge_branch(repo, base, head, message):
+            if (repo.name, base) == ('RepoB', 'master'):
+                raise KeyboardInterrupt()
+            return merged
+
+        # the first run dies merging RepoB into master
+        client = GitHubClient('', '')
+        client.iter_repositories_for_branches = Mock(return_value=repos)
+        client.merge_branch = Mock(side_effect=merge_branch)
+        journal = RunJournal(self.path)
+        with self.assertRaises(KeyboardInterrupt):
+            auto_merge('master', 'release', 'rel-2', client, journal=journal)
+        journal.close()
+
+        client = GitHubClient('', '')
+        client.iter_repositories_for_branches = Mock(return_value=[new_repository(repo.name, ['release', 'master', 'rel-2']) for repo in repos])
+        client.merge_branch = Mock(return_value=merged)
+        journal = RunJournal(self.path, resume=True)
+        finished = {(repo.name, base) for repo in repos for (base, head) in (('master', 'release'), ('rel-2', 'master'))
+            if journal.result(base, head, repo)}
+        results = auto_merge('master', 'release', 'rel-2', client, journal=journal)
+        journal.close()
+
+        # merges the first run journaled are not sent again; everything else is
+        merges = [(call.args[0].name, call.args[1]) for call in client.merge_branch.call_args_list]
+        self.assertIn(('RepoA', 'master'), finished)
+        self.assertEqual(len(merges), len(set(merges)))
+        self.assertEqual(finished.union(merges), {(name, base) for name in ('RepoA', 'RepoB', 'RepoC') for base in ('master', 'rel-2')})
+        self.assertFalse(finished.intersection(merges))
+
+        self.assertEqual([repo.name for repo in results[0][0]], ['RepoA', 'RepoB', 'RepoC'])
+        self.assertEqual([repo.name for repo in results[1][0]], ['RepoA', 'RepoB', 'RepoC'])
+
+        # resuming a finished run neither scans nor merges
+        client.iter_repositories_for_branches.reset_mock()
+        client.merge_branch.reset_mock()
+        journal = RunJournal(self.path, resume=True)
+        auto_merge('master', 'release', 'rel-2', client, journal=journal)
+        journal.close()
+        client.iter_repositories_for_branches.assert_not_called()
+        client.merge_branch.assert_not_called()
+
+    def test_should_keep_outcomes_when_the_scan_did_not_finish(self):
+        (repoA, repoB) = [new_repository(name, ['release', 'master']) for name in ('RepoA', 'RepoB')]
+        journal = RunJournal(self.path)
+        journal.start_plan('master', 'release', '')
+        journal.record_repository(repoA)
+        journal.record_result('master', 'release', repoA, 'succeeded', MergeResponse('abc', 'url', 'merged'))
+        journal.close()
+
+        journal = RunJournal(self.path, resume=True)
+        self.assertIsNone(journal.plan('master', 'release'))
+        journal.start_plan('master', 'release', '')
+        self.assertEqual(journal.result('master', 'release', repoA).commit_hash, 'abc')
+        self.assertIsNone(journal.result('master', 'release', repoB))
+        journal.close()
+
+if __name__ == '__main__':
+    unittest.main()
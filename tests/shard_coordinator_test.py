@@ -0,0 +1,135 @@
+import unittest
+import multiprocessing
+import os
+import tempfile
+import time
+from unittest.mock import Mock
+from tests.mock_github_server import MockGitHubServer, MockOrganization
+from automerge.shards import ShardCoordinator, ShardedRun, shard_of, work_shards
+from automerge.utilities import auto_merge, plan_merge
+from github.client import GitHubClient
+from github.types import MergeResponse, Ref, Repository
+
+def work(path: str, url: str, token: str) -> list:
+    # runs in a worker process of its own, with a token of its own
+    coordinator = ShardCoordinator(path, lease_seconds=1.0)
+    client = GitHubClient(token, 'mock-org', GitHubClient.create_pool(2, url))
+    try:
+        return work_shards(coordinator, client, token, batch_size=5, concurrency=2, poll=0.1)
+    finally:
+        client.close()
+        coordinator.close()
+
+class ShardCoordinatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'run.sqlite3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def new_organization(self) -> MockOrganization:
+        return MockOrganization(300, coverage={'REL-1': 0.6, 'REL-2': 0.5}, up_to_date=0.2, conflicts=0.1, read_only=0.05)
+
+    def test_should_merge_shards_in_worker_processes_and_combine_their_results(self):
+        with MockGitHubServer(self.new_organization()) as server:
+            client = GitHubClient('token', 'mock-org', GitHubClient.create_pool(2, server.url))
+            expected = auto_merge('master', 'REL-1', 'REL-2', client, batch_size=5, report=[])
+            client.close()
+
+        organization = self.new_organization()
+        with MockGitHubServer(organization) as server:
+            client = GitHubClient('coordinator-token', 'mock-org', GitHubClient.create_pool(2, server.url))
+            (_, repositories) = plan_merge('master', 'REL-1', 'REL-2', client)
+            client.close()
+            coordinator = ShardCoordinator(self.path, lease_seconds=1.0)
+            coordinator.create(ShardedRun('mock-org', 'master', 'REL-1', 'REL-2', 6), repositories)
+            # a worker that takes a shard and dies before merging it
+            (abandoned, _) = coordinator.acquire('crashed-worker')
+
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(3) as pool:
+                finished = pool.starmap(work, [(self.path, server.url, 'token-{}'.format(i)) for i in range(3)])
+            tokens = server.stats()['tokens']
+
+            report = []
+            results = coordinator.results(report)
+            coordinator.close()
+
+        describe = lambda results: [[sorted(repo.name for repo in repos) for repos in phase] for phase in results]
+        self.assertTrue(all(results[0]) and results[1][0])
+        self.assertEqual(describe(results), describe(expected))
+        self.assertEqual([(base, head) for (base, head, *_) in report], [('master', 'REL-1'), ('REL-2', 'master')])
+        # every shard was merged exactly once, the abandoned one by whoever found its lease expired
+        self.assertEqual(sorted(shard for shards in finished for shard in shards), list(range(6)))
+        self.assertIn(abandoned, [shard for shards in finished for shard in shards])
+        self.assertEqual(set(tokens), {'coordinator-token', 'token-0', 'token-1', 'token-2'})
+        merged = set(repo.name for repo in results[0][0])
+        for repo in organization.repositories:
+            if repo['name'] in merged:
+                self.assertTrue(organization.commits[repo['branches']['REL-1']] <= organization.commits[repo['branches']['master']])
+
+    def test_should_hand_each_shard_to_one_worker_at_a_time(self):
+        now = [1000.0]
+        coordinator = ShardCoordinator(self.path, lease_seconds=10, clock=lambda: now[0])
+        repositories = [Repository('R_{}'.format(i), 'repo-{}'.format(i), 'WRITE', None) for i in range(20)]
+        run = ShardedRun('mock-org', 'master', 'REL-1', '', 3)
+        coordinator.create(run, repositories)
+
+        self.assertEqual(shard_of('R_7', 3), shard_of('R_7', 3))
+        (first, firstRepos) = coordinator.acquire('a')
+        self.assertTrue(all(shard_of(repo.id, 3) == first for repo in firstRepos))
+        (second, _) = coordinator.acquire('b')
+        (third, _) = coordinator.acquire('c')
+        self.assertEqual(sorted([first, second, third]), [0, 1, 2])
+        self.assertIsNone(coordinator.acquire('d'))
+
+        # a renewed lease survives, an expired one goes to the next worker and its old holder can't report
+        now[0] += 8
+        self.assertTrue(coordinator.renew(first, 'a'))
+        now[0] += 5
+        (taken, _) = coordinator.acquire('d')
+        self.assertIn(taken, [second, third])
+        holder = 'b' if taken == second else 'c'
+        self.assertFalse(coordinator.renew(taken, holder))
+        self.assertFalse(coordinator.complete(taken, holder, []))
+        self.assertTrue(coordinator.complete(taken, 'd', [], Exception('Bad credentials')))
+        self.assertEqual(coordinator.progress(), {'leased': 2, 'failed': 1})
+        self.assertEqual(coordinator.retry_failed(), 1)
+        self.assertEqual(coordinator.unfinished(), 3)
+
+        with self.assertRaises(Exception):
+            coordinator.create(run, repositories)
+        with self.assertRaises(Exception):
+            coordinator.results([])
+        coordinator.close()
+
+    def test_should_stop_merging_and_drop_a_shard_whose_lease_was_lost(self):
+        now = [1000.0]
+        coordinator = ShardCoordinator(self.path, lease_seconds=0.3, clock=lambda: now[0])
+        refs = {'master': Ref('', 'master', 'm', None), 'REL-1': Ref('', 'REL-1', 'r', None)}
+        repositories = [Repository('R_{}'.format(i), 'repo-{}'.format(i), 'WRITE', None, dict(refs)) for i in range(3)]
+        coordinator.create(ShardedRun('mock-org', 'master', 'REL-1', '', 1), repositories)
+
+        def merge_branch(repo, base, head, message):
+            # the worker stalls until its lease runs out and another worker takes the shard
+            now[0] += 10
+            (shard, _) = coordinator.acquire('other')
+            time.sleep(0.5)
+            coordinator.complete(shard, 'other', [])
+            return MergeResponse('', 'url', 'merged')
+
+        client = GitHubClient('', 'mock-org')
+        client.merge_branch = Mock(side_effect=merge_branch)
+
+        finished = work_shards(coordinator, client, 'worker', poll=0.01)
+
+        self.assertEqual(finished, [])
+        self.assertEqual(client.merge_branch.call_count, 1)
+        self.assertEqual(coordinator.progress(), {'done': 1})
+        coordinator.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import json
+import os
+import tempfile
+from github.client import GitHubClient
+from github.tracing import Tracer
+from tests.github_client_test import FakePool, repositories_page, repository_node
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class TracerTest(unittest.TestCase):
+
+    def test_should_nest_spans_and_record_attributes(self):
+        clock = FakeClock()
+        tracer = Tracer(clock)
+        with tracer.span('scan', branches=['REL-1']) as span:
+            clock.now = 1.0
+            with tracer.span('page'):
+                clock.now = 1.5
+            span.update(head_matches=3)
+            clock.now = 2.0
+
+        (page, scan) = tracer.spans
+        self.assertEqual((page['name'], page['parent'], page['duration']), ('page', 'scan', 0.5))
+        self.assertEqual((scan['name'], scan['parent'], scan['duration']), ('scan', None, 2.0))
+        self.assertEqual(scan['attributes'], {'branches': ['REL-1'], 'head_matches': 3})
+
+    def test_should_export_chrome_trace_events(self):
+        clock = FakeClock()
+        tracer = Tracer(clock)
+        with tracer.span('merge_base'):
+            clock.now = 0.25
+            tracer.record_request('MergeBranch', 200, 0.25, 512, 0.001, 1)
+
+        events = tracer.to_trace()['traceEvents']
+        self.assertEqual([event['name'] for event in events], ['merge_base', 'MergeBranch'])
+        self.assertEqual(events[1]['dur'], 250000.0)
+        self.assertEqual(events[1]['args']['bytes'], 512)
+
+    def test_should_aggregate_prometheus_metrics_per_operation(self):
+        tracer = Tracer(FakeClock())
+        tracer.record_request('RepositoriesForBranches', 200, 0.5, 1000, 0.01, 1)
+        tracer.record_request('RepositoriesForBranches', 200, 0.25, 500, 0.01, 1)
+        tracer.record_request('MergeBranches', 502, 0.1, 20, 0.0)
+        tracer.increment('merges_total', 3, base='master', outcome='succeeded')
+
+        metrics = tracer.to_prometheus()
+        self.assertIn('# TYPE automerge_graphql_request_duration_seconds summary', metrics)
+        self.assertIn('automerge_graphql_request_duration_seconds_sum{operation="RepositoriesForBranches"} 0.75', metrics)
+        self.assertIn('automerge_graphql_request_duration_seconds_count{operation="RepositoriesForBranches"} 2', metrics)
+        self.assertIn('automerge_graphql_response_bytes_total{operation="RepositoriesForBranches"} 1500', metrics)
+        self.assertIn('automerge_graphql_cost_total{operation="MergeBranches"} 0', metrics)
+        self.assertIn('automerge_merges_total{base="master",outcome="succeeded"} 3', metrics)
+
+    def test_should_write_trace_and_textfile(self):
+        tracer = Tracer()
+        with tracer.span('scan'):
+            pass
+
+        with tempfile.TemporaryDirectory() as directory:
+            prefix = os.path.join(directory, 'run')
+            tracer.write(prefix)
+            with open(prefix + '.json') as trace:
+                self.assertEqual(json.load(trace)['traceEvents'][0]['name'], 'scan')
+            with open(prefix + '.prom') as textfile:
+                self.assertIn('automerge_phase_duration_seconds{phase="scan"}', textfile.read())
+            self.assertEqual(sorted(os.listdir(directory)), ['run.json', 'run.prom'])
+
+    def test_client_should_record_each_request(self):
+        page = repositories_page([repository_node('RepoA', {'ref0': 'a-head'})])
+        page['data']['rateLimit'] = {'cost': 1, 'remaining': 4999, 'resetAt': '2030-01-01T00:00:00Z'}
+        client = GitHubClient('token', 'org', FakePool([page]))
+
+        client.get_repositories_for_branches(['REL-1'])
+
+        (request,) = client.tracer.requests
+        self.assertEqual(request['operation'], 'RepositoriesForBranches')
+        self.assertEqual(request['status'], 200)
+        self.assertEqual(request['bytes'], len(json.dumps(page)))
+        self.assertEqual(request['cost'], 1)
+
+if __name__ == '__main__':
+    unittest.main()